@@ -0,0 +1,346 @@
+"""Аналитика чтения на NumPy.
+
+Сессии чтения загружаются одним запросом в колонки NumPy (книга, день,
+час, страницы, минуты, жанр книги), сортируются по времени и хранятся
+в памяти процесса. Кэш сверяется со счетчиком data_versions['reading'],
+который события сессии увеличивают при любом изменении книг и сессий,
+так что запрос к базе при попадании в кэш один - за номером версии.
+Серии, скорость чтения, темп по жанрам и прогнозы дальше считаются
+векторными операциями над колонками.
+
+NumPy - необязательная зависимость: без него available() возвращает False
+и раздел аналитики не показывается.
+"""
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session, attributes
+
+from models import db, Book, DataVersion, ReadingGoal, ReadingSession
+from goals import compute_progress, GOAL_TYPES
+from storage import read_connection
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+VERSION_NAME = 'reading'
+
+# Поля, от которых зависит аналитика; изменения остальных кэш не сбрасывают
+TRACKED_FIELDS = {
+    Book: ('genre', 'title', 'reading_status', 'page_count', 'current_page'),
+    ReadingSession: ('book_id', 'start_time', 'pages_read', 'duration_minutes'),
+}
+
+# Окно в днях, по которому считается текущая скорость для прогнозов
+PACE_WINDOW = 30
+# Границы корзин распределения скорости, страниц в час; последняя корзина открыта
+SPEED_BINS = (0, 10, 20, 30, 40, 50, 60, 80, 100, 150)
+FORECAST_LIMIT = 20
+
+EPOCH = date(1970, 1, 1)
+
+_BUMP = text('INSERT INTO data_versions (name, version) VALUES (:name, 1) '
+             'ON CONFLICT (name) DO UPDATE SET version = version + 1')
+
+_SESSION_DTYPE = [('book', 'i4'), ('time', 'i8'), ('pages', 'i4'), ('minutes', 'i4')]
+
+
+def available():
+    return np is not None
+
+
+def bump_version(connection, name=VERSION_NAME):
+    """Отмечает изменение данных; вызывается внутри транзакции изменения"""
+    connection.execute(_BUMP, {'name': name})
+
+
+def current_version(name=VERSION_NAME):
+    return db.session.execute(select(DataVersion.version).where(DataVersion.name == name)).scalar() or 0
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    changed = any(type(obj) in TRACKED_FIELDS for obj in session.new) \
+        or any(type(obj) in TRACKED_FIELDS for obj in session.deleted) \
+        or any(type(obj) in TRACKED_FIELDS
+               and any(attributes.get_history(obj, field).has_changes() for field in TRACKED_FIELDS[type(obj)])
+               for obj in session.dirty)
+    if changed:
+        bump_version(session.connection())
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in TRACKED_FIELDS:
+        return
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        bump_version(orm_execute_state.session.connection())
+
+
+def _day_number(day):
+    return (day - EPOCH).days
+
+
+def _date(number):
+    return (EPOCH + timedelta(days=int(number))).isoformat()
+
+
+class ReadingData:
+    """Колонки сессий, отсортированные по времени, и справочник книг"""
+
+    def __init__(self, version):
+        self.version = version
+        self.results = None
+
+    @classmethod
+    def load(cls, connection, version):
+        data = cls(version)
+        count = connection.execute(text('SELECT count(*) FROM reading_sessions')).scalar()
+        # Время хранится в UTC; дни считаются по UTC, как в сводке rollups.py,
+        # поэтому и сегодняшний день в reading_analytics берется по UTC
+        result = connection.exec_driver_sql(
+            "SELECT book_id, CAST(strftime('%s', start_time) AS INTEGER), pages_read, "
+            "coalesce(duration_minutes, 0) FROM reading_sessions"
+        )
+        rows = np.fromiter(result.cursor, dtype=_SESSION_DTYPE, count=count)
+        result.close()
+        # Строки приходят почти по порядку времени, устойчивая сортировка на этом быстрая
+        rows = rows[np.argsort(rows['time'], kind='stable')]
+
+        data.book = np.ascontiguousarray(rows['book'])
+        data.day = (rows['time'] // 86400).astype(np.int32)
+        data.hour = (rows['time'] % 86400 // 3600).astype(np.int8)
+        data.pages = np.ascontiguousarray(rows['pages'])
+        data.minutes = np.ascontiguousarray(rows['minutes'])
+
+        books = connection.execute(select(Book.id, Book.genre)).all()
+        codes = {}
+        ids = np.fromiter((book_id for book_id, _ in books), dtype=np.int64, count=len(books))
+        genres = np.fromiter((codes.setdefault(genre or None, len(codes)) for _, genre in books),
+                             dtype=np.int32, count=len(books))
+        size = max(int(ids.max()) + 1 if ids.size else 0, int(data.book.max()) + 1 if data.book.size else 0)
+        # id книги -> код жанра; у сессий удаленных книг код -1
+        data.book_genre = np.full(size, -1, dtype=np.int32)
+        data.book_genre[ids] = genres
+        data.genre = data.book_genre[data.book]
+        data.genre_codes = codes
+        data.genre_names = list(codes)
+
+        data.reading = connection.execute(
+            select(Book.id, Book.title, Book.page_count, Book.current_page)
+            .where(Book.reading_status == 'читаю')
+        ).all()
+        return data
+
+    @property
+    def sessions(self):
+        return int(self.day.size)
+
+    def since(self, day_number):
+        """Номер первой сессии не раньше дня day_number (колонки отсортированы)"""
+        return int(np.searchsorted(self.day, day_number))
+
+
+_cache = {'data': None}
+_lock = threading.Lock()
+
+
+def reading_data():
+    """Колонки текущей версии; перечитываются, только если версия сменилась"""
+    version = current_version()
+    data = _cache['data']
+    if data is not None and data.version == version:
+        return data
+    with _lock:
+        data = _cache['data']
+        if data is None or data.version != version:
+            data = _cache['data'] = ReadingData.load(read_connection(db.session), version)
+    return data
+
+
+def clear_cache():
+    with _lock:
+        _cache['data'] = None
+
+
+def streaks(data, today):
+    """Самая длинная и текущая серии дней подряд с чтением"""
+    if not data.sessions:
+        return {'longest': 0, 'longest_start': None, 'longest_end': None, 'current': 0, 'active_days': 0}
+    days = data.day[np.concatenate(([True], data.day[1:] != data.day[:-1]))]
+    breaks = np.flatnonzero(np.diff(days) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [days.size - 1]))
+    lengths = ends - starts + 1
+    best = int(np.argmax(lengths))
+    # Серия не прервана, если последний день чтения - сегодня или вчера
+    current = int(lengths[-1]) if days[-1] >= _day_number(today) - 1 else 0
+    return {
+        'longest': int(lengths[best]),
+        'longest_start': _date(days[starts[best]]),
+        'longest_end': _date(days[ends[best]]),
+        'current': current,
+        'active_days': int(days.size),
+    }
+
+
+def reading_speed(data):
+    """Распределение скорости по сессиям с длительностью и средняя скорость по часам суток"""
+    timed = data.minutes > 0
+    pages = data.pages[timed]
+    minutes = data.minutes[timed]
+    if not pages.size:
+        return None
+    speed = pages * 60.0 / minutes
+    # searchsorted по верхним границам быстрее np.histogram с неравными корзинами
+    counts = np.bincount(np.searchsorted(SPEED_BINS[1:], speed, side='right'), minlength=len(SPEED_BINS))
+    quartile, median, upper, top = np.percentile(speed, (25, 50, 75, 90))
+
+    hours = data.hour[timed]
+    hour_pages = np.bincount(hours, weights=pages, minlength=24)
+    hour_minutes = np.bincount(hours, weights=minutes, minlength=24)
+    by_hour = np.divide(hour_pages * 60, hour_minutes, out=np.zeros(24), where=hour_minutes > 0)
+
+    labels = [f'{low}–{high}' for low, high in zip(SPEED_BINS, SPEED_BINS[1:])] + [f'{SPEED_BINS[-1]}+']
+    return {
+        'sessions': int(pages.size),
+        'average': round(float(pages.sum()) * 60 / float(minutes.sum()), 1),
+        'percentiles': {'p25': round(float(quartile), 1), 'p50': round(float(median), 1),
+                        'p75': round(float(upper), 1), 'p90': round(float(top), 1)},
+        'histogram': {'labels': labels, 'counts': counts.tolist()},
+        'by_hour': [round(float(value), 1) for value in by_hour],
+    }
+
+
+def genre_pace(data):
+    """Скорость чтения по жанрам: страниц в час по сессиям с длительностью"""
+    timed = (data.minutes > 0) & (data.genre >= 0)
+    codes = data.genre[timed]
+    size = len(data.genre_names)
+    pages = np.bincount(codes, weights=data.pages[timed], minlength=size)
+    minutes = np.bincount(codes, weights=data.minutes[timed], minlength=size)
+    sessions = np.bincount(codes, minlength=size)
+    pace = np.divide(pages * 60, minutes, out=np.zeros(size), where=minutes > 0)
+    rows = [{'genre': name, 'pages_per_hour': round(float(pace[code]), 1),
+             'pages': int(pages[code]), 'hours': round(float(minutes[code]) / 60, 1),
+             'sessions': int(sessions[code])}
+            for code, name in enumerate(data.genre_names) if sessions[code]]
+    return sorted(rows, key=lambda row: row['pages_per_hour'], reverse=True)
+
+
+def finish_forecast(data, today, limit=FORECAST_LIMIT):
+    """Прогноз окончания книг 'читаю' по скорости за последние PACE_WINDOW дней.
+
+    Если в окне сессий не было, берется средняя скорость с первой сессии книги.
+    """
+    books = [row for row in data.reading if row.page_count]
+    if not books:
+        return {'books': 0, 'items': []}
+    today_number = _day_number(today)
+    ids = np.array([row.id for row in books], dtype=np.int64)
+    position = np.full(data.book_genre.size, -1, dtype=np.int64)
+    position[ids] = np.arange(ids.size)
+
+    own = position[data.book] >= 0
+    index = position[data.book[own]]
+    days = data.day[own]
+    pages = data.pages[own]
+    total = np.bincount(index, weights=pages, minlength=ids.size)
+    window = days > today_number - PACE_WINDOW
+    recent = np.bincount(index[window], weights=pages[window], minlength=ids.size)
+    first = np.full(ids.size, today_number, dtype=np.int64)
+    # Сессии отсортированы по времени: первое вхождение книги - её первая сессия
+    found, first_index = np.unique(index, return_index=True)
+    first[found] = days[first_index]
+    # Книга, начатая позже начала окна, читается меньше PACE_WINDOW дней
+    elapsed = np.maximum(today_number - first + 1, 1)
+    rate = np.where(recent > 0, recent / np.minimum(PACE_WINDOW, elapsed), total / elapsed)
+
+    items = []
+    for row, pages_per_day in zip(books, rate.tolist()):
+        remaining = max(row.page_count - (row.current_page or 0), 0)
+        days_left = -(-remaining // pages_per_day) if pages_per_day > 0 else None
+        items.append({
+            'book_id': row.id,
+            'title': row.title,
+            'remaining_pages': remaining,
+            'pages_per_day': round(pages_per_day, 1),
+            'days_left': int(days_left) if days_left is not None else None,
+            'finish_date': (today + timedelta(days=int(days_left))).isoformat() if days_left is not None else None,
+        })
+    items.sort(key=lambda item: (item['days_left'] is None, item['days_left'] or 0))
+    return {'books': len(items), 'items': items[:limit]}
+
+
+def _period(goal):
+    if goal.month is None:
+        return date(goal.year, 1, 1), date(goal.year + 1, 1, 1)
+    start = date(goal.year, goal.month, 1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def goal_forecast(data, today):
+    """Прогноз целей, период которых идет сейчас: итог к концу периода при текущей скорости"""
+    goals = compute_progress(ReadingGoal.query.filter(ReadingGoal.year == today.year).order_by(
+        ReadingGoal.month, ReadingGoal.goal_type, ReadingGoal.genre).all())
+    today_number = _day_number(today)
+    forecasts = []
+    for goal in goals:
+        start, end = _period(goal)
+        if not start <= today < end:
+            continue
+        elapsed = (today - start).days + 1
+        days_left = (end - today).days - 1
+        if goal.goal_type == 'books':
+            rate = goal.current_progress / elapsed
+        else:
+            # Окно скорости не выходит за начало периода цели
+            first_day = max(_day_number(start), today_number - PACE_WINDOW + 1)
+            window = data.since(first_day)
+            values = data.pages[window:] if goal.goal_type == 'pages' else data.minutes[window:]
+            if goal.genre:
+                values = values[data.genre[window:] == data.genre_codes.get(goal.genre, -2)]
+            rate = float(values.sum()) / (today_number - first_day + 1)
+        projected = goal.current_progress + rate * days_left
+        remaining = max(goal.target - goal.current_progress, 0)
+        forecasts.append({
+            'id': goal.id,
+            'goal_type': goal.goal_type,
+            'unit': GOAL_TYPES[goal.goal_type],
+            'year': goal.year,
+            'month': goal.month,
+            'genre': goal.genre,
+            'target': goal.target,
+            'progress': goal.current_progress,
+            'projected': round(projected),
+            'on_track': projected >= goal.target,
+            'per_day': round(rate, 1),
+            'needed_per_day': round(remaining / days_left, 1) if days_left else float(remaining),
+            'days_left': days_left,
+        })
+    return forecasts
+
+
+def reading_analytics(today=None):
+    """Вся аналитика для /api/stats/analytics (раздел аналитики на /stats).
+
+    Расчеты по колонкам кэшируются вместе с версией данных на текущий день;
+    прогноз целей считается заново, цели в счетчик версии не входят.
+    """
+    today = today or datetime.utcnow().date()
+    data = reading_data()
+    cached = data.results
+    if cached is None or cached[0] != today:
+        cached = data.results = (today, {
+            'version': data.version,
+            'sessions': data.sessions,
+            'streaks': streaks(data, today),
+            'speed': reading_speed(data),
+            'genres': genre_pace(data),
+            'finish': finish_forecast(data, today),
+        })
+    return dict(cached[1], goals=goal_forecast(data, today))
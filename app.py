@@ -1,19 +1,106 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
-from models import db, Book, Author, ReadingSession, ReadingGoal
-from book_api import get_book_by_isbn
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context, abort, send_file
+from flask.cli import AppGroup
+from models import db, Book, Author, ReadingSession, ReadingGoal, Tag, StatRollup, EnrichmentJob, book_tags
+import book_api
+import storage
+from storage import retry_on_busy
+from book_api import get_book_by_isbn, cache_stats, prepare_isbns, iter_books_by_isbn
+from migrations import run_migrations
+from tags import parse_tags, set_book_tags, prune_unused_tags
+from bulk import run_bulk_operation, matching_ids, parse_ids
+from facets import facet_cache
+from pagination import keyset_paginate
+from search import search_books
+from exports import generate_csv, generate_json, generate_ndjson, parse_include, EXTRA_STREAMS
+from importer import import_file
+from dashboard import load_dashboard
+from book_progress import session_page, progress_series, MAX_POINTS
+from author_list import load_authors, books_page, AUTHOR_SORTS, AUTHORS_PER_PAGE, BOOKS_PER_PAGE
+from goals import compute_progress, GOAL_TYPES, MONTH_NAMES
+from datagen import generate_library, PRESETS
+from benchmark import run_benchmark, compare
+from query_plans import check_query_plans, PLAN_CHECKS
+import analytics
+from rollups import rollup_total, rollup_rows, rebuild_rollups, check_rollups, reading_activity, GRANULARITIES
+from instrumentation import instrumentation
+import covers
+from covers import cover_store, DIGEST_PATTERN
+from similar import similar_index, similar_books, is_queued
+import enrichment
+import duplicates
+from suggest import suggest_index, author_condition, FIELDS as SUGGEST_FIELDS, MAX_SUGGESTIONS
 from datetime import datetime, timedelta
 import json
-import csv
-import io
-from sqlalchemy import func, extract, and_
-from sqlalchemy.orm import joinedload
+import os
+import click
+from sqlalchemy import func, and_
 
-app = Flask(__name__)
+# Каталог instance (база, кэши ISBN и обложек) можно задать через LIBRARY_INSTANCE_PATH, например в тестах
+app = Flask(__name__, instance_path=os.environ.get('LIBRARY_INSTANCE_PATH'))
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///library.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
+# 'memory' или 'sqlite:///путь/к/facets.db' для общего кэша между воркерами
+app.config['FACET_CACHE_BACKEND'] = 'memory'
+# Размер пачки книг в одной транзакции при импорте
+app.config['IMPORT_BATCH_SIZE'] = 1000
+
+# Кэш метаданных ISBN: файл SQLite и время жизни записей в секундах
+app.config['ISBN_CACHE_PATH'] = os.path.join(app.instance_path, 'isbn_cache.db')
+app.config['ISBN_CACHE_HIT_TTL'] = 30 * 24 * 3600
+app.config['ISBN_CACHE_MISS_TTL'] = 24 * 3600
+app.config['ISBN_HTTP_TIMEOUT'] = (3.05, 10)
+app.config['OPENLIBRARY_URL'] = 'https://openlibrary.org'
+app.config['ISBN_BATCH_LIMIT'] = 100
+# Запросов в секунду на источник и потоки пакетного поиска. Холодный пакет из N ISBN
+# занимает не меньше N / ISBN_RATE_LIMITS['isbnlib'] секунд: с ключом API или своим
+# зеркалом Open Library лимиты можно поднять
+app.config['ISBN_RATE_LIMITS'] = {'isbnlib': 5.0, 'openlibrary': 10.0}
+app.config['ISBN_BATCH_WORKERS'] = 16
+
+# Профиль SQLite ('development' или 'production'), по умолчанию из LIBRARY_STORAGE_PROFILE
+app.config['STORAGE_PROFILE'] = os.environ.get('LIBRARY_STORAGE_PROFILE', 'production')
+
+# Метрики SQL по запросам: заголовок Server-Timing и /debug/metrics
+app.config['INSTRUMENTATION_ENABLED'] = True
+app.config['INSTRUMENTATION_SLOW_QUERIES'] = 3
+# Сколько одинаковых запросов за один HTTP-запрос считать признаком N+1
+app.config['INSTRUMENTATION_REPEAT_THRESHOLD'] = 5
+app.config['INSTRUMENTATION_BUFFER_SIZE'] = 200
+# /debug/metrics отдает текст SQL без авторизации: только в режиме отладки или с LIBRARY_DEBUG_METRICS=1
+app.config['DEBUG_METRICS_ENABLED'] = os.environ.get('LIBRARY_DEBUG_METRICS') == '1'
+
+# Локальный кэш обложек: файлы в instance/covers, уменьшенные копии по размерам
+app.config['COVERS_PATH'] = os.path.join(app.instance_path, 'covers')
+app.config['COVER_SIZES'] = {'list': (60, 90), 'detail': (300, 450)}
+app.config['COVER_WORKERS'] = 4
+
+# Обработчик дозаполнения метаданных: потоки и не больше задач в секунду
+app.config['ENRICHMENT_WORKERS'] = 4
+app.config['ENRICHMENT_RATE'] = 2.0
+
+# Похожие книги: соседей на книгу и пересчет очереди в фоне после изменений
+app.config['SIMILAR_BOOKS_K'] = 10
+app.config['SIMILAR_BOOKS_AUTO_UPDATE'] = True
+
+storage.configure(app)
 db.init_app(app)
+storage.init_app(app, db)
+facet_cache.init_app(app)
+instrumentation.init_app(app, db)
+cover_store.init_app(app)
+similar_index.init_app(app)
+suggest_index.init_app(app, db)
+
+os.makedirs(app.instance_path, exist_ok=True)
+book_api.configure(cache_path=app.config['ISBN_CACHE_PATH'],
+                   hit_ttl=app.config['ISBN_CACHE_HIT_TTL'],
+                   miss_ttl=app.config['ISBN_CACHE_MISS_TTL'],
+                   timeout=app.config['ISBN_HTTP_TIMEOUT'],
+                   openlibrary_url=app.config['OPENLIBRARY_URL'],
+                   rate_limits=app.config['ISBN_RATE_LIMITS'],
+                   batch_workers=app.config['ISBN_BATCH_WORKERS'],
+                   logger=app.logger)
 
 
 # Фильтры для Jinja2
@@ -24,6 +111,13 @@ def format_datetime(value, format='%d.%m.%Y %H:%M'):
     return value.strftime(format)
 
 
+@app.template_global()
+def cover_thumbnail(url, size):
+    """Локальный адрес обложки нужного размера или None, пока она не скачана"""
+    found = cover_store.thumbnail(url, size)
+    return url_for('cover_image', size=found[0], digest=found[1]) if found else None
+
+
 @app.template_filter('date')
 def format_date(value, format='%d.%m.%Y'):
     if value is None:
@@ -33,9 +127,11 @@ def format_date(value, format='%d.%m.%Y'):
 
 @app.template_filter('tags_list')
 def tags_list(value):
-    if value:
-        return [tag.strip() for tag in value.split(',')]
-    return []
+    if not value:
+        return []
+    if isinstance(value, str):
+        return parse_tags(value)
+    return [tag.name for tag in value]
 
 
 @app.context_processor
@@ -49,44 +145,33 @@ def utility_processor():
 # Главная страница
 @app.route('/')
 def index():
-    # Статистика для сводки
-    total_books = Book.query.count()
-    reading_books = Book.query.filter_by(reading_status='читаю').count()
-    completed_books = Book.query.filter_by(reading_status='прочитана').count()
-
-    # Последние добавленные книги
-    recent_books = Book.query.order_by(Book.date_added.desc()).limit(5).all()
+    return render_template('index.html', dashboard=load_dashboard())
 
-    # Текущие книги в чтении
-    current_reading = Book.query.filter_by(reading_status='читаю').all()
 
-    # Недавно прочитанные книги
-    recently_finished = Book.query.filter(
-        Book.reading_status == 'прочитана',
-        Book.date_finished_reading.isnot(None)
-    ).order_by(Book.date_finished_reading.desc()).limit(5).all()
+# Данные главной страницы для обновления виджетов без перезагрузки
+@app.route('/api/dashboard')
+def api_dashboard():
+    return jsonify(load_dashboard().to_dict())
 
-    return render_template('index.html',
-                           total_books=total_books,
-                           reading_books=reading_books,
-                           completed_books=completed_books,
-                           recent_books=recent_books,
-                           current_reading=current_reading,
-                           recently_finished=recently_finished)
 
+# Поля сортировки каталога
+SORT_MAPPING = {
+    'title': Book.title,
+    'author': Book.author,
+    'rating': Book.my_rating,
+    'date_added': Book.date_added,
+    'publication_year': Book.publication_year,
+    'page_count': Book.page_count
+}
 
-# Каталог книг
-@app.route('/books')
-def books():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
 
-    # Фильтры
-    status_filter = request.args.get('status')
-    genre_filter = request.args.get('genre')
-    author_filter = request.args.get('author')
-    tag_filter = request.args.get('tag')
-    rating_filter = request.args.get('rating')
+def filter_books(args):
+    """Запрос книг с фильтрами каталога из параметров запроса"""
+    status_filter = args.get('status')
+    genre_filter = args.get('genre')
+    author_filter = args.get('author')
+    tag_filter = args.get('tag')
+    rating_filter = args.get('rating')
 
     query = Book.query
 
@@ -95,81 +180,222 @@ def books():
     if genre_filter:
         query = query.filter(Book.genre == genre_filter)
     if author_filter:
-        query = query.filter(Book.author == author_filter)
+        # Поле автора - текст с подсказками: имя целиком или начало любого слова имени
+        query = query.filter(author_condition(author_filter))
     if tag_filter:
-        query = query.filter(Book.tags.contains(tag_filter))
+        query = query.join(book_tags, book_tags.c.book_id == Book.id) \
+            .join(Tag, Tag.id == book_tags.c.tag_id) \
+            .filter(Tag.name == tag_filter)
     if rating_filter:
         query = query.filter(Book.my_rating == rating_filter)
 
-    # Сортировка
-    sort_by = request.args.get('sort', 'date_added')
-    sort_order = request.args.get('order', 'desc')
-
-    sort_mapping = {
-        'title': Book.title,
-        'author': Book.author,
-        'rating': Book.my_rating,
-        'date_added': Book.date_added,
-        'publication_year': Book.publication_year,
-        'page_count': Book.page_count
+    return query
+
+
+def paginate_books(args, per_page=20, count=None):
+    """Курсорная страница каталога по параметрам запроса"""
+    sort_by = args.get('sort', 'date_added')
+    if sort_by not in SORT_MAPPING:
+        sort_by = 'date_added'
+    sort_order = 'asc' if args.get('order') == 'asc' else 'desc'
+
+    return keyset_paginate(filter_books(args),
+                           SORT_MAPPING[sort_by],
+                           Book.id,
+                           sort=f'{sort_by}:{sort_order}',
+                           descending=sort_order == 'desc',
+                           cursor=args.get('cursor'),
+                           per_page=per_page,
+                           count=args.get('count', count))
+
+
+def book_to_dict(book):
+    """Краткое представление книги для JSON API"""
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'genre': book.genre,
+        'reading_status': book.reading_status,
+        'my_rating': book.my_rating,
+        'publication_year': book.publication_year,
+        'page_count': book.page_count,
+        'cover_image_url': book.cover_image_url,
+        'date_added': book.date_added.isoformat() if book.date_added else None
     }
 
-    sort_field = sort_mapping.get(sort_by, Book.date_added)
 
-    if sort_order == 'asc':
-        query = query.order_by(sort_field.asc())
+# Каталог книг
+@app.route('/books')
+def books():
+    per_page = 20
+    pagination = None
+    keyset_page = None
+
+    if 'page' in request.args:
+        # Старые ссылки с номером страницы продолжают работать через OFFSET
+        page = request.args.get('page', 1, type=int)
+        query = filter_books(request.args)
+        sort_field = SORT_MAPPING.get(request.args.get('sort', 'date_added'), Book.date_added)
+        if request.args.get('order', 'desc') == 'asc':
+            query = query.order_by(sort_field.asc())
+        else:
+            query = query.order_by(sort_field.desc())
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        items = pagination.items
     else:
-        query = query.order_by(sort_field.desc())
+        keyset_page = paginate_books(request.args, per_page=per_page, count='approx')
+        items = keyset_page.items
 
-    books_pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Параметры фильтров без позиции, для построения ссылок пагинации
+    current_filters = {key: value for key, value in request.args.items() if key not in ('page', 'cursor')}
 
-    # Получаем уникальные значения для фильтров
-    genres = db.session.query(Book.genre).filter(Book.genre.isnot(None)).distinct().all()
-    authors = db.session.query(Book.author).distinct().all()
-    statuses = db.session.query(Book.reading_status).distinct().all()
+    # Значения для фильтров берем из кэша (пары значение/количество книг)
+    return render_template('books.html',
+                           books=items,
+                           pagination=pagination,
+                           keyset_page=keyset_page,
+                           genres=facet_cache.values('genre'),
+                           statuses=facet_cache.values('reading_status'),
+                           all_tags=facet_cache.values('tag'),
+                           current_filters=current_filters)
 
-    # Извлекаем все теги
-    all_tags = set()
-    for book in Book.query.with_entities(Book.tags).all():
-        if book.tags:
-            all_tags.update(tag.strip() for tag in book.tags.split(','))
 
-    return render_template('books.html',
-                           books=books_pagination.items,
-                           pagination=books_pagination,
-                           genres=[g[0] for g in genres if g[0]],
-                           authors=[a[0] for a in authors if a[0]],
-                           statuses=[s[0] for s in statuses if s[0]],
-                           all_tags=sorted(all_tags),
-                           current_filters=request.args)
+# Каталог книг в JSON с курсорной пагинацией
+@app.route('/api/books')
+def api_books():
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    page = paginate_books(request.args, per_page=per_page)
+
+    result = {
+        'items': [book_to_dict(book) for book in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    }
+    if page.total is not None:
+        result['total'] = page.total
+        result['total_is_estimate'] = page.total_is_estimate
+
+    return jsonify(result)
+
+
+# Полнотекстовый поиск
+@app.route('/search')
+def search():
+    query_string = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 20
+
+    hits, has_next, narrowed = search_books(filter_books(request.args), query_string,
+                                            limit=per_page, offset=(page - 1) * per_page,
+                                            all_columns=request.args.get('all') == '1')
+
+    return render_template('search.html',
+                           hits=hits,
+                           page=page,
+                           has_next=has_next,
+                           narrowed=narrowed,
+                           query_string=query_string,
+                           genres=facet_cache.values('genre'),
+                           statuses=facet_cache.values('reading_status'),
+                           current_filters={key: value for key, value in request.args.items() if key != 'page'})
+
+
+@app.route('/api/search')
+def api_search():
+    query_string = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+
+    hits, has_next, narrowed = search_books(filter_books(request.args), query_string,
+                                            limit=per_page, offset=(page - 1) * per_page,
+                                            all_columns=request.args.get('all') == '1')
+
+    items = []
+    for hit in hits:
+        item = book_to_dict(hit.book)
+        item['rank'] = hit.rank
+        item['title_highlight'] = str(hit.title)
+        item['snippet'] = str(hit.snippet)
+        items.append(item)
+
+    return jsonify({'items': items, 'page': page, 'has_next': has_next, 'narrowed': narrowed})
 
 
 # Детальная страница книги
 @app.route('/book/<int:book_id>')
 def book_detail(book_id):
     book = Book.query.get_or_404(book_id)
-    reading_sessions = ReadingSession.query.filter_by(book_id=book_id).order_by(ReadingSession.start_time.desc()).all()
-
-    # Подготавливаем данные для графика прогресса
-    progress_data = []
-    if reading_sessions and book.reading_status == 'читаю':
-        cumulative_pages = 0
-        for session in sorted(reading_sessions, key=lambda x: x.start_time):
-            cumulative_pages += session.pages_read
-            progress_data.append({
-                'date': session.start_time.strftime('%Y-%m-%d'),
-                'pages': cumulative_pages,
-                'session_pages': session.pages_read
-            })
+    sessions = session_page(book_id, cursor=request.args.get('sessions_cursor'))
 
+    # Сам ряд для графика загружается отдельно: /api/books/<id>/progress
     return render_template('book_detail.html',
                            book=book,
-                           reading_sessions=reading_sessions,
-                           progress_data=json.dumps(progress_data))
+                           sessions=sessions,
+                           show_progress=book.reading_status == 'читаю' and bool(sessions.items),
+                           similar=similar_books(book_id))
+
+
+# Похожие книги из предрасчитанного индекса (см. similar.py)
+@app.route('/api/books/<int:book_id>/similar')
+def api_similar_books(book_id):
+    limit = max(1, min(request.args.get('limit', app.config['SIMILAR_BOOKS_K'], type=int),
+                       app.config['SIMILAR_BOOKS_K']))
+    return jsonify({
+        'book_id': book_id,
+        'items': [{'id': book.id, 'title': book.title, 'author': book.author,
+                   'genre': book.genre, 'score': score}
+                  for book, score in similar_books(book_id, limit)],
+        # Книга изменилась и еще ждет пересчета
+        'pending': is_queued(book_id),
+    })
+
+
+# Подсказки при вводе: /api/suggest?field=author&q=тол (см. suggest.py)
+@app.route('/api/suggest')
+def api_suggest():
+    field = request.args.get('field')
+    if field not in SUGGEST_FIELDS:
+        return jsonify({'error': f'Поле должно быть одним из: {", ".join(SUGGEST_FIELDS)}'}), 400
+    limit = max(1, min(request.args.get('limit', MAX_SUGGESTIONS, type=int), 50))
+    query = request.args.get('q', '')
+    return jsonify({'field': field, 'q': query, 'items': suggest_index.suggest(field, query, limit)})
+
+
+# Отчет о дублях по всей библиотеке (см. duplicates.py)
+@app.route('/duplicates')
+def duplicates_report():
+    return render_template('duplicates.html', report=duplicates.duplicate_report(), limit=duplicates.REPORT_LIMIT)
+
+
+@app.route('/api/duplicates')
+def api_duplicates():
+    return jsonify(duplicates.duplicate_report())
+
+
+# Проверка перед сохранением: /api/duplicates/check?title=&author=&isbn=
+@app.route('/api/duplicates/check')
+def api_duplicates_check():
+    found = duplicates.find_duplicates(request.args.get('title', ''), request.args.get('author'),
+                                       request.args.get('isbn'), exclude_id=request.args.get('exclude', type=int))
+    return jsonify({
+        'isbn': [{'id': book.id, 'title': book.title, 'author': book.author} for book in found['isbn']],
+        'similar': [{'id': book.id, 'title': book.title, 'author': book.author, 'score': score}
+                    for book, score in found['similar']],
+        'authors': [{'id': author.id, 'name': author.name} for author in found['authors']],
+    })
+
+
+# Ряд прогресса чтения книги, не больше points точек
+@app.route('/api/books/<int:book_id>/progress')
+def api_book_progress(book_id):
+    points = max(2, min(request.args.get('points', MAX_POINTS, type=int), 1000))
+    return jsonify(progress_series(book_id, max_points=points))
 
 
 # Быстрое обновление статуса книги
 @app.route('/book/<int:book_id>/update_status', methods=['POST'])
+@retry_on_busy
 def update_book_status(book_id):
     book = Book.query.get_or_404(book_id)
     new_status = request.form.get('status')
@@ -197,6 +423,7 @@ def update_book_status(book_id):
 
 # Обновление рейтинга книги
 @app.route('/book/<int:book_id>/update_rating', methods=['POST'])
+@retry_on_busy
 def update_book_rating(book_id):
     book = Book.query.get_or_404(book_id)
     new_rating = request.form.get('rating', type=int)
@@ -211,6 +438,7 @@ def update_book_rating(book_id):
 
 # Добавление сессии чтения
 @app.route('/book/<int:book_id>/add_session', methods=['POST'])
+@retry_on_busy
 def add_reading_session(book_id):
     book = Book.query.get_or_404(book_id)
 
@@ -246,13 +474,26 @@ def add_reading_session(book_id):
 
 # В маршруте /book/add (POST)
 @app.route('/book/add', methods=['GET', 'POST'])
+@retry_on_busy
 def add_book():
     if request.method == 'POST':
         # Обработка автора
         author_name = request.form.get('author')
         author = None
 
-        if author_name:
+        # Перед сохранением ищем дубли по ISBN, похожие названия и другие записи автора
+        if not request.form.get('confirm_duplicates'):
+            found = duplicates.find_duplicates(request.form.get('title'), author_name, request.form.get('isbn'))
+            if duplicates.has_duplicates(found):
+                return render_template('add_book.html', form=request.form, duplicates=found)
+
+        author_choice = request.form.get('author_choice', type=int)
+        if author_choice:
+            # Пользователь выбрал уже существующую запись автора
+            author = db.session.get(Author, author_choice)
+            author_name = author.name if author else author_name
+
+        if author_name and not author:
             # Ищем существующего автора
             author = Author.query.filter_by(name=author_name).first()
 
@@ -271,7 +512,6 @@ def add_book():
             'publication_year': request.form.get('publication_year', type=int),
             'publisher': request.form.get('publisher'),
             'genre': request.form.get('genre'),
-            'tags': request.form.get('tags'),
             'description': request.form.get('description'),
             'cover_image_url': request.form.get('cover_image_url'),
             'language': request.form.get('language', 'Russian'),
@@ -292,17 +532,23 @@ def add_book():
             book_data['current_page'] = book_data['page_count']
 
         book = Book(**book_data)
+        set_book_tags(book, request.form.get('tags'))
         db.session.add(book)
+        db.session.flush()
+        # Недостающие данные по ISBN дозаполнит фоновый обработчик
+        if enrichment.needs_enrichment(book):
+            enrichment.enqueue([book.id])
         db.session.commit()
 
         flash('Книга успешно добавлена', 'success')
         return redirect(url_for('book_detail', book_id=book.id))
 
-    return render_template('add_book.html')
+    return render_template('add_book.html', form={})
 
 
 # Редактирование книги
 @app.route('/book/<int:book_id>/edit', methods=['GET', 'POST'])
+@retry_on_busy
 def edit_book(book_id):
     book = Book.query.get_or_404(book_id)
 
@@ -313,7 +559,7 @@ def edit_book(book_id):
         book.publication_year = request.form.get('publication_year', type=int)
         book.publisher = request.form.get('publisher')
         book.genre = request.form.get('genre')
-        book.tags = request.form.get('tags')
+        set_book_tags(book, request.form.get('tags'))
         book.description = request.form.get('description')
         book.cover_image_url = request.form.get('cover_image_url')
         book.language = request.form.get('language')
@@ -323,6 +569,7 @@ def edit_book(book_id):
         book.my_rating = request.form.get('my_rating', type=int)
         book.notes = request.form.get('notes')
 
+        prune_unused_tags()
         db.session.commit()
         flash('Книга успешно обновлена', 'success')
         return redirect(url_for('book_detail', book_id=book.id))
@@ -332,13 +579,16 @@ def edit_book(book_id):
 
 # Удаление книги
 @app.route('/book/<int:book_id>/delete', methods=['POST'])
+@retry_on_busy
 def delete_book(book_id):
     book = Book.query.get_or_404(book_id)
 
-    # Удаляем связанные сессии чтения
+    # Удаляем связанные сессии чтения и задачи дозаполнения
     ReadingSession.query.filter_by(book_id=book_id).delete()
+    EnrichmentJob.query.filter_by(book_id=book_id).delete()
 
     db.session.delete(book)
+    prune_unused_tags()
     db.session.commit()
 
     flash('Книга удалена', 'success')
@@ -356,84 +606,159 @@ def search_isbn():
     return jsonify({'error': 'Книга не найдена'}), 404
 
 
+# Пакетный поиск по списку ISBN: {"isbns": [...]}; ?stream=1 - NDJSON по мере готовности
+@app.route('/book/search_isbn/batch', methods=['POST'])
+def search_isbn_batch():
+    payload = request.get_json(silent=True) or {}
+    isbns = payload.get('isbns')
+    if isbns is None:
+        isbns = request.form.get('isbns', '').split()
+    if not isinstance(isbns, list):
+        return jsonify({'error': 'Ожидается список ISBN'}), 400
+
+    isbns, invalid = prepare_isbns(str(isbn) for isbn in isbns)
+    if len(isbns) > app.config['ISBN_BATCH_LIMIT']:
+        return jsonify({'error': f'Не больше {app.config["ISBN_BATCH_LIMIT"]} ISBN за запрос'}), 400
+
+    if request.args.get('stream'):
+        def generate():
+            for isbn in invalid:
+                yield json.dumps({'isbn': isbn, 'error': 'Некорректный ISBN'}, ensure_ascii=False) + '\n'
+            for isbn, book in iter_books_by_isbn(isbns):
+                yield json.dumps({'isbn': isbn, 'book': book}, ensure_ascii=False) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    return jsonify({'results': dict(iter_books_by_isbn(isbns)), 'invalid': invalid})
+
+
+# Статистика кэша ISBN
+@app.route('/api/isbn_cache/stats')
+def api_isbn_cache_stats():
+    return jsonify(cache_stats())
+
+
+# Обложки из локального кэша; адрес содержит хэш, поэтому кэшируются навсегда
+@app.route('/covers/<size>/<digest>')
+def cover_image(size, digest):
+    if (size != 'original' and size not in cover_store.sizes) or not DIGEST_PATTERN.match(digest):
+        abort(404)
+    path = cover_store.path(size, digest)
+    if not os.path.exists(path):
+        abort(404)
+    response = send_file(path, mimetype=cover_store.mimetype(size, digest), etag=digest,
+                         max_age=365 * 24 * 3600, conditional=True)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+# Состояние очереди дозаполнения метаданных
+@app.route('/api/enrichment/status')
+def api_enrichment_status():
+    return jsonify(enrichment.status())
+
+
+# Поставить в очередь все книги с ISBN и пустыми метаданными (retry=1 - и недавно завершенные)
+@app.route('/enrichment/enqueue', methods=['POST'])
+@retry_on_busy
+def enqueue_enrichment():
+    queued = enrichment.enqueue_missing(retry=request.form.get('retry') == '1')
+    db.session.commit()
+    flash(f'В очередь дозаполнения поставлено книг: {queued}', 'success')
+    return redirect(request.referrer or url_for('books'))
+
+
+# Гистограммы времени ответа по маршрутам и последние запросы с их SQL
+@app.route('/debug/metrics')
+def debug_metrics():
+    if not (app.config['DEBUG_METRICS_ENABLED'] or app.debug):
+        return jsonify({'error': 'Метрики отключены'}), 404
+    return jsonify(instrumentation.snapshot(request.args.get('recent', 50, type=int)))
+
+
 # Массовые операции
 @app.route('/books/bulk_operations', methods=['POST'])
+@retry_on_busy
 def bulk_operations():
-    book_ids = request.form.getlist('book_ids')
     operation = request.form.get('operation')
 
+    # select_all: все книги по фильтрам каталога, переданным в форме
+    if request.form.get('select_all'):
+        book_ids = matching_ids(filter_books(request.form))
+    else:
+        book_ids = parse_ids(request.form.getlist('book_ids'))
+
     if not book_ids:
         flash('Не выбрано ни одной книги', 'warning')
         return redirect(url_for('books'))
 
-    books = Book.query.filter(Book.id.in_(book_ids)).all()
-
-    if operation == 'change_status':
-        new_status = request.form.get('new_status')
-        for book in books:
-            book.reading_status = new_status
-            if new_status == 'прочитана' and not book.date_finished_reading:
-                book.date_finished_reading = datetime.utcnow()
-                book.current_page = book.page_count
-    elif operation == 'add_tag':
-        new_tag = request.form.get('new_tag')
-        for book in books:
-            current_tags = [tag.strip() for tag in book.tags.split(',')] if book.tags else []
-            if new_tag and new_tag not in current_tags:
-                current_tags.append(new_tag)
-                book.tags = ','.join(current_tags)
-    elif operation == 'delete':
-        for book in books:
-            # Удаляем связанные сессии
-            ReadingSession.query.filter_by(book_id=book.id).delete()
-            db.session.delete(book)
+    if not run_bulk_operation(operation, book_ids, request.form):
+        flash('Неизвестная операция', 'danger')
+        return redirect(url_for('books'))
 
     db.session.commit()
-    flash(f'Операция выполнена для {len(books)} книг', 'success')
+    flash(f'Операция выполнена для {len(book_ids)} книг', 'success')
     return redirect(url_for('books'))
 
 
 # Авторы
 @app.route('/authors')
 def authors():
-    authors = Author.query.options(joinedload(Author.books)).all()
-    return render_template('authors.html', authors=authors)
+    page = load_authors(page=request.args.get('page', 1, type=int),
+                        sort=request.args.get('sort', 'books'),
+                        order=request.args.get('order'))
+    return render_template('authors.html', authors_page=page, author_sorts=AUTHOR_SORTS)
+
+
+# Авторы в JSON: та же страница, что и в /authors
+@app.route('/api/authors')
+def api_authors():
+    per_page = max(1, min(request.args.get('per_page', AUTHORS_PER_PAGE, type=int), 100))
+    page = load_authors(page=request.args.get('page', 1, type=int),
+                        sort=request.args.get('sort', 'books'),
+                        order=request.args.get('order'),
+                        per_page=per_page)
+    return jsonify({
+        'items': [author.to_dict() for author in page.items],
+        'page': page.page,
+        'pages': page.pages,
+        'total': page.total,
+    })
+
+
+# Книги автора для карточки на странице авторов
+@app.route('/api/authors/<int:author_id>/books')
+def api_author_books(author_id):
+    per_page = max(1, min(request.args.get('per_page', BOOKS_PER_PAGE, type=int), 100))
+    return jsonify(books_page(author_id, cursor=request.args.get('cursor'), per_page=per_page))
 
 
 # Статистика
 @app.route('/stats')
 def stats():
-    # Базовая статистика
-    total_books = Book.query.count()
-    total_pages = db.session.query(func.sum(Book.page_count)).scalar() or 0
-    total_authors = db.session.query(func.count(Book.author.distinct())).scalar()
+    # Все цифры берутся из сводных таблиц stat_rollups (см. rollups.py)
+    total = rollup_total()
+    total_books = total.books
+    total_pages = total.pages
+    total_authors = rollup_rows('author').count()
 
-    books_by_status = db.session.query(
-        Book.reading_status,
-        func.count(Book.id)
-    ).group_by(Book.reading_status).all()
+    books_by_status = [(row.key, row.books) for row in rollup_rows('status').order_by(StatRollup.key)]
 
-    books_by_genre = db.session.query(
-        Book.genre,
-        func.count(Book.id)
-    ).filter(Book.genre.isnot(None)).group_by(Book.genre).order_by(func.count(Book.id).desc()).limit(10).all()
+    books_by_genre = [(row.key, row.books) for row in rollup_rows('genre').order_by(
+        StatRollup.books.desc(), StatRollup.key).limit(10)]
 
     # Рейтинги
-    average_rating = db.session.query(func.avg(Book.my_rating)).filter(Book.my_rating.isnot(None)).scalar()
+    average_rating = total.rating_sum / total.rating_count if total.rating_count else None
 
     # Темп чтения (страниц в месяц)
     current_year = datetime.now().year
-    monthly_pages = db.session.query(
-        extract('month', ReadingSession.start_time).label('month'),
-        func.sum(ReadingSession.pages_read).label('total_pages')
-    ).filter(
-        extract('year', ReadingSession.start_time) == current_year
-    ).group_by('month').all()
+    monthly_pages = dict(db.session.query(StatRollup.key, StatRollup.pages).filter(
+        StatRollup.dimension == 'month',
+        StatRollup.key.between(f'{current_year}-01', f'{current_year}-12')
+    ).all())
 
     # Заполняем все месяцы
-    monthly_data = [0] * 12
-    for data in monthly_pages:
-        monthly_data[data.month - 1] = data.total_pages
+    monthly_data = [monthly_pages.get(f'{current_year}-{month:02d}', 0) for month in range(1, 13)]
 
     # Активность по сезонам
     seasonal_activity = {
@@ -451,10 +776,8 @@ def stats():
             seasonal_activity['Autumn'] += pages
 
     # Топ авторов
-    top_authors = db.session.query(
-        Book.author,
-        func.count(Book.id).label('book_count')
-    ).group_by(Book.author).order_by(func.count(Book.id).desc()).limit(10).all()
+    top_authors = [(row.key, row.books) for row in rollup_rows('author').order_by(
+        StatRollup.books.desc(), StatRollup.key).limit(10)]
 
     return render_template('stats.html',
                            total_books=total_books,
@@ -466,52 +789,57 @@ def stats():
                            monthly_data=monthly_data,
                            seasonal_activity=seasonal_activity,
                            top_authors=top_authors,
-                           current_year=current_year)
+                           current_year=current_year,
+                           # Аналитика читает все сессии, страница подгружает её из /api/stats/analytics
+                           analytics_available=analytics.available(),
+                           month_names=MONTH_NAMES)
 
 
 # Цели чтения
 @app.route('/goals', methods=['GET', 'POST'])
+@retry_on_busy
 def goals():
     if request.method == 'POST':
         year = request.form.get('year', type=int)
         goal_type = request.form.get('goal_type')
         target = request.form.get('target', type=int)
+        genre = request.form.get('genre') or None
+        month = request.form.get('month', type=int)
+
+        if goal_type not in GOAL_TYPES or month is not None and not 1 <= month <= 12:
+            flash('Некорректные параметры цели', 'danger')
+            return redirect(url_for('goals'))
+        # На цель делится прогресс в goals.html: пустая или нулевая цель сломала бы страницу
+        if year is None or target is None or target <= 0:
+            flash('Год и цель должны быть целыми числами, цель - больше нуля', 'danger')
+            return redirect(url_for('goals'))
 
-        # Проверяем, нет ли уже цели на этот год и тип
-        existing_goal = ReadingGoal.query.filter_by(year=year, goal_type=goal_type).first()
+        # Проверяем, нет ли уже такой цели
+        existing_goal = ReadingGoal.query.filter_by(year=year, goal_type=goal_type,
+                                                    genre=genre, month=month).first()
         if existing_goal:
-            flash('Цель на этот год и тип уже существует', 'warning')
+            flash('Такая цель уже существует', 'warning')
             return redirect(url_for('goals'))
 
-        goal = ReadingGoal(year=year, goal_type=goal_type, target=target)
+        goal = ReadingGoal(year=year, goal_type=goal_type, target=target, genre=genre, month=month)
         db.session.add(goal)
         db.session.commit()
         flash('Цель добавлена', 'success')
         return redirect(url_for('goals'))
 
-    goals = ReadingGoal.query.all()
+    # Прогресс считается двумя сгруппированными запросами на все цели, без записи в базу
+    goals = compute_progress(ReadingGoal.query.order_by(
+        ReadingGoal.year.desc(), ReadingGoal.month, ReadingGoal.goal_type, ReadingGoal.genre).all())
     current_year = datetime.now().year
 
-    # Обновляем прогресс для целей
-    for goal in goals:
-        if goal.goal_type == 'books':
-            goal.current_progress = Book.query.filter(
-                Book.reading_status == 'прочитана',
-                extract('year', Book.date_finished_reading) == goal.year
-            ).count()
-        elif goal.goal_type == 'pages':
-            result = db.session.query(func.sum(ReadingSession.pages_read)).filter(
-                extract('year', ReadingSession.start_time) == goal.year
-            ).first()
-            goal.current_progress = result[0] or 0
-
-    db.session.commit()
-
-    return render_template('goals.html', goals=goals, current_year=current_year)
+    return render_template('goals.html', goals=goals, current_year=current_year,
+                           goal_types=GOAL_TYPES, month_names=MONTH_NAMES,
+                           genres=[genre for genre, _ in facet_cache.values('genre')])
 
 
 # Удаление цели
 @app.route('/goal/<int:goal_id>/delete', methods=['POST'])
+@retry_on_busy
 def delete_goal(goal_id):
     goal = ReadingGoal.query.get_or_404(goal_id)
     db.session.delete(goal)
@@ -526,103 +854,339 @@ def import_export():
     return render_template('import_export.html')
 
 
-# Экспорт в CSV
+# Импорт из файлов в форматах экспорта
+@app.route('/import', methods=['POST'])
+def import_books():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Не выбран файл для импорта', 'error')
+        return redirect(url_for('import_export'))
+
+    file_format = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    if file_format not in ('csv', 'json', 'ndjson'):
+        flash('Поддерживаются файлы CSV, JSON и NDJSON', 'error')
+        return redirect(url_for('import_export'))
+
+    report = import_file(upload.stream, file_format, batch_size=app.config['IMPORT_BATCH_SIZE'])
+    # Импорт пишет в базу напрямую, минуя события сессии
+    facet_cache.invalidate()
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(report.to_dict())
+    return render_template('import_export.html', report=report.to_dict())
+
+
+# Экспорт в CSV (?stream=sessions или goals для дополнительных таблиц)
 @app.route('/export/csv')
 def export_csv():
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Заголовки
-    writer.writerow(['Title', 'Author', 'ISBN', 'Publication Year', 'Publisher',
-                     'Genre', 'Tags', 'Description', 'Language', 'Page Count',
-                     'Reading Status', 'Rating', 'Date Added', 'Date Started',
-                     'Date Finished', 'Notes'])
-
-    # Данные
-    books = Book.query.all()
-    for book in books:
-        writer.writerow([
-            book.title,
-            book.author,
-            book.isbn or '',
-            book.publication_year or '',
-            book.publisher or '',
-            book.genre or '',
-            book.tags or '',
-            book.description or '',
-            book.language or '',
-            book.page_count or '',
-            book.reading_status,
-            book.my_rating or '',
-            book.date_added.strftime('%Y-%m-%d') if book.date_added else '',
-            book.date_started_reading.strftime('%Y-%m-%d') if book.date_started_reading else '',
-            book.date_finished_reading.strftime('%Y-%m-%d') if book.date_finished_reading else '',
-            book.notes or ''
-        ])
-
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
+    stream = request.args.get('stream', 'books')
+    if stream not in ('books',) + EXTRA_STREAMS:
+        stream = 'books'
+    suffix = '' if stream == 'books' else f'_{stream}'
+
+    return Response(
+        stream_with_context(generate_csv(stream)),
         mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'library_export_{datetime.now().strftime("%Y%m%d")}.csv'
+        headers={'Content-Disposition': 'attachment; filename='
+                 f'library_export{suffix}_{datetime.now().strftime("%Y%m%d")}.csv'}
     )
 
 
-# Экспорт в JSON
+# Экспорт в JSON (?format=ndjson, ?include=sessions,goals)
 @app.route('/export/json')
 def export_json():
-    books_data = []
-    books = Book.query.all()
+    include = parse_include(request.args.get('include'))
 
-    for book in books:
-        book_data = {
-            'title': book.title,
-            'author': book.author,
-            'isbn': book.isbn,
-            'publication_year': book.publication_year,
-            'publisher': book.publisher,
-            'genre': book.genre,
-            'tags': book.tags,
-            'description': book.description,
-            'cover_image_url': book.cover_image_url,
-            'language': book.language,
-            'page_count': book.page_count,
-            'physical_location': book.physical_location,
-            'reading_status': book.reading_status,
-            'my_rating': book.my_rating,
-            'date_added': book.date_added.isoformat() if book.date_added else None,
-            'date_started_reading': book.date_started_reading.isoformat() if book.date_started_reading else None,
-            'date_finished_reading': book.date_finished_reading.isoformat() if book.date_finished_reading else None,
-            'notes': book.notes,
-            'current_page': book.current_page
-        }
-        books_data.append(book_data)
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(generate_ndjson(include)), mimetype='application/x-ndjson')
 
-    return jsonify(books_data)
+    return Response(stream_with_context(generate_json(include)), mimetype='application/json')
 
 
 # API для получения статистики (для AJAX запросов)
+# Параметры: start и end (YYYY-MM-DD, включительно), granularity: day/week/month/year
 @app.route('/api/stats/reading_activity')
 def api_reading_activity():
-    # Статистика чтения за последние 6 месяцев
-    six_months_ago = datetime.now() - timedelta(days=180)
-
-    activity_data = db.session.query(
-        func.date(ReadingSession.start_time).label('date'),
-        func.sum(ReadingSession.pages_read).label('pages')
-    ).filter(
-        ReadingSession.start_time >= six_months_ago
-    ).group_by(
-        func.date(ReadingSession.start_time)
-    ).order_by('date').all()
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f'granularity: одно из {", ".join(GRANULARITIES)}'}), 400
+    try:
+        # Дни сводки - по UTC, как и время сессий
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if 'end' in request.args \
+            else datetime.utcnow().date()
+        # По умолчанию - последние 6 месяцев
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if 'start' in request.args \
+            else end - timedelta(days=180)
+    except ValueError:
+        return jsonify({'error': 'Даты в формате YYYY-MM-DD'}), 400
 
-    result = {
-        'dates': [item.date.strftime('%Y-%m-%d') for item in activity_data],
-        'pages': [item.pages for item in activity_data]
-    }
+    result = {'start': start.isoformat(), 'end': end.isoformat(), 'granularity': granularity}
+    result.update(reading_activity(start, end, granularity))
+
+    # Ответ строится из сводки и дешев, ETag экономит передачу и разбор на клиенте
+    response = jsonify(result)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
-    return jsonify(result)
+
+# Серии, скорость чтения, темп по жанрам и прогнозы (см. analytics.py)
+@app.route('/api/stats/analytics')
+def api_reading_analytics():
+    if not analytics.available():
+        return jsonify({'error': 'Для аналитики нужен NumPy'}), 503
+    response = jsonify(analytics.reading_analytics())
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+# Применение миграций схемы: flask --app app migrate
+@app.cli.command('migrate')
+def migrate_command():
+    run_migrations()
+    print('Миграции применены')
+
+
+# Обслуживание сводной статистики: flask --app app rollups rebuild|check
+rollups_cli = AppGroup('rollups', help='Сводные таблицы статистики')
+
+
+@rollups_cli.command('rebuild')
+def rollups_rebuild_command():
+    with db.engine.begin() as conn:
+        rebuild_rollups(conn)
+    print('Сводная статистика пересобрана')
+
+
+@rollups_cli.command('check')
+def rollups_check_command():
+    with db.engine.connect() as conn:
+        problems = check_rollups(conn)
+    for problem in problems:
+        print(f"{problem['row']}: в сводке {problem['stored']}, фактически {problem['actual']}")
+    if problems:
+        raise SystemExit(f'Расхождений: {len(problems)}. Исправить: flask --app app rollups rebuild')
+    print('Сводная статистика согласована')
+
+
+app.cli.add_command(rollups_cli)
+
+
+# Профиль хранения: flask --app app storage info|stress
+storage_cli = AppGroup('storage', help='Профиль хранения SQLite')
+
+
+@storage_cli.command('info')
+def storage_info_command():
+    print(f"Профиль: {app.config['STORAGE_PROFILE']}")
+    for bind_key, title in ((None, 'Писатель'), (storage.READ_BIND, 'Чтение')):
+        pragmas = storage.effective_pragmas(app, db, bind_key)
+        print(f"{title}: " + ', '.join(f'{name}={value}' for name, value in pragmas.items()))
+
+
+@storage_cli.command('stress')
+@click.option('--seconds', default=5.0, help='Длительность теста')
+@click.option('--readers', default=8, help='Потоков чтения')
+@click.option('--writers', default=2, help='Потоков записи')
+def storage_stress_command(seconds, readers, writers):
+    stats = storage.stress_test(app, db, seconds=seconds, readers=readers, writers=writers)
+    print(f"Чтений: {stats['reads']}, записей: {stats['writes']}")
+    print(f"Макс. время чтения: {stats['max_read_ms']:.1f} мс, записи: {stats['max_write_ms']:.1f} мс")
+    if stats['read_errors'] or stats['write_errors']:
+        raise SystemExit(f"Ошибок чтения: {stats['read_errors']}, записи: {stats['write_errors']}")
+    print('Ошибок нет')
+
+
+app.cli.add_command(storage_cli)
+
+
+# Обложки: flask --app app covers prefetch|info
+covers_cli = AppGroup('covers', help='Локальный кэш обложек')
+
+
+@covers_cli.command('prefetch')
+def covers_prefetch_command():
+    """Скачивает все еще не сохраненные обложки книг"""
+    if not covers.available():
+        print('Для кэша обложек нужен Pillow: pip install Pillow')
+        return
+    urls = [url for (url,) in db.session.query(Book.cover_image_url).filter(
+        Book.cover_image_url.isnot(None), Book.cover_image_url != '').distinct()]
+    scheduled = [url for url in urls if cover_store.thumbnail(url, 'list') is None]
+    cover_store.drain()
+    info = cover_store.info()
+    print(f"Обложек: {len(urls)}, скачивалось: {len(scheduled)}, "
+          f"сохранено всего: {info['stored']}, ошибок: {info['errors']}")
+
+
+@covers_cli.command('info')
+def covers_info_command():
+    for key, value in cover_store.info().items():
+        print(f'{key}: {value}')
+
+
+app.cli.add_command(covers_cli)
+
+
+# Дозаполнение метаданных: flask --app app enrich enqueue|worker|status
+enrich_cli = AppGroup('enrich', help='Фоновое дозаполнение метаданных по ISBN')
+
+
+@enrich_cli.command('enqueue')
+@click.option('--retry', is_flag=True, help='Ставить и книги, задачи которых недавно завершились')
+def enrich_enqueue_command(retry):
+    queued = enrichment.enqueue_missing(retry=retry)
+    db.session.commit()
+    print(f'Поставлено задач: {queued}')
+
+
+@enrich_cli.command('worker')
+@click.option('--workers', type=int, default=None, help='Потоков для сетевых запросов')
+@click.option('--rate', type=float, default=None, help='Не больше задач в секунду')
+@click.option('--once', is_flag=True, help='Обработать готовые задачи и выйти')
+def enrich_worker_command(workers, rate, once):
+    processed = enrichment.run_worker(app,
+                                      workers=workers or app.config['ENRICHMENT_WORKERS'],
+                                      rate=rate or app.config['ENRICHMENT_RATE'],
+                                      once=once)
+    print(f'Готово, обработано задач: {processed}')
+
+
+@enrich_cli.command('status')
+def enrich_status_command():
+    print(json.dumps(enrichment.status(), ensure_ascii=False, indent=2))
+
+
+app.cli.add_command(enrich_cli)
+
+
+# Индекс похожих книг: flask --app app similar rebuild|update|status
+similar_cli = AppGroup('similar', help='Индекс похожих книг')
+
+
+@similar_cli.command('rebuild')
+def similar_rebuild_command():
+    """Пересчитывает соседей всех книг"""
+    started = datetime.now()
+    count = similar_index.rebuild(progress=lambda done, total: print(f'books: {done}/{total}'))
+    print(f'Готово за {(datetime.now() - started).total_seconds():.1f} с, книг: {count}')
+
+
+@similar_cli.command('update')
+def similar_update_command():
+    """Разбирает очередь измененных книг"""
+    processed = 0
+    while True:
+        batch = similar_index.process_queue()
+        if not batch:
+            break
+        processed += batch
+        print(f'Обработано: {processed}')
+    print(f'Очередь разобрана, книг: {processed}')
+
+
+@similar_cli.command('status')
+def similar_status_command():
+    for key, value in similar_index.status().items():
+        print(f'{key}: {value}')
+
+
+app.cli.add_command(similar_cli)
+
+
+# Поиск дублей: flask --app app dedupe report|rebuild
+dedupe_cli = AppGroup('dedupe', help='Поиск дублей книг и авторов')
+
+
+@dedupe_cli.command('report')
+@click.option('--limit', default=duplicates.REPORT_LIMIT, help='Не больше групп каждого вида')
+def dedupe_report_command(limit):
+    started = datetime.now()
+    report = duplicates.duplicate_report(limit)
+    books = report['books']
+    for group in report['isbn']:
+        print(f"ISBN {group['isbn']}: " + '; '.join(f"#{book_id} {books[book_id]['title']}"
+                                                    for book_id in group['book_ids']))
+    for group in report['titles']:
+        print(f"Название ({group['score']}): " + ' / '.join(f"#{book_id} {books[book_id]['title']}"
+                                                           for book_id in group['book_ids']))
+    for alias in report['authors']:
+        print(f"Автор: {' / '.join(alias['names'])}")
+    print(f"Готово за {(datetime.now() - started).total_seconds():.1f} с: ISBN {len(report['isbn'])}, "
+          f"названий {len(report['titles'])}, авторов {len(report['authors'])}"
+          + (' (показаны не все)' if report['truncated'] else ''))
+
+
+@dedupe_cli.command('rebuild')
+def dedupe_rebuild_command():
+    """Заново строит нормализованные ISBN и триграммы названий и имен"""
+    duplicates.normalize_isbns(db.session.connection())
+    duplicates.rebuild_name_index(db.session.connection())
+    db.session.commit()
+    print('Индекс дублей перестроен')
+
+
+app.cli.add_command(dedupe_cli)
+
+
+# Синтетическая библиотека для замеров: flask --app app datagen --preset medium
+@app.cli.command('datagen')
+@click.option('--preset', type=click.Choice(sorted(PRESETS)), help='Готовый размер библиотеки')
+@click.option('--books', type=int, help='Количество книг')
+@click.option('--sessions', type=int, help='Количество сессий чтения')
+@click.option('--seed', default=1, help='Зерно генератора случайных чисел')
+def datagen_command(preset, books, sessions, seed):
+    preset_books, preset_sessions = PRESETS[preset or 'small']
+    books = preset_books if books is None else books
+    sessions = preset_sessions if sessions is None else sessions
+    run_migrations()
+
+    def progress(stage, done, total):
+        if stage != 'done':
+            print(f'{stage}: {done}/{total}')
+
+    started = datetime.now()
+    generate_library(books, sessions, seed, progress)
+    print(f'Готово за {(datetime.now() - started).total_seconds():.1f} с')
+
+
+# Замеры маршрутов: flask --app app benchmark --output bench.json [--compare old.json]
+@app.cli.command('benchmark')
+@click.option('--iterations', default=20, help='Запросов на маршрут')
+@click.option('--warmup', default=2, help='Запросов на прогрев (не учитываются)')
+@click.option('--only', multiple=True, help='Только указанные сценарии')
+@click.option('--output', type=click.Path(dir_okay=False), help='Файл для отчета JSON')
+@click.option('--compare', 'compare_with', type=click.File(encoding='utf-8'), help='Предыдущий отчет для сравнения')
+def benchmark_command(iterations, warmup, only, output, compare_with):
+    report = run_benchmark(app, iterations=iterations, warmup=warmup, only=set(only))
+    print(f"Библиотека: {report['library']['books']} книг, {report['library']['sessions']} сессий")
+    for name, result in report['routes'].items():
+        print(f"{name:20} p50 {result['p50_ms']:9.2f} мс  p95 {result['p95_ms']:9.2f} мс  "
+              f"запросов {result['queries']:6.1f}  память {result['peak_kb']:9.1f} КиБ  {result['statuses']}")
+    for endpoint, reason in report['skipped'].items():
+        print(f'пропущен {endpoint}: {reason}')
+    if compare_with:
+        for line in compare(json.load(compare_with), report):
+            print(line)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'Отчет сохранен в {output}')
+
+
+# Проверка планов запросов страниц: flask --app app query-plans
+@app.cli.command('query-plans')
+def query_plans_command():
+    problems = check_query_plans(app, db)
+    for problem in problems:
+        print(f"{problem['url']}: полный проход {', '.join(problem['scans'])}")
+        print(f"  {problem['sql']}")
+        for detail in problem['plan']:
+            print(f'    {detail}')
+    if problems:
+        raise SystemExit(f'Запросов с полным проходом таблицы: {len(problems)}')
+    print(f'Планы запросов в порядке ({len(PLAN_CHECKS)} страниц)')
 
 
 # Обработка ошибки 404
@@ -640,5 +1204,5 @@ def internal_error(error):
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        run_migrations()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""Страница авторов.
+
+Авторы выводятся страницами, сортировка - по числу книг или по имени.
+Число книг по статусам считается одним сгруппированным запросом по
+индексу (author_id, reading_status) только для авторов текущей страницы,
+а сами книги автора подгружаются отдельно через JSON (books_page).
+"""
+from sqlalchemy import func, select
+from sqlalchemy.orm import load_only
+
+from models import db, Author, Book
+from pagination import keyset_paginate
+
+AUTHORS_PER_PAGE = 24
+BOOKS_PER_PAGE = 20
+
+# Сортировка -> направление по умолчанию
+AUTHOR_SORTS = {'books': 'desc', 'name': 'asc'}
+
+# Порядок бейджей статусов в карточке автора
+STATUS_ORDER = ('читаю', 'прочитана', 'в планах', 'не начата', 'брошена')
+
+
+class AuthorSummary:
+    """Автор в списке: поля карточки и число книг по статусам"""
+    __slots__ = ('id', 'name', 'biography', 'photo_url', 'book_count', 'statuses')
+
+    def __init__(self, author, statuses):
+        self.id = author.id
+        self.name = author.name
+        self.biography = author.biography
+        self.photo_url = author.photo_url
+        order = {status: index for index, status in enumerate(STATUS_ORDER)}
+        self.statuses = sorted(statuses.items(), key=lambda item: (order.get(item[0], len(order)), item[0] or ''))
+        self.book_count = sum(statuses.values())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'biography': self.biography,
+            'photo_url': self.photo_url,
+            'book_count': self.book_count,
+            'statuses': dict(self.statuses),
+        }
+
+
+class AuthorPage:
+    __slots__ = ('items', 'page', 'per_page', 'total', 'sort', 'order')
+
+    def __init__(self, items, page, per_page, total, sort, order):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.sort = sort
+        self.order = order
+
+    @property
+    def pages(self):
+        return max(1, -(-self.total // self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+
+def _status_counts(author_ids):
+    counts = {author_id: {} for author_id in author_ids}
+    if author_ids:
+        rows = db.session.execute(
+            select(Book.author_id, Book.reading_status, func.count())
+            .where(Book.author_id.in_(author_ids))
+            .group_by(Book.author_id, Book.reading_status)
+        )
+        for author_id, status, count in rows:
+            counts[author_id][status] = count
+    return counts
+
+
+def load_authors(page=1, sort='books', order=None, per_page=AUTHORS_PER_PAGE):
+    """Страница авторов; неизвестная сортировка заменяется на 'books'"""
+    if sort not in AUTHOR_SORTS:
+        sort = 'books'
+    if order not in ('asc', 'desc'):
+        order = AUTHOR_SORTS[sort]
+    total = db.session.execute(select(func.count(Author.id))).scalar()
+    page = max(1, min(page, max(1, -(-total // per_page))))
+
+    query = select(Author).options(load_only(Author.id, Author.name, Author.biography, Author.photo_url))
+    if sort == 'books':
+        # Подсчет идет только по индексу, без чтения строк книг
+        book_counts = (select(Book.author_id, func.count().label('book_count'))
+                       .where(Book.author_id.isnot(None))
+                       .group_by(Book.author_id)
+                       .subquery())
+        book_count = func.coalesce(book_counts.c.book_count, 0)
+        query = query.outerjoin(book_counts, book_counts.c.author_id == Author.id)
+        query = query.order_by(book_count.desc() if order == 'desc' else book_count.asc(), Author.name, Author.id)
+    else:
+        query = query.order_by(Author.name.desc() if order == 'desc' else Author.name.asc(), Author.id)
+
+    authors = db.session.execute(query.limit(per_page).offset((page - 1) * per_page)).scalars().all()
+    counts = _status_counts([author.id for author in authors])
+    items = [AuthorSummary(author, counts[author.id]) for author in authors]
+    return AuthorPage(items, page, per_page, total, sort, order)
+
+
+def books_page(author_id, cursor=None, per_page=BOOKS_PER_PAGE):
+    """Книги автора по названию, только id, название и статус"""
+    query = Book.query.options(load_only(Book.id, Book.title, Book.reading_status)).filter(
+        Book.author_id == author_id)
+    page = keyset_paginate(query, Book.title, Book.id, 'title', False, cursor=cursor, per_page=per_page)
+    return {
+        'items': [{'id': book.id, 'title': book.title, 'reading_status': book.reading_status}
+                  for book in page.items],
+        'next_cursor': page.next_cursor,
+    }
@@ -0,0 +1,248 @@
+"""Замеры маршрутов приложения через тестовый клиент Flask.
+
+Для каждого маршрута выполняется несколько запросов и считаются p50/p95
+времени ответа, среднее число SQL-запросов и пиковая память Python
+(tracemalloc) за запрос; в память входит и тело ответа, которое тестовый
+клиент собирает целиком. Результат сохраняется в JSON, чтобы сравнивать
+прогоны на разных коммитах.
+"""
+import io
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from flask import has_app_context
+from sqlalchemy import event, func, select
+
+from models import db, Book, ReadingSession, ReadingGoal
+
+# Маршруты, которые ходят во внешние сервисы и в замеры не входят
+SKIPPED_ENDPOINTS = {
+    'static': 'статические файлы',
+    'search_isbn': 'запрос к внешним сервисам ISBN',
+    'search_isbn_batch': 'запрос к внешним сервисам ISBN',
+    'cover_image': 'файлы обложек из кэша на диске',
+}
+
+
+def _import_file(context):
+    data = json.dumps([{'title': f'Замер {context["iteration"]}', 'author': 'Автор замера'}]).encode()
+    return {'file': (io.BytesIO(data), 'benchmark.json')}
+
+
+# (имя, эндпоинт, метод, url, данные формы); в url и данных подставляются
+# значения из контекста: {book_id}, {author_id}, {goal_id}, {victim_id}, {iteration}
+SCENARIOS = [
+    ('index', 'index', 'GET', '/', None),
+    ('api_dashboard', 'api_dashboard', 'GET', '/api/dashboard', None),
+    ('books', 'books', 'GET', '/books', None),
+    ('books_filtered', 'books', 'GET', '/books?status=прочитана&sort=rating', None),
+    ('books_offset', 'books', 'GET', '/books?page=50', None),
+    ('api_books', 'api_books', 'GET', '/api/books?sort=title&order=asc', None),
+    ('search', 'search', 'GET', '/search?q=война', None),
+    ('api_search', 'api_search', 'GET', '/api/search?q=звезда ночь', None),
+    ('book_detail', 'book_detail', 'GET', '/book/{book_id}', None),
+    ('book_progress', 'api_book_progress', 'GET', '/api/books/{book_id}/progress', None),
+    ('similar_books', 'api_similar_books', 'GET', '/api/books/{book_id}/similar', None),
+    # GET /book/<id>/edit не замеряется: в templates нет edit_book.html
+    ('add_book_form', 'add_book', 'GET', '/book/add', None),
+    ('authors', 'authors', 'GET', '/authors', None),
+    ('authors_by_name', 'authors', 'GET', '/authors?sort=name&page=3', None),
+    ('api_authors', 'api_authors', 'GET', '/api/authors', None),
+    ('api_author_books', 'api_author_books', 'GET', '/api/authors/{author_id}/books', None),
+    ('stats', 'stats', 'GET', '/stats', None),
+    ('goals', 'goals', 'GET', '/goals', None),
+    ('import_export', 'import_export', 'GET', '/import_export', None),
+    ('export_csv', 'export_csv', 'GET', '/export/csv', None),
+    ('export_json', 'export_json', 'GET', '/export/json', None),
+    ('reading_activity', 'api_reading_activity', 'GET', '/api/stats/reading_activity', None),
+    ('reading_activity_year', 'api_reading_activity', 'GET',
+     '/api/stats/reading_activity?start=2021-01-01&end=2025-12-31&granularity=week', None),
+    ('reading_analytics', 'api_reading_analytics', 'GET', '/api/stats/analytics', None),
+    ('isbn_cache_stats', 'api_isbn_cache_stats', 'GET', '/api/isbn_cache/stats', None),
+    # 404, если /debug/metrics не включен (LIBRARY_DEBUG_METRICS=1 или режим отладки)
+    ('debug_metrics', 'debug_metrics', 'GET', '/debug/metrics', None),
+    ('enrichment_status', 'api_enrichment_status', 'GET', '/api/enrichment/status', None),
+    ('suggest', 'api_suggest', 'GET', '/api/suggest?field=author&q=тол', None),
+    ('duplicates_check', 'api_duplicates_check', 'GET',
+     '/api/duplicates/check?title=Война и мир&author=Толстой Л.&isbn=9785170902349', None),
+    ('duplicates', 'duplicates_report', 'GET', '/duplicates', None),
+    ('api_duplicates', 'api_duplicates', 'GET', '/api/duplicates', None),
+    # Запись: изменяют базу, поэтому выполняются после чтения
+    ('update_status', 'update_book_status', 'POST', '/book/{book_id}/update_status', {'status': 'читаю'}),
+    ('update_rating', 'update_book_rating', 'POST', '/book/{book_id}/update_rating', {'rating': '{iteration_rating}'}),
+    ('add_session', 'add_reading_session', 'POST', '/book/{book_id}/add_session',
+     {'pages_read': '10', 'duration_minutes': '15'}),
+    # Названия итераций похожи друг на друга: дубли подтверждаем, проверку замеряет duplicates_check
+    ('add_book', 'add_book', 'POST', '/book/add',
+     {'title': 'Замер {iteration}', 'author': 'Автор замера', 'genre': 'Роман', 'tags': 'замер', 'page_count': '300',
+      'confirm_duplicates': '1'}),
+    ('edit_book', 'edit_book', 'POST', '/book/{book_id}/edit',
+     {'title': 'Книга замера', 'author': 'Автор замера', 'genre': 'Роман', 'tags': 'замер',
+      'page_count': '300', 'reading_status': 'читаю', 'language': 'Russian'}),
+    ('bulk_status', 'bulk_operations', 'POST', '/books/bulk_operations',
+     {'book_ids': '{book_id}', 'operation': 'change_status', 'new_status': 'в планах'}),
+    ('add_goal', 'goals', 'POST', '/goals', {'year': '{iteration_year}', 'goal_type': 'books', 'target': '10'}),
+    ('delete_goal', 'delete_goal', 'POST', '/goal/{goal_id}/delete', None),
+    ('enqueue_enrichment', 'enqueue_enrichment', 'POST', '/enrichment/enqueue', None),
+    ('import', 'import_books', 'POST', '/import', _import_file),
+    ('delete_book', 'delete_book', 'POST', '/book/{victim_id}/delete', None),
+]
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _library_size():
+    return {
+        'books': db.session.execute(select(func.count(Book.id))).scalar(),
+        'sessions': db.session.execute(select(func.count(ReadingSession.id))).scalar(),
+    }
+
+
+def _context(iteration):
+    """Значения для подстановки; книги для удаления берутся с конца"""
+    book_id = db.session.execute(select(func.min(Book.id))).scalar()
+    victim_id = db.session.execute(select(func.max(Book.id))).scalar()
+    goal_id = db.session.execute(select(func.max(ReadingGoal.id))).scalar()
+    author_id = db.session.execute(select(func.min(Book.author_id))).scalar()
+    db.session.remove()
+    return {'book_id': book_id, 'author_id': author_id, 'victim_id': victim_id, 'goal_id': goal_id, 'iteration': iteration,
+            'iteration_rating': iteration % 10 + 1, 'iteration_year': 3000 + iteration}
+
+
+def _fill(value, context):
+    if callable(value):
+        return value(context)
+    if isinstance(value, dict):
+        return {key: _fill(item, context) for key, item in value.items()}
+    return value.format(**context) if isinstance(value, str) else value
+
+
+class QueryCounter:
+    def __init__(self, engines):
+        self.engines = engines
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, *args):
+        # BEGIN/COMMIT - управление транзакцией, а не запросы
+        if not statement.startswith(('BEGIN', 'COMMIT', 'ROLLBACK')):
+            self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._on_execute)
+
+
+def run_benchmark(app, iterations=20, warmup=2, only=None):
+    """Прогоняет SCENARIOS и возвращает отчет (словарь для JSON)"""
+    client = app.test_client()
+    with app.app_context():
+        engines = list(db.engines.values())
+        library = _library_size()
+
+    def request(iteration, url, method, data, trace=False):
+        with app.app_context():
+            context = _context(iteration)
+        form = _fill(data, context) if data is not None else None
+        with QueryCounter(engines) as counter:
+            if trace:
+                tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                response = client.open(_fill(url, context), method=method, data=form)
+                # Потоковые ответы считаются вместе с чтением тела
+                response.get_data()
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if trace else 0
+            if trace:
+                tracemalloc.stop()
+        # Команда CLI уже держит контекст приложения, и запросы тестового
+        # клиента работают в нем же: закрываем сессию, как teardown запроса
+        if has_app_context():
+            db.session.remove()
+        return status, elapsed * 1000, counter.count, peak / 1024
+
+    results = {}
+    covered = set()
+    for name, endpoint, method, url, data in SCENARIOS:
+        if only and name not in only:
+            continue
+        covered.add(endpoint)
+        for iteration in range(warmup):
+            request(iteration, url, method, data)
+
+        timings = []
+        queries = []
+        statuses = {}
+        for iteration in range(warmup, warmup + iterations):
+            status, elapsed, count, _ = request(iteration, url, method, data)
+            timings.append(elapsed)
+            queries.append(count)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        # tracemalloc заметно замедляет код, поэтому память меряем отдельным запросом
+        _, _, _, peak = request(warmup + iterations, url, method, data, trace=True)
+
+        results[name] = {
+            'endpoint': endpoint,
+            'method': method,
+            'url': url,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(_percentile(timings, 95), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries': round(statistics.fmean(queries), 2),
+            'peak_kb': round(peak, 1),
+            'statuses': {str(code): count for code, count in statuses.items()},
+        }
+
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+    return {
+        'revision': _git_revision(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'iterations': iterations,
+        'library': library,
+        'routes': results,
+        'skipped': {endpoint: SKIPPED_ENDPOINTS.get(endpoint, 'нет сценария')
+                    for endpoint in sorted(endpoints - covered) if not only},
+    }
+
+
+def compare(old, new):
+    """Строки сравнения двух отчетов по p50 и числу запросов"""
+    lines = []
+    for name, result in new['routes'].items():
+        before = old.get('routes', {}).get(name)
+        if before is None:
+            lines.append(f"{name}: {result['p50_ms']} мс (нет в старом отчете)")
+            continue
+        change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+        lines.append(f"{name}: p50 {before['p50_ms']} -> {result['p50_ms']} мс ({change:+.0f}%), "
+                     f"запросов {before['queries']} -> {result['queries']}")
+    return lines
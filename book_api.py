@@ -1,54 +1,336 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 import isbnlib
+from requests.adapters import HTTPAdapter
 
+# Настройки по умолчанию, переопределяются через configure()
+settings = {
+    'cache_path': 'isbn_cache.db',
+    'hit_ttl': 30 * 24 * 3600,  # найденные книги храним месяц
+    'miss_ttl': 24 * 3600,  # отсутствие книги запоминаем на сутки
+    'lru_size': 1024,
+    'timeout': (3.05, 10),  # (соединение, чтение) в секундах
+    'openlibrary_url': 'https://openlibrary.org',
+    'sources': ('isbnlib', 'openlibrary'),
+    # Запросов в секунду на источник: публичные API без ключа при превышении
+    # отвечают 429 и временно блокируют адрес, поэтому по умолчанию осторожно
+    'rate_limits': {'isbnlib': 5.0, 'openlibrary': 10.0},
+    'batch_workers': 16,
+    'logger': logging.getLogger(__name__),
+}
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def http_session():
+    """Общая сессия requests с пулом соединений"""
+    global _http
+    with _http_lock:
+        if _http is None:
+            _http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+            _http.mount('http://', adapter)
+            _http.mount('https://', adapter)
+        return _http
+
+
+def normalize_isbn(isbn):
+    """Приводит ISBN к ISBN-13 без дефисов; для некорректного ISBN возвращает None"""
+    if not isbn:
+        return None
+    canonical = isbnlib.canonical(str(isbn))
+    if isbnlib.is_isbn10(canonical):
+        return isbnlib.to_isbn13(canonical)
+    if isbnlib.is_isbn13(canonical):
+        return canonical
+    return None
+
+
+class IsbnCache:
+    """Двухуровневый кэш: LRU в памяти процесса перед таблицей SQLite.
+
+    Отсутствие книги тоже кэшируется (data = None), но с отдельным, более коротким TTL.
+    """
+
+    def __init__(self, path, hit_ttl, miss_ttl, lru_size):
+        self.path = path
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'errors': 0}
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS isbn_cache ('
+            'isbn TEXT PRIMARY KEY, data TEXT, fetched_at REAL NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, isbn, expires_at, data):
+        with self._lock:
+            self._lru[isbn] = (expires_at, data)
+            self._lru.move_to_end(isbn)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, isbn):
+        """Возвращает (True, данные или None) из кэша либо (False, None), если записи нет"""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(isbn)
+            if entry is not None and entry[0] <= now:
+                del self._lru[isbn]
+                entry = None
+            if entry is not None:
+                self._lru.move_to_end(isbn)
+
+        if entry is None:
+            row = self._connect().execute(
+                'SELECT data, expires_at FROM isbn_cache WHERE isbn = ? AND expires_at > ?', (isbn, now)
+            ).fetchone()
+            if row is not None:
+                entry = (row[1], json.loads(row[0]) if row[0] is not None else None)
+                self._remember(isbn, *entry)
+
+        if entry is None:
+            self.count('misses')
+            return False, None
+        self.count('hits' if entry[1] is not None else 'negative_hits')
+        return True, entry[1]
+
+    def put(self, isbn, data):
+        now = time.time()
+        expires_at = now + (self.hit_ttl if data is not None else self.miss_ttl)
+        self._connect().execute(
+            'INSERT OR REPLACE INTO isbn_cache (isbn, data, fetched_at, expires_at) VALUES (?, ?, ?, ?)',
+            (isbn, json.dumps(data, ensure_ascii=False) if data is not None else None, now, expires_at)
+        )
+        self._remember(isbn, expires_at, data)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+        self._connect().execute('DELETE FROM isbn_cache')
+
+
+_cache = None
+
+
+def configure(**options):
+    """Обновляет настройки и пересоздает кэш (вызывается приложением при старте)"""
+    global _cache
+    settings.update({key: value for key, value in options.items() if value is not None})
+    _cache = None
+    with _limiters_lock:
+        _limiters.clear()
+    _reset_pool()
+    if 'timeout' in options:
+        isbnlib.config.seturlopentimeout(settings['timeout'][1])
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = IsbnCache(settings['cache_path'], settings['hit_ttl'],
+                           settings['miss_ttl'], settings['lru_size'])
+    return _cache
+
+
+def cache_stats():
+    """Счетчики попаданий и промахов кэша ISBN"""
+    return dict(get_cache().stats)
+
+
+def _fetch_isbnlib(isbn):
+    book_info = isbnlib.meta(isbn)
+    if not book_info:
+        return None
+
+    # Пытаемся получить обложку
+    cover_url = f"https://covers.openlibrary.org/b/isbn/{isbn}-L.jpg"
+
+    return {
+        'title': book_info.get('Title', ''),
+        'author': book_info.get('Authors', [''])[0],
+        'isbn': isbn,
+        'publisher': book_info.get('Publisher', ''),
+        'publication_year': book_info.get('Year', ''),
+        'language': book_info.get('Language', 'ru'),
+        'cover_image_url': cover_url
+    }
 
-def get_book_by_isbn(isbn):
-    """Получает информацию о книге по ISBN"""
-    try:
-        # Очищаем ISBN
-        clean_isbn = isbnlib.to_isbn13(isbn) if isbnlib.is_isbn10(isbn) else isbn
-
-        # Пробуем разные источники
-        book_info = isbnlib.meta(clean_isbn)
-
-        if book_info:
-            # Пытаемся получить обложку
-            cover_url = f"https://covers.openlibrary.org/b/isbn/{clean_isbn}-L.jpg"
-
-            return {
-                'title': book_info.get('Title', ''),
-                'author': book_info.get('Authors', [''])[0],
-                'isbn': clean_isbn,
-                'publisher': book_info.get('Publisher', ''),
-                'publication_year': book_info.get('Year', ''),
-                'language': book_info.get('Language', 'ru'),
-                'cover_image_url': cover_url
-            }
-
-        # Альтернативный источник - Open Library
-        ol_url = f"https://openlibrary.org/api/books?bibkeys=ISBN:{clean_isbn}&format=json&jscmd=data"
-        response = requests.get(ol_url)
-
-        if response.status_code == 200:
-            data = response.json()
-            book_key = f"ISBN:{clean_isbn}"
-
-            if book_key in data:
-                book_data = data[book_key]
-
-                return {
-                    'title': book_data.get('title', ''),
-                    'author': book_data.get('authors', [{}])[0].get('name', '') if book_data.get('authors') else '',
-                    'isbn': clean_isbn,
-                    'publisher': book_data.get('publishers', [{}])[0].get('name', '') if book_data.get(
-                        'publishers') else '',
-                    'publication_year': book_data.get('publish_date', ''),
-                    'cover_image_url': book_data.get('cover', {}).get('large', ''),
-                    'page_count': book_data.get('number_of_pages')
-                }
 
+def _fetch_openlibrary(isbn):
+    book_key = f"ISBN:{isbn}"
+    response = http_session().get(
+        f"{settings['openlibrary_url']}/api/books",
+        params={'bibkeys': book_key, 'format': 'json', 'jscmd': 'data'},
+        timeout=settings['timeout']
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    if book_key not in data:
         return None
 
+    book_data = data[book_key]
+    return {
+        'title': book_data.get('title', ''),
+        'author': book_data.get('authors', [{}])[0].get('name', '') if book_data.get('authors') else '',
+        'isbn': isbn,
+        'publisher': book_data.get('publishers', [{}])[0].get('name', '') if book_data.get(
+            'publishers') else '',
+        'publication_year': book_data.get('publish_date', ''),
+        'cover_image_url': book_data.get('cover', {}).get('large', ''),
+        'page_count': book_data.get('number_of_pages')
+    }
+
+
+FETCHERS = {
+    'isbnlib': _fetch_isbnlib,
+    'openlibrary': _fetch_openlibrary,
+}
+
+
+class RateLimiter:
+    """Простое ограничение частоты: не чаще rate запросов в секунду"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter(source):
+    with _limiters_lock:
+        if source not in _limiters:
+            _limiters[source] = RateLimiter(settings['rate_limits'].get(source))
+        return _limiters[source]
+
+
+def fetch_book_by_isbn(isbn):
+    """Запрашивает источники по очереди, без кэша.
+
+    Возвращает данные книги или None, если ни один источник её не знает.
+    Если все источники упали с ошибкой, пробрасывает последнюю ошибку.
+    """
+    error = None
+    answered = False
+    for source in settings['sources']:
+        _limiter(source).acquire()
+        try:
+            book = FETCHERS[source](isbn)
+        except Exception as e:
+            settings['logger'].warning('Ошибка запроса ISBN %s к %s: %s', isbn, source, e)
+            error = e
+            continue
+        answered = True
+        if book:
+            return book
+    if not answered and error is not None:
+        raise error
+    return None
+
+
+def get_book_by_isbn(isbn, raise_errors=False):
+    """Получает информацию о книге по ISBN.
+
+    raise_errors=True пробрасывает сетевую ошибку вместо None, чтобы
+    вызывающий код мог отличить сбой от отсутствия книги.
+    """
+    clean_isbn = normalize_isbn(isbn)
+    if clean_isbn is None:
+        return None
+
+    cache = get_cache()
+    cached, book = cache.get(clean_isbn)
+    if cached:
+        return book
+
+    try:
+        book = fetch_book_by_isbn(clean_isbn)
     except Exception as e:
-        print(f"Error fetching book data: {e}")
-        return None
\ No newline at end of file
+        # Сетевые ошибки не кэшируем - повторим при следующем запросе
+        cache.count('errors')
+        settings['logger'].error('Не удалось получить данные по ISBN %s: %s', clean_isbn, e)
+        if raise_errors:
+            raise
+        return None
+
+    cache.put(clean_isbn, book)
+    return book
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings['batch_workers'],
+                                           thread_name_prefix='isbn-lookup')
+        return _executor
+
+
+def _reset_pool():
+    """Пул пересоздается при следующем поиске, например с новым batch_workers"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def prepare_isbns(isbns):
+    """Нормализует список ISBN: возвращает (уникальные ISBN-13 по порядку, некорректные)"""
+    valid = []
+    invalid = []
+    seen = set()
+    for isbn in isbns:
+        clean_isbn = normalize_isbn(isbn)
+        if clean_isbn is None:
+            invalid.append(isbn)
+        elif clean_isbn not in seen:
+            seen.add(clean_isbn)
+            valid.append(clean_isbn)
+    return valid, invalid
+
+
+def iter_books_by_isbn(isbns):
+    """Параллельный поиск: отдает пары (ISBN-13, данные или None) по мере готовности"""
+    futures = {_pool().submit(get_book_by_isbn, isbn): isbn for isbn in isbns}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
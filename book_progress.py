@@ -0,0 +1,58 @@
+"""Сессии чтения и график прогресса на странице книги.
+
+Накопленное число страниц считается оконной функцией SUM() OVER в SQLite.
+Если сессий больше max_points, они группируются в равные по времени
+интервалы: точка интервала - дата последней сессии, накопленный итог на
+ней и сумма страниц за интервал. Так ответ не растет с числом сессий.
+"""
+from sqlalchemy import Integer, cast, func, select
+
+from models import db, ReadingSession
+from pagination import keyset_paginate
+
+SESSIONS_PER_PAGE = 20
+MAX_POINTS = 200
+
+
+def session_page(book_id, cursor=None, per_page=SESSIONS_PER_PAGE):
+    """Страница сессий книги, от новых к старым (KeysetPage)"""
+    query = ReadingSession.query.filter(ReadingSession.book_id == book_id)
+    return keyset_paginate(query, ReadingSession.start_time, ReadingSession.id, 'start_time', True,
+                           cursor=cursor, per_page=per_page)
+
+
+def progress_series(book_id, max_points=MAX_POINTS):
+    """Ряд для графика в колоночном виде: dates, pages (накопленно), session_pages"""
+    day = func.julianday(ReadingSession.start_time)
+    count, first, last = db.session.execute(
+        select(func.count(), func.min(day), func.max(day)).where(ReadingSession.book_id == book_id)
+    ).one()
+
+    pages = func.coalesce(ReadingSession.pages_read, 0)
+    sessions = select(
+        ReadingSession.start_time.label('start_time'),
+        pages.label('pages_read'),
+        func.sum(pages).over(order_by=(ReadingSession.start_time, ReadingSession.id)).label('cumulative'),
+        func.row_number().over(order_by=(ReadingSession.start_time, ReadingSession.id)).label('position'),
+    ).where(ReadingSession.book_id == book_id).subquery()
+
+    if count <= max_points:
+        query = select(sessions.c.start_time, sessions.c.cumulative, sessions.c.pages_read) \
+            .order_by(sessions.c.position)
+        bucketed = False
+    else:
+        width = (last - first) / max_points or 1
+        # Скалярный min() ограничивает номер последнего интервала
+        bucket = func.min(cast((func.julianday(sessions.c.start_time) - first) / width, Integer), max_points - 1)
+        query = select(func.max(sessions.c.start_time), func.max(sessions.c.cumulative),
+                       func.sum(sessions.c.pages_read)).group_by(bucket).order_by(bucket)
+        bucketed = True
+
+    rows = db.session.execute(query).all()
+    return {
+        'dates': [start_time.strftime('%Y-%m-%d') for start_time, _, _ in rows],
+        'pages': [cumulative for _, cumulative, _ in rows],
+        'session_pages': [session_pages for _, _, session_pages in rows],
+        'sessions': count,
+        'bucketed': bucketed,
+    }
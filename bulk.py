@@ -0,0 +1,121 @@
+"""Массовые операции над книгами.
+
+Каждая операция - несколько UPDATE/DELETE ... WHERE id IN (...) пачками по
+ID_CHUNK_SIZE id, чтобы не упереться в лимит параметров SQLite. Все пачки
+идут в одной транзакции, коммит делает вызывающий код. Изменения книг и
+сессий идут через ORM-операторы, поэтому сводная статистика (rollups.py)
+и кэш фильтров (facets.py) обновляются теми же событиями, что и раньше.
+Связи с тегами меняются напрямую, их книги ставятся в очередь похожих
+книг (similar.py) явно.
+"""
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, insert, select, update
+
+from models import db, Book, EnrichmentJob, ReadingSession, Tag, book_tags
+from tags import get_or_create_tags, prune_unused_tags
+from facets import invalidate_after_commit
+from enrichment import enqueue
+from similar import mark
+
+# Лимит параметров в старых сборках SQLite - 999, берем с запасом
+ID_CHUNK_SIZE = 500
+
+BULK_OPERATIONS = ('change_status', 'add_tag', 'remove_tag', 'enrich', 'delete')
+
+
+def chunked(ids, size=ID_CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def parse_ids(values):
+    """id книг из формы: только целые, без повторов, по возрастанию"""
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return sorted(ids)
+
+
+def matching_ids(query):
+    """id всех книг запроса (например, filter_books) без загрузки объектов"""
+    rows = query.order_by(None).with_entities(Book.id).distinct()
+    return sorted(db.session.execute(rows.statement).scalars())
+
+
+def _execute(statement):
+    db.session.execute(statement, execution_options={'synchronize_session': False})
+
+
+def change_status(ids, status):
+    """Меняет статус; у прочитанных без даты окончания ставит дату и последнюю страницу"""
+    if not status:
+        return
+    values = {'reading_status': status}
+    if status == 'прочитана':
+        # В UPDATE правые части видят старые значения строки
+        values['current_page'] = case((Book.date_finished_reading.is_(None), Book.page_count),
+                                      else_=Book.current_page)
+        values['date_finished_reading'] = func.coalesce(Book.date_finished_reading, datetime.utcnow())
+    for chunk in chunked(ids):
+        _execute(update(Book).where(Book.id.in_(chunk)).values(**values))
+
+
+def add_tag(ids, name):
+    """Добавляет тег книгам; уже привязанные пропускаются"""
+    if not name or not ids:
+        return
+    tag = get_or_create_tags([name])[0]
+    db.session.flush()
+    for chunk in chunked(ids):
+        db.session.execute(insert(book_tags).prefix_with('OR IGNORE').from_select(
+            ['book_id', 'tag_id'],
+            select(Book.id, tag.id).where(Book.id.in_(chunk))
+        ))
+    mark(db.session, ids)
+    invalidate_after_commit(db.session, 'tag')
+
+
+def remove_tag(ids, name):
+    """Отвязывает тег от книг и удаляет его, если он больше нигде не используется"""
+    tag_id = db.session.execute(select(Tag.id).where(Tag.name == name)).scalar()
+    if tag_id is None:
+        return
+    for chunk in chunked(ids):
+        db.session.execute(delete(book_tags).where(book_tags.c.tag_id == tag_id,
+                                                   book_tags.c.book_id.in_(chunk)))
+    mark(db.session, ids)
+    prune_unused_tags()
+    invalidate_after_commit(db.session, 'tag')
+
+
+def delete_books(ids):
+    """Удаляет книги вместе с сессиями чтения, связями с тегами и задачами дозаполнения"""
+    for chunk in chunked(ids):
+        _execute(delete(ReadingSession).where(ReadingSession.book_id.in_(chunk)))
+        _execute(delete(EnrichmentJob).where(EnrichmentJob.book_id.in_(chunk)))
+        _execute(delete(Book).where(Book.id.in_(chunk)))
+        db.session.execute(delete(book_tags).where(book_tags.c.book_id.in_(chunk)))
+    prune_unused_tags()
+
+
+def run_bulk_operation(operation, ids, form):
+    """Выполняет операцию из BULK_OPERATIONS по списку id; False для неизвестной операции"""
+    if operation == 'change_status':
+        change_status(ids, form.get('new_status'))
+    elif operation == 'add_tag':
+        add_tag(ids, form.get('new_tag', '').strip())
+    elif operation == 'remove_tag':
+        remove_tag(ids, form.get('new_tag', '').strip())
+    elif operation == 'enrich':
+        enqueue(ids)
+    elif operation == 'delete':
+        delete_books(ids)
+    else:
+        return False
+    # Объекты книг в сессии могли устареть после массовых операторов
+    db.session.expire_all()
+    return True
@@ -0,0 +1,243 @@
+"""Локальный кэш обложек.
+
+Обложка по cover_image_url скачивается один раз в фоновом пуле потоков и
+хранится на диске под sha256 своего содержимого, рядом - уменьшенные копии
+для каждого размера из COVER_SIZES. Страницы ссылаются на /covers/<размер>/<хэш>:
+адрес меняется вместе с содержимым, поэтому ответ кэшируется браузером
+навсегда. Пока обложка не скачана, cover_thumbnail возвращает None и
+страницы показывают удаленный cover_image_url.
+
+Уменьшенные копии делает Pillow - необязательная зависимость: без него
+кэш обложек выключен (available() возвращает False) и страницы всегда
+ссылаются на удаленный адрес, а не на полноразмерную копию.
+"""
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import book_api
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Размер -> (ширина, высота) рамки, в которую вписывается уменьшенная копия
+DEFAULT_SIZES = {
+    'list': (60, 90),
+    'detail': (300, 450),
+}
+
+# Сигнатуры форматов: первые байты файла -> (расширение, MIME-тип)
+_SIGNATURES = (
+    (b'\xff\xd8\xff', ('jpg', 'image/jpeg')),
+    (b'\x89PNG\r\n\x1a\n', ('png', 'image/png')),
+    (b'GIF87a', ('gif', 'image/gif')),
+    (b'GIF89a', ('gif', 'image/gif')),
+    (b'RIFF', ('webp', 'image/webp')),
+)
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class CoverError(Exception):
+    pass
+
+
+def image_type(data):
+    """(расширение, MIME-тип) по содержимому или None, если это не картинка"""
+    for signature, kind in _SIGNATURES:
+        if data.startswith(signature):
+            if signature == b'RIFF' and data[8:12] != b'WEBP':
+                continue
+            return kind
+    return None
+
+
+def available():
+    return Image is not None
+
+
+def make_thumbnail(data, box):
+    """Уменьшенная копия в JPEG, вписанная в box (нужен Pillow)"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail(box)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=85, optimize=True)
+    return output.getvalue(), ('jpg', 'image/jpeg')
+
+
+class CoverStore:
+    def __init__(self):
+        self.root = None
+        self.sizes = dict(DEFAULT_SIZES)
+        self.timeout = (3.05, 10)
+        self.max_bytes = 5 * 1024 * 1024
+        self.retry_after = 3600
+        self.workers = 4
+        # url -> хэш содержимого; неудачные загрузки не запоминаются, чтобы их можно было повторить
+        self._known = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = None
+        self.stats = {'fetched': 0, 'failed': 0, 'thumbnails': 0}
+
+    def init_app(self, app):
+        """Настройки: COVERS_PATH, COVER_SIZES, COVER_WORKERS, COVER_MAX_BYTES,
+        COVER_HTTP_TIMEOUT, COVER_RETRY_AFTER"""
+        self.root = app.config.setdefault('COVERS_PATH', os.path.join(app.instance_path, 'covers'))
+        self.sizes = dict(app.config.get('COVER_SIZES', DEFAULT_SIZES))
+        self.workers = app.config.get('COVER_WORKERS', 4)
+        self.max_bytes = app.config.get('COVER_MAX_BYTES', 5 * 1024 * 1024)
+        self.timeout = app.config.get('COVER_HTTP_TIMEOUT', (3.05, 10))
+        self.retry_after = app.config.get('COVER_RETRY_AFTER', 3600)
+        with self._lock:
+            self._known.clear()
+        self._local = threading.local()
+        os.makedirs(self.root, exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS covers ('
+            'url TEXT PRIMARY KEY, digest TEXT, mimetype TEXT, error TEXT, fetched_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, 'covers.db'), timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cover-fetch')
+            return self._executor
+
+    def path(self, size, digest):
+        """Файл обложки: size - имя размера или 'original'"""
+        return os.path.join(self.root, size, digest[:2], digest)
+
+    def _write(self, size, digest, data):
+        path = self.path(size, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: читатель не увидит недописанную картинку
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+    def _lookup(self, url):
+        with self._lock:
+            if url in self._known:
+                return True, self._known[url]
+        row = self._connect().execute('SELECT digest, error, fetched_at FROM covers WHERE url = ?',
+                                      (url,)).fetchone()
+        if row is None:
+            return False, None
+        digest, error, fetched_at = row
+        # Неудачную загрузку повторяем не раньше чем через retry_after секунд
+        if digest is None:
+            return time.time() - fetched_at <= self.retry_after, None
+        with self._lock:
+            self._known[url] = digest
+        return True, digest
+
+    def download(self, url):
+        response = book_api.http_session().get(url, timeout=self.timeout, stream=True)
+        try:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise CoverError(f'Обложка больше {self.max_bytes} байт')
+                chunks.append(chunk)
+        finally:
+            response.close()
+        return b''.join(chunks)
+
+    def store(self, data):
+        """Сохраняет картинку и её уменьшенные копии; возвращает хэш содержимого"""
+        kind = image_type(data)
+        if kind is None:
+            raise CoverError('Неизвестный формат картинки')
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path('original', digest)):
+            self._write('original', digest, data)
+        for size, box in self.sizes.items() if available() else ():
+            if not os.path.exists(self.path(size, digest)):
+                thumbnail, _ = make_thumbnail(data, box)
+                self._write(size, digest, thumbnail)
+                with self._lock:
+                    self.stats['thumbnails'] += 1
+        return digest, kind[1]
+
+    def fetch(self, url):
+        """Скачивает и сохраняет обложку (выполняется в пуле); возвращает хэш или None"""
+        digest = mimetype = error = None
+        try:
+            digest, mimetype = self.store(self.download(url))
+        except Exception as e:
+            error = str(e)[:500]
+        self._connect().execute(
+            'INSERT OR REPLACE INTO covers (url, digest, mimetype, error, fetched_at) VALUES (?, ?, ?, ?, ?)',
+            (url, digest, mimetype, error, time.time())
+        )
+        with self._lock:
+            if digest:
+                self._known[url] = digest
+            self._pending.pop(url, None)
+            self.stats['fetched' if digest else 'failed'] += 1
+        return digest
+
+    def schedule(self, url):
+        """Ставит загрузку в очередь пула, если она еще не идет"""
+        executor = self._pool()
+        with self._lock:
+            future = self._pending.get(url)
+            if future is None:
+                # fetch снимет отметку под той же блокировкой, уже после этой записи
+                future = self._pending[url] = executor.submit(self.fetch, url)
+        return future
+
+    def thumbnail(self, url, size):
+        """Локальный адрес (размер, хэш) обложки или None; неизвестные обложки ставятся в очередь"""
+        if not url or self.root is None or not available():
+            return None
+        found, digest = self._lookup(url)
+        if not found:
+            self.schedule(url)
+            return None
+        return (size, digest) if digest else None
+
+    def mimetype(self, size, digest):
+        if size != 'original':
+            return 'image/jpeg'
+        with open(self.path('original', digest), 'rb') as file:
+            kind = image_type(file.read(16))
+        return kind[1] if kind else 'application/octet-stream'
+
+    def drain(self, timeout=None):
+        """Ждет завершения поставленных загрузок (для команд CLI и проверок)"""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures, timeout=timeout)
+
+    def info(self):
+        with self._lock:
+            stats = dict(self.stats, pending=len(self._pending))
+        stats.update(zip(('stored', 'errors'), self._connect().execute(
+            'SELECT count(digest), count(*) - count(digest) FROM covers').fetchone()))
+        stats['pillow'] = available()
+        return stats
+
+
+cover_store = CoverStore()
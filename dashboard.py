@@ -0,0 +1,112 @@
+"""Данные главной страницы.
+
+Счетчики считаются одним запросом с условной агрегацией, списки книг
+загружают только нужные колонки, а результат собирается в легкие
+объекты со __slots__, которые одинаково отдаются в шаблон и в JSON.
+"""
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import load_only
+
+from models import db, Book
+
+# Сколько книг показывать в каждом списке
+RECENT_LIMIT = 5
+READING_LIMIT = 10
+
+_SUMMARY_COLUMNS = (Book.id, Book.title, Book.author, Book.page_count, Book.current_page,
+                    Book.date_added, Book.date_finished_reading)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+class BookSummary:
+    """Книга в виджетах главной страницы"""
+    __slots__ = ('id', 'title', 'author', 'page_count', 'current_page',
+                 'date_added', 'date_finished_reading', 'progress')
+
+    def __init__(self, book):
+        self.id = book.id
+        self.title = book.title
+        self.author = book.author
+        self.page_count = book.page_count
+        self.current_page = book.current_page or 0
+        self.date_added = book.date_added
+        self.date_finished_reading = book.date_finished_reading
+        # Процент прочитанного; None, если число страниц неизвестно
+        self.progress = min(round(self.current_page / self.page_count * 100), 100) if self.page_count else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'author': self.author,
+            'page_count': self.page_count,
+            'current_page': self.current_page,
+            'progress': self.progress,
+            'date_added': _iso(self.date_added),
+            'date_finished_reading': _iso(self.date_finished_reading)
+        }
+
+
+class Dashboard:
+    __slots__ = ('total_books', 'reading_books', 'completed_books',
+                 'recent_books', 'current_reading', 'more_reading', 'recently_finished')
+
+    def __init__(self, total_books, reading_books, completed_books,
+                 recent_books, current_reading, more_reading, recently_finished):
+        self.total_books = total_books
+        self.reading_books = reading_books
+        self.completed_books = completed_books
+        self.recent_books = recent_books
+        self.current_reading = current_reading
+        # Есть ли книги в чтении сверх показанных READING_LIMIT
+        self.more_reading = more_reading
+        self.recently_finished = recently_finished
+
+    def to_dict(self):
+        return {
+            'total_books': self.total_books,
+            'reading_books': self.reading_books,
+            'completed_books': self.completed_books,
+            'recent_books': [book.to_dict() for book in self.recent_books],
+            'current_reading': [book.to_dict() for book in self.current_reading],
+            'more_reading': self.more_reading,
+            'recently_finished': [book.to_dict() for book in self.recently_finished]
+        }
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _summaries(query, limit):
+    return [BookSummary(book) for book in query.options(load_only(*_SUMMARY_COLUMNS)).limit(limit)]
+
+
+def load_dashboard():
+    """Собирает данные главной страницы: один агрегирующий запрос и три ограниченных списка"""
+    total_books, reading_books, completed_books = db.session.execute(select(
+        func.count(Book.id),
+        _count_if(Book.reading_status == 'читаю'),
+        _count_if(Book.reading_status == 'прочитана')
+    )).one()
+
+    recent_books = _summaries(Book.query.order_by(Book.date_added.desc(), Book.id.desc()), RECENT_LIMIT)
+
+    current_reading = _summaries(
+        Book.query.filter_by(reading_status='читаю')
+        .order_by(Book.date_started_reading.desc(), Book.id.desc()),
+        READING_LIMIT + 1
+    )
+
+    recently_finished = _summaries(
+        Book.query.filter(Book.reading_status == 'прочитана', Book.date_finished_reading.isnot(None))
+        .order_by(Book.date_finished_reading.desc()),
+        RECENT_LIMIT
+    )
+
+    return Dashboard(total_books, reading_books, completed_books,
+                     recent_books, current_reading[:READING_LIMIT],
+                     len(current_reading) > READING_LIMIT, recently_finished)
@@ -1,10 +1,12 @@
 from models import db, Book, Author, ReadingSession, ReadingGoal
+from migrations import run_migrations
+from tags import set_book_tags
 from datetime import datetime
 
 
 def init_db():
     """Инициализация базы данных с тестовыми данными"""
-    db.create_all()
+    run_migrations()
 
     # Добавляем тестовых авторов
     authors = [
@@ -25,7 +27,6 @@ def init_db():
             author="Фёдор Достоевский",
             author_id=authors[0].id,
             genre="Роман",
-            tags="классика, психология, философия",
             description="Роман о моральных страданиях и психической боли.",
             page_count=551,
             reading_status="прочитана",
@@ -38,7 +39,6 @@ def init_db():
             author="Лев Толстой",
             author_id=authors[1].id,
             genre="Роман-эпопея",
-            tags="классика, исторический, философия",
             description="Роман-эпопея, описывающий русское общество в эпоху войн против Наполеона.",
             page_count=1225,
             reading_status="читаю",
@@ -49,6 +49,9 @@ def init_db():
         )
     ]
 
+    set_book_tags(books[0], "классика, психология, философия")
+    set_book_tags(books[1], "классика, исторический, философия")
+
     for book in books:
         db.session.add(book)
 
@@ -0,0 +1,246 @@
+"""Генератор синтетической библиотеки для замеров производительности.
+
+Авторы, жанры и теги выбираются с распределением, близким к закону Ципфа
+(немного популярных значений и длинный хвост), тексты собираются из
+русских слов. Строки пишутся пачками через executemany в обход ORM,
+после чего пересобираются сводная статистика и кэш фильтров.
+"""
+import itertools
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import db, Author, Book, ReadingSession, ReadingGoal, Tag, book_tags
+from rollups import rebuild_rollups
+from facets import facet_cache
+from suggest import suggest_index
+from analytics import bump_version
+from similar import queue_all
+from duplicates import rebuild_name_index
+from storage import begin_write
+
+# Готовые размеры: books, sessions
+PRESETS = {
+    'small': (1000, 10000),
+    'medium': (100000, 1000000),
+    'large': (1000000, 10000000),
+}
+
+CHUNK_SIZE = 10000
+
+GENRES = ['Роман', 'Детектив', 'Фантастика', 'Фэнтези', 'Классика', 'Поэзия', 'Драма',
+          'Биография', 'История', 'Психология', 'Философия', 'Приключения', 'Триллер',
+          'Научно-популярное', 'Публицистика', 'Сказки', 'Ужасы', 'Мемуары', 'Юмор', 'Роман-эпопея']
+
+STATUSES = ['не начата', 'читаю', 'прочитана', 'брошена', 'в планах']
+STATUS_WEIGHTS = [30, 5, 45, 5, 15]
+
+LANGUAGES = ['Russian', 'English', 'French', 'German']
+LANGUAGE_WEIGHTS = [80, 12, 4, 4]
+
+FIRST_NAMES = ['Александр', 'Михаил', 'Анна', 'Мария', 'Фёдор', 'Лев', 'Иван', 'Ольга',
+               'Сергей', 'Елена', 'Дмитрий', 'Татьяна', 'Николай', 'Марина', 'Алексей', 'Юлия',
+               'Борис', 'Варвара', 'Григорий', 'Ксения', 'Пётр', 'Людмила', 'Владимир', 'Нина']
+LAST_NAMES = ['Пушкин', 'Толстой', 'Чехов', 'Булгаков', 'Ахматова', 'Цветаева', 'Гоголь',
+              'Лермонтов', 'Тургенев', 'Набоков', 'Пастернак', 'Бунин', 'Куприн', 'Платонов',
+              'Шолохов', 'Распутин', 'Солженицын', 'Довлатов', 'Стругацкий', 'Пелевин',
+              'Улицкая', 'Ильф', 'Зощенко', 'Гончаров', 'Лесков', 'Островский', 'Грибоедов']
+
+WORDS = ('война мир время жизнь дом путь ночь свет тень сердце память город море звезда '
+         'человек любовь смерть история дорога ветер огонь вода земля небо сад лес река '
+         'тайна судьба дар слово песня зима весна лето осень утро вечер мастер белый '
+         'красный тихий долгий последний первый старый новый странный далёкий ёлка').split()
+
+PUBLISHERS = ['АСТ', 'Эксмо', 'Азбука', 'Иностранка', 'Альпина', 'Питер', 'Самокат', 'Вече']
+
+
+def _zipf_weights(count, exponent=1.1):
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def _sentence(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+def _isbn(rng):
+    """Случайный ISBN-13 с правильной контрольной цифрой (уже нормализованный)"""
+    digits = f'978{rng.randint(0, 10 ** 9 - 1):09d}'
+    check = -sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10
+    return f'{digits}{check}'
+
+
+def _chunks(total):
+    for start in range(0, total, CHUNK_SIZE):
+        yield start, min(CHUNK_SIZE, total - start)
+
+
+class LibraryGenerator:
+    def __init__(self, books, sessions, seed=1, start_date=None):
+        self.books = books
+        self.sessions = sessions
+        self.rng = random.Random(seed)
+        self.end_date = start_date or datetime(2025, 12, 31)
+        self.start_date = self.end_date - timedelta(days=5 * 365)
+        # Примерно 20 книг на автора и 1 тег на 500 книг, но не меньше 50
+        self.author_count = max(books // 20, 10)
+        self.tag_count = max(books // 500, 50)
+
+    def _date(self):
+        span = (self.end_date - self.start_date).total_seconds()
+        return self.start_date + timedelta(seconds=self.rng.random() * span)
+
+    def _insert(self, table, rows):
+        if rows:
+            db.session.connection().execute(table.insert(), rows)
+
+    def _names(self, count, make):
+        names = set()
+        while len(names) < count:
+            names.add(make(len(names)))
+        return sorted(names)
+
+    def generate_authors(self):
+        rng = self.rng
+        names = self._names(self.author_count, lambda n: (
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            + ('' if n < len(FIRST_NAMES) * len(LAST_NAMES) // 2 else f' {n}')))
+        first_id = (db.session.execute(select(func.max(Author.id))).scalar() or 0) + 1
+        existing = set(db.session.execute(select(Author.name)).scalars())
+        names = [name for name in names if name not in existing]
+        self._insert(Author.__table__, [
+            {'id': author_id, 'name': name, 'biography': _sentence(rng, 10, 30)}
+            for author_id, name in enumerate(names, start=first_id)
+        ])
+        return db.session.execute(select(Author.id, Author.name)).all()
+
+    def generate_tags(self):
+        names = self._names(self.tag_count, lambda n: f'{self.rng.choice(WORDS)}-{n}' if n >= 30 else WORDS[n])
+        existing = set(db.session.execute(select(Tag.name)).scalars())
+        self._insert(Tag.__table__, [{'name': name} for name in names if name not in existing])
+        return db.session.execute(select(Tag.id)).scalars().all()
+
+    def generate_books(self, authors, tag_ids):
+        rng = self.rng
+        author_weights = _zipf_weights(len(authors))
+        genre_weights = _zipf_weights(len(GENRES), 0.8)
+        tag_weights = _zipf_weights(len(tag_ids))
+        # Как в importer.py: id после max(id) безопасны под блокировкой записи
+        begin_write(db.session)
+        first_id = (db.session.execute(select(func.max(Book.id))).scalar() or 0) + 1
+
+        for start, size in _chunks(self.books):
+            rows = []
+            links = []
+            chosen_authors = rng.choices(authors, cum_weights=author_weights, k=size)
+            for offset, (author_id, author_name) in enumerate(chosen_authors):
+                book_id = first_id + start + offset
+                status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+                page_count = rng.randint(60, 1200)
+                date_added = self._date()
+                started = finished = None
+                current_page = 0
+                if status in ('читаю', 'прочитана', 'брошена'):
+                    started = date_added + timedelta(days=rng.randint(0, 60))
+                    current_page = rng.randint(1, page_count)
+                if status == 'прочитана':
+                    finished = started + timedelta(days=rng.randint(3, 90))
+                    current_page = page_count
+                isbn = _isbn(rng) if rng.random() < 0.7 else None
+                rows.append({
+                    'id': book_id,
+                    'title': _sentence(rng, 1, 5).capitalize(),
+                    'author': author_name,
+                    'author_id': author_id,
+                    'isbn': isbn,
+                    'isbn_normalized': isbn,
+                    'publication_year': rng.randint(1800, 2025),
+                    'publisher': rng.choice(PUBLISHERS),
+                    'genre': rng.choices(GENRES, cum_weights=genre_weights)[0] if rng.random() < 0.95 else None,
+                    'description': _sentence(rng, 20, 80),
+                    'cover_image_url': None,
+                    'language': rng.choices(LANGUAGES, LANGUAGE_WEIGHTS)[0],
+                    'page_count': page_count,
+                    'physical_location': f'Полка {rng.randint(1, 40)}',
+                    'reading_status': status,
+                    'my_rating': rng.randint(1, 10) if status == 'прочитана' and rng.random() < 0.8 else None,
+                    'date_added': date_added,
+                    'date_started_reading': started,
+                    'date_finished_reading': finished,
+                    'notes': _sentence(rng, 5, 20) if rng.random() < 0.2 else None,
+                    'current_page': current_page,
+                })
+                for tag_id in set(rng.choices(tag_ids, cum_weights=tag_weights, k=rng.randint(0, 4))):
+                    links.append({'book_id': book_id, 'tag_id': tag_id})
+            self._insert(Book.__table__, rows)
+            self._insert(book_tags, links)
+            yield size
+
+    def generate_sessions(self):
+        rng = self.rng
+        book_ids = db.session.execute(select(Book.id).where(Book.date_started_reading.isnot(None))).scalars().all()
+        if not book_ids:
+            return
+        # Популярные книги читают чаще
+        rng.shuffle(book_ids)
+        weights = _zipf_weights(len(book_ids), 0.7)
+
+        for start, size in _chunks(self.sessions):
+            rows = []
+            for book_id in rng.choices(book_ids, cum_weights=weights, k=size):
+                start_time = self._date()
+                duration = rng.randint(10, 180)
+                rows.append({
+                    'book_id': book_id,
+                    'start_time': start_time,
+                    'end_time': start_time + timedelta(minutes=duration),
+                    'pages_read': max(1, duration // rng.randint(1, 4)),
+                    'duration_minutes': duration if rng.random() < 0.9 else None,
+                })
+            self._insert(ReadingSession.__table__, rows)
+            yield size
+
+    def generate_goals(self):
+        existing = set(db.session.execute(select(ReadingGoal.year, ReadingGoal.goal_type)).all())
+        rows = []
+        for year in range(self.start_date.year, self.end_date.year + 1):
+            for goal_type, target in (('books', 50), ('pages', 15000), ('minutes', 20000)):
+                if (year, goal_type) not in existing:
+                    rows.append({'year': year, 'goal_type': goal_type, 'target': target})
+        self._insert(ReadingGoal.__table__, rows)
+
+    def run(self, progress=None):
+        """Заполняет базу; progress(стадия, сделано, всего) вызывается после каждой пачки"""
+        progress = progress or (lambda stage, done, total: None)
+
+        authors = self.generate_authors()
+        tag_ids = self.generate_tags()
+        progress('authors', len(authors), len(authors))
+
+        done = 0
+        for size in self.generate_books(authors, tag_ids):
+            done += size
+            db.session.commit()
+            progress('books', done, self.books)
+
+        done = 0
+        for size in self.generate_sessions():
+            done += size
+            db.session.commit()
+            progress('sessions', done, self.sessions)
+
+        self.generate_goals()
+        rebuild_rollups(db.session.connection())
+        # Вставки идут в таблицы напрямую, мимо событий сессии
+        bump_version(db.session.connection())
+        queue_all(db.session.connection())
+        rebuild_name_index(db.session.connection())
+        db.session.commit()
+        facet_cache.invalidate()
+        suggest_index.invalidate()
+        progress('done', 1, 1)
+
+
+def generate_library(books=1000, sessions=10000, seed=1, progress=None):
+    """Добавляет в текущую базу books книг и sessions сессий чтения"""
+    LibraryGenerator(books, sessions, seed).run(progress)
@@ -0,0 +1,501 @@
+"""Поиск дублей книг и псевдонимов авторов.
+
+ISBN приводится к ISBN-13 без дефисов (book_api.normalize_isbn) и хранится
+в индексированной колонке books.isbn_normalized, поэтому точный дубль
+находится одним поиском по индексу.
+
+Для нечетких совпадений названия и имена нормализуются (регистр, ё/е,
+пунктуация) и раскладываются на триграммы: названия - в title_trigrams,
+слова имен авторов - в author_trigrams; trigram_counts хранит, сколько
+строк содержат каждую триграмму. Кандидаты ищутся фильтром по префиксу:
+строка со сходством Жаккара не ниже порога обязана разделять с искомой
+хотя бы одну из её самых редких триграмм, поэтому читаются только
+короткие списки, а не вся библиотека. Триграммы названий разложены по
+автору книги, поэтому проверка новой книги читает только книги её автора
+и его других записей. Кандидаты проверяются точным сходством.
+
+Отчет по библиотеке (duplicate_report) делает то же для всех пар сразу
+(all-pairs) внутри книг каждого автора и останавливается на limit находках.
+
+Индекс поддерживают события сессии, как и сводку в rollups.py; массовые
+UPDATE книг названия не меняют. После прямых вставок (datagen) нужен
+rebuild_name_index.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from sqlalchemy import bindparam, delete, event, func, insert, select, text
+from sqlalchemy.orm import Session, attributes
+
+from book_api import normalize_isbn
+from models import db, Author, Book, author_trigrams, title_trigrams, trigram_counts
+from analytics import bump_version, current_version
+
+# Минимальное сходство Жаккара триграмм названий и слов имени
+TITLE_THRESHOLD = 0.6
+NAME_THRESHOLD = 0.6
+VERSION_NAME = 'names'
+
+MAX_MATCHES = 10
+REPORT_LIMIT = 500
+
+_NON_WORD = re.compile(r'[\W_]+')
+_ID_CHUNK = 500
+
+_COUNT = text('INSERT INTO trigram_counts (kind, trigram, count) VALUES (:kind, :trigram, :delta) '
+              'ON CONFLICT (kind, trigram) DO UPDATE SET count = count + excluded.count')
+
+
+def normalize_text(value):
+    """Нижний регистр, ё -> е, без пунктуации и лишних пробелов"""
+    return ' '.join(_NON_WORD.sub(' ', (value or '').casefold().replace('ё', 'е')).split())
+
+
+def trigrams(value):
+    """Триграммы нормализованной строки с пробелами по краям"""
+    normalized = normalize_text(value)
+    if not normalized:
+        return frozenset()
+    padded = f' {normalized} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def name_words(name):
+    return normalize_text(name).split()
+
+
+def name_trigrams(name):
+    """Триграммы слов имени длиннее двух букв; инициалы в индекс не попадают"""
+    return frozenset().union(*(_word_trigrams(word) for word in name_words(name) if len(word) > 2))
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    common = len(first & second)
+    return common / (len(first) + len(second) - common)
+
+
+@lru_cache(maxsize=100000)
+def _word_trigrams(word):
+    return trigrams(word)
+
+
+def same_author(first, second):
+    """Похоже ли на одного автора: одна фамилия (с опечаткой) и совместимые инициалы.
+
+    «Достоевский Ф.», «Ф. М. Достоевский» и «Фёдор Достоевский» совпадают,
+    «Лев Толстой» и «Алексей Толстой» - нет.
+    """
+    words_first, words_second = name_words(first), name_words(second)
+    for word in words_first:
+        if len(word) < 3:
+            continue
+        for other in words_second:
+            if len(other) < 3 or (word != other and
+                                  jaccard(_word_trigrams(word), _word_trigrams(other)) < NAME_THRESHOLD):
+                continue
+            initials_first = {rest[0] for rest in words_first if rest != word}
+            initials_second = {rest[0] for rest in words_second if rest != other}
+            if initials_first <= initials_second or initials_second <= initials_first:
+                return True
+    return False
+
+
+# Вид -> (таблица, колонки ссылки после trigram, разбиение на триграммы).
+# Триграммы названий разложены по авторам: проверка новой книги читает
+# только книги её автора
+KINDS = {
+    'title': (title_trigrams, ('author_id', 'book_id'), trigrams),
+    'author': (author_trigrams, ('author_id',), name_trigrams),
+}
+
+
+def _title_ref(author_id, book_id):
+    # У книг без записи автора author_id = 0: колонка входит в первичный ключ
+    return author_id or 0, book_id
+
+
+class TrigramDelta:
+    """Изменения индекса триграмм за сброс сессии; применяются пачкой"""
+
+    def __init__(self):
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.changed = False
+
+    def change(self, kind, ref, old, new, new_ref=None):
+        """Строка ref сменила текст old на new (None - нет строки); new_ref - если сменилась и ссылка"""
+        _, _, split = KINDS[kind]
+        old_grams, new_grams = split(old), split(new)
+        if new_ref is not None and new_ref != ref:
+            self.removed[kind].update((gram, ref) for gram in old_grams)
+            self.added[kind].update((gram, new_ref) for gram in new_grams)
+        else:
+            self.removed[kind].update((gram, ref) for gram in old_grams - new_grams)
+            self.added[kind].update((gram, ref) for gram in new_grams - old_grams)
+        self.changed = True
+
+    def apply(self, connection):
+        if not self.changed:
+            return
+        for kind, (table, columns, _) in KINDS.items():
+            removed, added = self.removed[kind], self.added[kind]
+            if removed:
+                connection.execute(
+                    delete(table).where(table.c.trigram == bindparam('gram'),
+                                        *(table.c[column] == bindparam(f'ref_{column}') for column in columns)),
+                    [{'gram': gram, **{f'ref_{column}': value for column, value in zip(columns, ref)}}
+                     for gram, ref in removed])
+            if added:
+                connection.execute(insert(table).prefix_with('OR IGNORE'),
+                                   [{'trigram': gram, **dict(zip(columns, ref))} for gram, ref in added])
+            counts = Counter(gram for gram, _ in added)
+            counts.subtract(gram for gram, _ in removed)
+            deltas = [{'kind': kind, 'trigram': gram, 'delta': delta} for gram, delta in counts.items() if delta]
+            if deltas:
+                connection.execute(_COUNT, deltas)
+        bump_version(connection, VERSION_NAME)
+
+
+def _previous(obj, field):
+    history = attributes.get_history(obj, field)
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+def _changed(obj, field):
+    return attributes.get_history(obj, field).has_changes()
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    delta = TrigramDelta()
+    for obj in session.new:
+        if isinstance(obj, Book):
+            delta.change('title', _title_ref(obj.author_id, obj.id), None, obj.title)
+        elif isinstance(obj, Author):
+            delta.change('author', (obj.id,), None, obj.name)
+    for obj in session.deleted:
+        if isinstance(obj, Book):
+            delta.change('title', _title_ref(_previous(obj, 'author_id'), obj.id), _previous(obj, 'title'), None)
+        elif isinstance(obj, Author):
+            delta.change('author', (obj.id,), _previous(obj, 'name'), None)
+    for obj in session.dirty:
+        if obj in session.deleted:
+            continue
+        if isinstance(obj, Book):
+            if _changed(obj, 'title') or _changed(obj, 'author_id'):
+                delta.change('title', _title_ref(_previous(obj, 'author_id'), obj.id), _previous(obj, 'title'),
+                             obj.title, new_ref=_title_ref(obj.author_id, obj.id))
+            elif _changed(obj, 'isbn_normalized') or _changed(obj, 'author'):
+                # Отчет о дублях зависит и от ISBN, и от имени автора в книге
+                delta.changed = True
+        elif isinstance(obj, Author) and _changed(obj, 'name'):
+            delta.change('author', (obj.id,), _previous(obj, 'name'), obj.name)
+    delta.apply(session.connection())
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in (Book, Author):
+        return None
+    session = orm_execute_state.session
+    delta = TrigramDelta()
+
+    if orm_execute_state.is_delete:
+        if mapper.class_ is Book:
+            statement = select(Book.author_id, Book.id, Book.title)
+        else:
+            statement = select(Author.id, Author.name)
+        if orm_execute_state.statement.whereclause is not None:
+            statement = statement.where(orm_execute_state.statement.whereclause)
+        for row in session.execute(statement):
+            if mapper.class_ is Book:
+                delta.change('title', _title_ref(row[0], row[1]), row[2], None)
+            else:
+                delta.change('author', (row[0],), row[1], None)
+        delta.apply(session.connection())
+        return None
+
+    if not orm_execute_state.is_insert or not isinstance(orm_execute_state.parameters, list):
+        return None
+    if mapper.class_ is Book:
+        # Импорт назначает id книг сам
+        for values in orm_execute_state.parameters:
+            if 'id' in values:
+                delta.change('title', _title_ref(values.get('author_id'), values['id']), None, values.get('title'))
+        delta.apply(session.connection())
+        return None
+    # id новых авторов из импорта становятся известны только после вставки
+    last_id = session.execute(select(func.max(Author.id))).scalar() or 0
+    frozen = orm_execute_state.invoke_statement().freeze()
+    for author_id, name in session.execute(select(Author.id, Author.name).where(Author.id > last_id)):
+        delta.change('author', (author_id,), None, name)
+    delta.apply(session.connection())
+    return frozen()
+
+
+@event.listens_for(Book, 'before_insert')
+@event.listens_for(Book, 'before_update')
+def _normalize_isbn(mapper, connection, target):
+    target.isbn_normalized = normalize_isbn(target.isbn)
+
+
+def rebuild_name_index(connection):
+    """Заново строит триграммы названий и имен (после вставок мимо сессии)"""
+    connection.execute(delete(trigram_counts))
+    sources = {
+        'title': select(Book.title, Book.author_id, Book.id),
+        'author': select(Author.name, Author.id),
+    }
+    for kind, (table, columns, split) in KINDS.items():
+        connection.execute(delete(table))
+        counts = Counter()
+        rows = []
+        for value, *ref in connection.execute(sources[kind]):
+            if kind == 'title':
+                ref = _title_ref(*ref)
+            grams = split(value)
+            counts.update(grams)
+            rows.extend({'trigram': gram, **dict(zip(columns, ref))} for gram in grams)
+            if len(rows) >= 10000:
+                connection.execute(insert(table), rows)
+                rows = []
+        if rows:
+            connection.execute(insert(table), rows)
+        if counts:
+            connection.execute(insert(trigram_counts), [{'kind': kind, 'trigram': gram, 'count': count}
+                                                        for gram, count in counts.items()])
+    bump_version(connection, VERSION_NAME)
+
+
+def normalize_isbns(connection):
+    """Заполняет books.isbn_normalized у книг с ISBN"""
+    rows = connection.execute(select(Book.id, Book.isbn).where(Book.isbn.isnot(None), Book.isbn != '')).all()
+    values = [{'ref': book_id, 'value': normalize_isbn(isbn)} for book_id, isbn in rows]
+    if values:
+        connection.execute(Book.__table__.update().where(Book.__table__.c.id == bindparam('ref'))
+                           .values(isbn_normalized=bindparam('value')), values)
+
+
+def _prefix(grams, counts, threshold):
+    """Самые редкие триграммы, одну из которых обязан содержать любой кандидат"""
+    ordered = sorted(grams, key=lambda gram: (counts.get(gram, 0), gram))
+    return ordered[:len(ordered) - math.ceil(threshold * len(ordered)) + 1]
+
+
+def _rare_prefix(kind, grams, threshold):
+    counts = dict(db.session.execute(select(trigram_counts.c.trigram, trigram_counts.c.count).where(
+        trigram_counts.c.kind == kind, trigram_counts.c.trigram.in_(grams))).all())
+    # Триграммы, которых нет ни у одной строки, кандидатов не дают
+    return [gram for gram in _prefix(grams, counts, threshold) if counts.get(gram)]
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), _ID_CHUNK):
+        yield ids[start:start + _ID_CHUNK]
+
+
+def _author_matches(name):
+    """{id: имя} всех авторов, похожих на name, включая записанных так же"""
+    ids = set()
+    for word in name_words(name):
+        if len(word) < 3:
+            continue
+        prefix = _rare_prefix('author', trigrams(word), NAME_THRESHOLD)
+        if prefix:
+            ids.update(db.session.execute(select(author_trigrams.c.author_id).where(
+                author_trigrams.c.trigram.in_(prefix)).distinct()).scalars())
+    matches = {}
+    for chunk in _chunks(sorted(ids)):
+        matches.update((author_id, other) for author_id, other in db.session.execute(
+            select(Author.id, Author.name).where(Author.id.in_(chunk))) if same_author(name, other))
+    return matches
+
+
+def author_aliases(name, exclude_id=None, limit=MAX_MATCHES, matches=None):
+    """Авторы, похожие на name, но записанные иначе: [Author]"""
+    matches = _author_matches(name) if matches is None else matches
+    normalized = normalize_text(name)
+    ids = [author_id for author_id, other in matches.items()
+           if author_id != exclude_id and normalize_text(other) != normalized]
+    if not ids:
+        return []
+    return Author.query.filter(Author.id.in_(ids)).order_by(Author.name, Author.id).limit(limit).all()
+
+
+def find_duplicates(title, author=None, isbn=None, exclude_id=None, limit=MAX_MATCHES):
+    """Возможные дубли новой книги.
+
+    {'isbn': [Book] с тем же ISBN, 'similar': [(Book, сходство)] с похожим
+    названием и тем же автором, 'authors': [Author] - другие записи автора}.
+    Без автора ищутся только дубли по ISBN.
+    """
+    result = {'isbn': [], 'similar': [], 'authors': []}
+    isbn_key = normalize_isbn(isbn)
+    if isbn_key:
+        query = Book.query.filter(Book.isbn_normalized == isbn_key)
+        if exclude_id is not None:
+            query = query.filter(Book.id != exclude_id)
+        result['isbn'] = query.order_by(Book.id).limit(limit).all()
+
+    matches = _author_matches(author) if author else {}
+    if author:
+        result['authors'] = author_aliases(author, limit=limit, matches=matches)
+
+    grams = trigrams(title)
+    prefix = _rare_prefix('title', grams, TITLE_THRESHOLD) if grams and author else []
+    if not prefix:
+        return result
+    # Похожее название - дубль, только если и автор тот же: читаем
+    # триграммы книг его записей и книг без записи автора
+    statement = (select(Book.id, Book.title, Book.author, title_trigrams.c.author_id)
+                 .join(title_trigrams, title_trigrams.c.book_id == Book.id)
+                 .where(title_trigrams.c.trigram.in_(prefix),
+                        title_trigrams.c.author_id.in_(sorted(matches) + [0]))
+                 .distinct())
+    seen = {book.id for book in result['isbn']} | {exclude_id}
+    scores = {}
+    for book_id, other, other_author, author_id in db.session.execute(statement):
+        if book_id in seen or (not author_id and not same_author(author, other_author)):
+            continue
+        score = jaccard(grams, trigrams(other))
+        if score >= TITLE_THRESHOLD:
+            scores[book_id] = round(score, 3)
+    best = sorted(scores, key=lambda book_id: (-scores[book_id], book_id))[:limit]
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(best))} if best else {}
+    result['similar'] = [(books[book_id], scores[book_id]) for book_id in best if book_id in books]
+    return result
+
+
+def has_duplicates(found):
+    return any(found.values())
+
+
+def _similar_pairs(items, counts, threshold):
+    """Все пары (a, b, сходство) из {id: триграммы} со сходством не ниже threshold.
+
+    Алгоритм all-pairs: элементы идут по возрастанию размера, в индекс
+    попадают только префиксы из редких триграмм, а кандидаты меньше
+    threshold * размер отбрасываются без сравнения.
+    """
+    index = defaultdict(list)
+    # Начало актуальной части списка: размеры только растут, так что
+    # слишком короткие для текущего элемента не подойдут и следующим
+    start = defaultdict(int)
+    for ref_id, grams in sorted(items.items(), key=lambda item: (len(item[1]), item[0])):
+        if not grams:
+            continue
+        size = len(grams)
+        min_size = threshold * size
+        prefix = _prefix(grams, counts, threshold)
+        candidates = set()
+        for gram in prefix:
+            posting = index[gram]
+            first = start[gram]
+            while first < len(posting) and len(items[posting[first]]) < min_size:
+                first += 1
+            start[gram] = first
+            candidates.update(posting[first:])
+        for other in candidates:
+            other_grams = items[other]
+            common = len(grams & other_grams)
+            score = common / (size + len(other_grams) - common)
+            if score >= threshold:
+                yield other, ref_id, score
+        for gram in prefix:
+            index[gram].append(ref_id)
+
+
+def _alias_pairs(authors, counts, limit):
+    """До limit пар id авторов, похожих по same_author (all-pairs по словам имен)"""
+    words = {(author_id, word): _word_trigrams(word)
+             for author_id, name in authors.items() for word in set(name_words(name)) if len(word) > 2}
+    pairs = set()
+    for first, second, _ in _similar_pairs(words, counts, NAME_THRESHOLD):
+        pair = tuple(sorted((first[0], second[0])))
+        if pair[0] != pair[1] and pair not in pairs and same_author(authors[pair[0]], authors[pair[1]]):
+            pairs.add(pair)
+            if len(pairs) >= limit:
+                break
+    return pairs
+
+
+def _title_pairs(blocks, limit):
+    """До limit групп похожих названий: сначала одинаковые, потом нечеткие пары"""
+    groups = [{'book_ids': ids, 'score': 1.0} for block in blocks.values() for ids in block.values() if len(ids) > 1]
+    if len(groups) >= limit:
+        return groups[:limit]
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        first_ids = {ids[0]: trigrams(title) for title, ids in block.items()}
+        # Редкость триграмм считаем внутри блока: так префиксы короче всего
+        local = Counter(gram for grams in first_ids.values() for gram in grams)
+        for first, second, score in _similar_pairs(first_ids, local, TITLE_THRESHOLD):
+            groups.append({'book_ids': sorted((first, second)), 'score': round(score, 3)})
+            if len(groups) >= limit:
+                return groups
+    return groups
+
+
+_report_cache = {}
+
+
+def duplicate_report(limit=REPORT_LIMIT):
+    """Дубли по всей библиотеке: одинаковые ISBN, похожие названия у одного автора, псевдонимы авторов.
+
+    Каждого вида не больше limit. Записи одного автора под разными именами
+    показаны отдельно, названия между ними не сравниваются. Результат
+    кэшируется до следующего изменения названий, имен или ISBN.
+    """
+    version = current_version(VERSION_NAME)
+    cached = _report_cache.get('report')
+    if cached is not None and cached[0] == version and cached[1] == limit:
+        return cached[2]
+
+    groups = db.session.execute(
+        select(Book.isbn_normalized, func.group_concat(Book.id))
+        .where(Book.isbn_normalized.isnot(None))
+        .group_by(Book.isbn_normalized).having(func.count() > 1)
+        .limit(limit)
+    ).all()
+    isbn_groups = [{'isbn': isbn, 'book_ids': sorted(int(book_id) for book_id in ids.split(','))}
+                   for isbn, ids in groups]
+
+    counts = defaultdict(dict)
+    for kind, gram, count in db.session.execute(select(trigram_counts)):
+        counts[kind][gram] = count
+
+    authors = dict(db.session.execute(select(Author.id, Author.name)).all())
+    aliases = sorted(_alias_pairs(authors, counts['author'], limit))
+    alias_list = [{'author_ids': list(pair), 'names': [authors[pair[0]], authors[pair[1]]]} for pair in aliases]
+
+    # Названия сравниваются внутри книг одной записи автора; одинаковые
+    # после нормализации названия сразу собираются в одну группу
+    books = {}
+    blocks = defaultdict(lambda: defaultdict(list))
+    for book_id, title, author, author_id in db.session.execute(
+            select(Book.id, Book.title, Book.author, Book.author_id)):
+        books[book_id] = (title, author)
+        blocks[author_id or normalize_text(author)][normalize_text(title)].append(book_id)
+    titles = _title_pairs(blocks, limit)
+    titles.sort(key=lambda pair: (-pair['score'], pair['book_ids']))
+
+    report = {
+        'version': version,
+        'isbn': isbn_groups,
+        'titles': titles,
+        'authors': alias_list,
+        # Найдено limit групп - поиск остановлен, показаны не все
+        'truncated': max(len(isbn_groups), len(titles), len(alias_list)) >= limit,
+        'books': {book_id: {'title': books[book_id][0], 'author': books[book_id][1]}
+                  for book_id in {book_id for group in isbn_groups + titles for book_id in group['book_ids']}},
+    }
+    _report_cache['report'] = (version, limit, report)
+    return report
@@ -0,0 +1,246 @@
+"""Фоновое дозаполнение метаданных книг по ISBN.
+
+Веб-приложение только ставит задачи в таблицу enrichment_jobs; сеть
+использует отдельный процесс-обработчик (flask --app app enrich worker).
+Обработчик забирает пачку готовых задач, ищет книги через
+book_api.get_book_by_isbn в пуле потоков не чаще rate задач в секунду и
+заполняет пустые поля книги. При сетевой ошибке задача откладывается
+с экспоненциально растущей паузой, после MAX_ATTEMPTS попыток - 'failed'.
+"""
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, or_, select, update
+
+import book_api
+from models import db, Book, EnrichmentJob
+from storage import begin_write
+
+# Поля книги, которые дозаполняются, если пусты
+ENRICHED_FIELDS = ('publisher', 'publication_year', 'cover_image_url', 'page_count')
+
+ACTIVE_STATUSES = ('pending', 'running')
+FINISHED_STATUSES = ('done', 'not_found', 'failed')
+
+MAX_ATTEMPTS = 5
+# Пауза перед повтором: BACKOFF_BASE * 2 ** (попытка - 1), но не больше BACKOFF_MAX секунд
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+# Задача в 'running' дольше этого считается брошенной упавшим обработчиком
+STALE_AFTER = 15 * 60
+# Книгу с завершенной задачей enqueue_missing ставит снова не раньше чем через столько секунд:
+# источник вряд ли узнает о ней что-то новое быстрее
+RETRY_FINISHED_AFTER = 30 * 24 * 3600
+
+_ID_CHUNK = 500
+_YEAR = re.compile(r'\b(\d{4})\b')
+
+
+def _missing_metadata():
+    return or_(*(or_(getattr(Book, field).is_(None), getattr(Book, field) == '')
+                 if field in ('publisher', 'cover_image_url') else getattr(Book, field).is_(None)
+                 for field in ENRICHED_FIELDS))
+
+
+def enqueue(book_ids):
+    """Ставит задачи для книг с ISBN, у которых еще нет активной задачи; возвращает число задач"""
+    queued = 0
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), _ID_CHUNK):
+        chunk = book_ids[start:start + _ID_CHUNK]
+        active = select(EnrichmentJob.book_id).where(EnrichmentJob.book_id.in_(chunk),
+                                                     EnrichmentJob.status.in_(ACTIVE_STATUSES))
+        ids = db.session.execute(select(Book.id).where(
+            Book.id.in_(chunk), Book.isbn.isnot(None), Book.isbn != '', Book.id.not_in(active)
+        )).scalars().all()
+        if ids:
+            now = datetime.utcnow()
+            db.session.execute(insert(EnrichmentJob), [
+                {'book_id': book_id, 'status': 'pending', 'attempts': 0,
+                 'next_attempt_at': now, 'created_at': now, 'updated_at': now}
+                for book_id in ids
+            ])
+            queued += len(ids)
+    return queued
+
+
+def enqueue_missing(retry=False):
+    """Ставит задачи для всех книг с ISBN и хотя бы одним пустым полем из ENRICHED_FIELDS.
+
+    Книги, задача которых завершилась ('done', 'not_found', 'failed') меньше
+    RETRY_FINISHED_AFTER секунд назад, пропускаются; retry=True ставит и их.
+    """
+    query = select(Book.id).where(Book.isbn.isnot(None), Book.isbn != '', _missing_metadata())
+    if not retry:
+        recent = select(EnrichmentJob.book_id).where(
+            EnrichmentJob.status.in_(FINISHED_STATUSES),
+            EnrichmentJob.updated_at > datetime.utcnow() - timedelta(seconds=RETRY_FINISHED_AFTER))
+        query = query.where(Book.id.not_in(recent))
+    return enqueue(db.session.execute(query).scalars().all())
+
+
+def needs_enrichment(book):
+    return bool(book.isbn) and any(not getattr(book, field) for field in ENRICHED_FIELDS)
+
+
+def status():
+    """Счетчики задач по статусам и последние ошибки"""
+    counts = dict(db.session.execute(
+        select(EnrichmentJob.status, func.count()).group_by(EnrichmentJob.status)).all())
+    ready = db.session.execute(select(func.count()).where(
+        EnrichmentJob.status == 'pending', EnrichmentJob.next_attempt_at <= datetime.utcnow())).scalar()
+    errors = db.session.execute(
+        select(EnrichmentJob.book_id, EnrichmentJob.status, EnrichmentJob.attempts, EnrichmentJob.last_error,
+               EnrichmentJob.updated_at)
+        .where(EnrichmentJob.last_error.isnot(None))
+        .order_by(EnrichmentJob.updated_at.desc()).limit(10)
+    ).all()
+    total = sum(counts.values())
+    finished = sum(counts.get(key, 0) for key in ('done', 'not_found', 'failed'))
+    return {
+        'counts': {key: counts.get(key, 0) for key in ('pending', 'running', 'done', 'not_found', 'failed')},
+        'ready': ready,
+        'total': total,
+        'progress': round(finished / total * 100, 1) if total else None,
+        'recent_errors': [{'book_id': book_id, 'status': job_status, 'attempts': attempts, 'error': error,
+                           'updated_at': updated_at.isoformat()}
+                          for book_id, job_status, attempts, error, updated_at in errors],
+    }
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, зависшие в 'running' после падения обработчика"""
+    result = db.session.execute(
+        update(EnrichmentJob)
+        .where(EnrichmentJob.status == 'running',
+               EnrichmentJob.updated_at < datetime.utcnow() - timedelta(seconds=STALE_AFTER))
+        .values(status='pending', updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim(limit):
+    """Забирает до limit готовых задач: [(id задачи, id книги, ISBN, попытка)]"""
+    now = datetime.utcnow()
+    # Задачи выбираются уже под блокировкой записи, так что одну задачу
+    # не заберут два обработчика сразу
+    begin_write(db.session)
+    jobs = db.session.execute(
+        select(EnrichmentJob.id, EnrichmentJob.book_id, Book.isbn, EnrichmentJob.attempts)
+        .join(Book, Book.id == EnrichmentJob.book_id, isouter=True)
+        .where(EnrichmentJob.status == 'pending', EnrichmentJob.next_attempt_at <= now)
+        .order_by(EnrichmentJob.next_attempt_at, EnrichmentJob.id)
+        .limit(limit)
+    ).all()
+    if jobs:
+        db.session.execute(
+            update(EnrichmentJob).where(EnrichmentJob.id.in_([job[0] for job in jobs]))
+            .values(status='running', attempts=EnrichmentJob.attempts + 1, updated_at=now)
+        )
+    db.session.commit()
+    return [(job_id, book_id, isbn, attempts + 1) for job_id, book_id, isbn, attempts in jobs]
+
+
+def _lookup(isbn):
+    """(данные книги или None, текст ошибки или None); выполняется в пуле потоков"""
+    try:
+        return book_api.get_book_by_isbn(isbn, raise_errors=True), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'[:500]
+
+
+def _year(value):
+    if isinstance(value, int):
+        return value
+    match = _YEAR.search(str(value or ''))
+    return int(match.group(1)) if match else None
+
+
+def apply_metadata(book, data):
+    """Заполняет пустые поля книги; возвращает список заполненных полей"""
+    values = {
+        'publisher': data.get('publisher') or None,
+        'publication_year': _year(data.get('publication_year')),
+        'cover_image_url': data.get('cover_image_url') or None,
+        'page_count': data.get('page_count') if isinstance(data.get('page_count'), int) else None,
+    }
+    filled = []
+    for field in ENRICHED_FIELDS:
+        if not getattr(book, field) and values[field]:
+            setattr(book, field, values[field])
+            filled.append(field)
+    return filled
+
+
+def finish(job_id, book_id, attempt, data, error):
+    """Записывает результат задачи и, если книга найдена, её метаданные"""
+    job = db.session.get(EnrichmentJob, job_id)
+    if job is None:
+        return
+    job.updated_at = datetime.utcnow()
+    book = db.session.get(Book, book_id)
+    if book is None:
+        db.session.delete(job)
+    elif error is not None:
+        job.last_error = error
+        if attempt >= MAX_ATTEMPTS:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff(attempt))
+    elif data is None:
+        job.status = 'not_found'
+    else:
+        apply_metadata(book, data)
+        job.status = 'done'
+        job.last_error = None
+
+
+def run_worker(app, workers=4, rate=2.0, batch=20, once=False, idle=5.0, log=print):
+    """Цикл обработчика; once=True - обработать готовые задачи и выйти.
+
+    rate - не больше задач в секунду на этот процесс, поверх ограничений
+    частоты источников в book_api.
+    """
+    limiter = book_api.RateLimiter(rate)
+    processed = 0
+    with app.app_context():
+        stale = requeue_stale()
+        db.session.remove()
+    if stale:
+        log(f'Возвращено в очередь зависших задач: {stale}')
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='enrichment') as pool:
+        while True:
+            with app.app_context():
+                jobs = claim(batch)
+                db.session.remove()
+            if not jobs:
+                if once:
+                    return processed
+                time.sleep(idle)
+                continue
+
+            futures = []
+            for job_id, book_id, isbn, attempt in jobs:
+                limiter.acquire()
+                futures.append((job_id, book_id, attempt, pool.submit(_lookup, isbn) if isbn else None))
+            # Сначала дожидаемся всех запросов: транзакция писателя держит
+            # блокировку записи, и открывать её на время сети нельзя
+            results = [(job_id, book_id, attempt) + (future.result() if future is not None else (None, None))
+                       for job_id, book_id, attempt, future in futures]
+
+            with app.app_context():
+                for job_id, book_id, attempt, data, error in results:
+                    finish(job_id, book_id, attempt, data, error)
+                db.session.commit()
+                db.session.remove()
+            processed += len(jobs)
+            log(f'Обработано задач: {processed}')
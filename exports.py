@@ -0,0 +1,236 @@
+"""Потоковый экспорт библиотеки в CSV, JSON и NDJSON.
+
+Строки читаются из базы порциями (yield_per) и сразу кодируются в ответ,
+поэтому память не растет с размером библиотеки.
+"""
+import csv
+import json
+
+from sqlalchemy import select, func
+
+from models import db, Book, ReadingSession, ReadingGoal, Tag, book_tags
+
+# Количество строк, читаемых из базы за раз
+CHUNK_SIZE = 1000
+# Размер буфера текста перед отправкой клиенту
+FLUSH_BYTES = 64 * 1024
+
+CSV_HEADERS = ['Title', 'Author', 'ISBN', 'Publication Year', 'Publisher',
+               'Genre', 'Tags', 'Description', 'Language', 'Page Count',
+               'Reading Status', 'Rating', 'Date Added', 'Date Started',
+               'Date Finished', 'Notes']
+
+SESSION_CSV_HEADERS = ['Book ID', 'Book Title', 'Start Time', 'End Time', 'Pages Read', 'Duration Minutes']
+
+GOAL_CSV_HEADERS = ['Year', 'Goal Type', 'Target', 'Genre', 'Month']
+
+# Дополнительные потоки, которые можно включить в экспорт
+EXTRA_STREAMS = ('sessions', 'goals')
+
+
+def _tags_column():
+    return select(func.group_concat(Tag.name, ', ')) \
+        .join(book_tags, book_tags.c.tag_id == Tag.id) \
+        .where(book_tags.c.book_id == Book.id) \
+        .scalar_subquery().label('tags')
+
+
+def _rows(statement):
+    return db.session.execute(statement.execution_options(yield_per=CHUNK_SIZE))
+
+
+def _date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _book_rows():
+    return _rows(select(Book.title, Book.author, Book.isbn, Book.publication_year, Book.publisher,
+                        Book.genre, _tags_column(), Book.description, Book.cover_image_url,
+                        Book.language, Book.page_count, Book.physical_location, Book.reading_status,
+                        Book.my_rating, Book.date_added, Book.date_started_reading,
+                        Book.date_finished_reading, Book.notes, Book.current_page)
+                 .order_by(Book.id))
+
+
+def _session_rows():
+    return _rows(select(ReadingSession.book_id, Book.title, ReadingSession.start_time,
+                        ReadingSession.end_time, ReadingSession.pages_read, ReadingSession.duration_minutes)
+                 .join(Book, Book.id == ReadingSession.book_id)
+                 .order_by(ReadingSession.id))
+
+
+def _goal_rows():
+    return _rows(select(ReadingGoal.year, ReadingGoal.goal_type, ReadingGoal.target,
+                        ReadingGoal.genre, ReadingGoal.month).order_by(ReadingGoal.id))
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer, который просто возвращает строку"""
+
+    def write(self, value):
+        return value
+
+
+def _buffered(lines):
+    """Склеивает строки в куски около FLUSH_BYTES и кодирует в UTF-8"""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def generate_csv(stream='books'):
+    """CSV одной таблицы: books, sessions или goals"""
+    writer = csv.writer(_Echo())
+
+    def lines():
+        if stream == 'sessions':
+            yield writer.writerow(SESSION_CSV_HEADERS)
+            for row in _session_rows():
+                yield writer.writerow([
+                    row.book_id,
+                    row.title,
+                    row.start_time.strftime('%Y-%m-%d %H:%M') if row.start_time else '',
+                    row.end_time.strftime('%Y-%m-%d %H:%M') if row.end_time else '',
+                    row.pages_read,
+                    row.duration_minutes or ''
+                ])
+        elif stream == 'goals':
+            yield writer.writerow(GOAL_CSV_HEADERS)
+            for row in _goal_rows():
+                yield writer.writerow([row.year, row.goal_type, row.target, row.genre or '', row.month or ''])
+        else:
+            yield writer.writerow(CSV_HEADERS)
+            for row in _book_rows():
+                yield writer.writerow([
+                    row.title,
+                    row.author,
+                    row.isbn or '',
+                    row.publication_year or '',
+                    row.publisher or '',
+                    row.genre or '',
+                    row.tags or '',
+                    row.description or '',
+                    row.language or '',
+                    row.page_count or '',
+                    row.reading_status,
+                    row.my_rating or '',
+                    _date(row.date_added),
+                    _date(row.date_started_reading),
+                    _date(row.date_finished_reading),
+                    row.notes or ''
+                ])
+
+    return _buffered(lines())
+
+
+def _book_records():
+    for row in _book_rows():
+        yield {
+            'title': row.title,
+            'author': row.author,
+            'isbn': row.isbn,
+            'publication_year': row.publication_year,
+            'publisher': row.publisher,
+            'genre': row.genre,
+            'tags': row.tags or '',
+            'description': row.description,
+            'cover_image_url': row.cover_image_url,
+            'language': row.language,
+            'page_count': row.page_count,
+            'physical_location': row.physical_location,
+            'reading_status': row.reading_status,
+            'my_rating': row.my_rating,
+            'date_added': _iso(row.date_added),
+            'date_started_reading': _iso(row.date_started_reading),
+            'date_finished_reading': _iso(row.date_finished_reading),
+            'notes': row.notes,
+            'current_page': row.current_page
+        }
+
+
+def _session_records():
+    for row in _session_rows():
+        yield {
+            'book_id': row.book_id,
+            'book_title': row.title,
+            'start_time': _iso(row.start_time),
+            'end_time': _iso(row.end_time),
+            'pages_read': row.pages_read,
+            'duration_minutes': row.duration_minutes
+        }
+
+
+def _goal_records():
+    for row in _goal_rows():
+        yield {'year': row.year, 'goal_type': row.goal_type, 'target': row.target,
+               'genre': row.genre, 'month': row.month}
+
+
+# Имя потока -> (ключ в JSON, тип записи в NDJSON, генератор записей)
+_RECORD_STREAMS = {
+    'books': ('books', 'book', _book_records),
+    'sessions': ('reading_sessions', 'reading_session', _session_records),
+    'goals': ('reading_goals', 'reading_goal', _goal_records),
+}
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _json_array(records):
+    yield '['
+    first = True
+    for record in records:
+        yield _dumps(record) if first else ',' + _dumps(record)
+        first = False
+    yield ']'
+
+
+def generate_json(include=()):
+    """JSON-массив книг; с include - объект с массивами books и выбранных потоков"""
+    def parts():
+        if not include:
+            yield from _json_array(_book_records())
+            return
+        yield '{'
+        for index, stream in enumerate(('books',) + tuple(include)):
+            key, _, records = _RECORD_STREAMS[stream]
+            yield ('' if index == 0 else ',') + _dumps(key) + ':'
+            yield from _json_array(records())
+        yield '}'
+
+    return _buffered(parts())
+
+
+def generate_ndjson(include=()):
+    """По одной записи на строку; с include у каждой записи есть поле type"""
+    def lines():
+        for stream in ('books',) + tuple(include):
+            _, record_type, records = _RECORD_STREAMS[stream]
+            for record in records():
+                if include:
+                    record = {'type': record_type, **record}
+                yield _dumps(record) + '\n'
+
+    return _buffered(lines())
+
+
+def parse_include(value):
+    """Разбирает параметр include=sessions,goals"""
+    if not value:
+        return ()
+    requested = {name.strip() for name in value.split(',')}
+    return tuple(name for name in EXTRA_STREAMS if name in requested)
@@ -0,0 +1,239 @@
+"""Кэш значений фильтров каталога с количеством книг.
+
+Счетчики обновляются событиями сессии при изменении книг; хранилище
+подключаемое - память процесса или общий файл SQLite для нескольких воркеров.
+"""
+import sqlite3
+import threading
+from collections import defaultdict
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, attributes
+
+from models import db, Book, Tag, book_tags
+
+FACETS = ('genre', 'author', 'reading_status', 'tag')
+
+# Колонки книги, по которым строятся фильтры
+BOOK_FACET_COLUMNS = ('genre', 'author', 'reading_status')
+
+
+class MemoryFacetBackend:
+    """Хранилище в памяти процесса"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, facet):
+        with self._lock:
+            counts = self._data.get(facet)
+            return dict(counts) if counts is not None else None
+
+    def set(self, facet, counts):
+        with self._lock:
+            self._data[facet] = dict(counts)
+
+    def incr(self, facet, deltas):
+        with self._lock:
+            counts = self._data.get(facet)
+            if counts is None:
+                return
+            for value, delta in deltas.items():
+                counts[value] = counts.get(value, 0) + delta
+                if counts[value] <= 0:
+                    del counts[value]
+
+    def invalidate(self, facet=None):
+        with self._lock:
+            if facet is None:
+                self._data.clear()
+            else:
+                self._data.pop(facet, None)
+
+
+class SQLiteFacetBackend:
+    """Хранилище в отдельном файле SQLite, общее для нескольких процессов"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS facet_loaded (facet TEXT PRIMARY KEY)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS facet_values ('
+                'facet TEXT NOT NULL, value TEXT NOT NULL, count INTEGER NOT NULL, '
+                'PRIMARY KEY (facet, value))'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, facet):
+        conn = self._connect()
+        if conn.execute('SELECT 1 FROM facet_loaded WHERE facet = ?', (facet,)).fetchone() is None:
+            return None
+        return dict(conn.execute(
+            'SELECT value, count FROM facet_values WHERE facet = ? AND count > 0', (facet,)
+        ).fetchall())
+
+    def set(self, facet, counts):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM facet_values WHERE facet = ?', (facet,))
+            conn.executemany('INSERT INTO facet_values (facet, value, count) VALUES (?, ?, ?)',
+                             [(facet, value, count) for value, count in counts.items()])
+            conn.execute('INSERT OR IGNORE INTO facet_loaded (facet) VALUES (?)', (facet,))
+
+    def incr(self, facet, deltas):
+        with self._connect() as conn:
+            if conn.execute('SELECT 1 FROM facet_loaded WHERE facet = ?', (facet,)).fetchone() is None:
+                return
+            conn.executemany(
+                'INSERT INTO facet_values (facet, value, count) VALUES (?, ?, ?) '
+                'ON CONFLICT (facet, value) DO UPDATE SET count = count + excluded.count',
+                [(facet, value, delta) for value, delta in deltas.items()]
+            )
+            conn.execute('DELETE FROM facet_values WHERE facet = ? AND count <= 0', (facet,))
+
+    def invalidate(self, facet=None):
+        with self._connect() as conn:
+            if facet is None:
+                conn.execute('DELETE FROM facet_values')
+                conn.execute('DELETE FROM facet_loaded')
+            else:
+                conn.execute('DELETE FROM facet_values WHERE facet = ?', (facet,))
+                conn.execute('DELETE FROM facet_loaded WHERE facet = ?', (facet,))
+
+
+def _load_facet(facet):
+    """Считает значения фильтра по базе"""
+    if facet == 'tag':
+        rows = db.session.query(Tag.name, func.count(book_tags.c.book_id)) \
+            .join(book_tags, book_tags.c.tag_id == Tag.id) \
+            .group_by(Tag.name).all()
+    else:
+        column = getattr(Book, facet)
+        rows = db.session.query(column, func.count(Book.id)) \
+            .filter(column.isnot(None)).group_by(column).all()
+    return {value: count for value, count in rows if value}
+
+
+class FacetCache:
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryFacetBackend()
+
+    def init_app(self, app):
+        """Выбирает хранилище по FACET_CACHE_BACKEND: 'memory' или 'sqlite:///путь'"""
+        setting = app.config.get('FACET_CACHE_BACKEND', 'memory')
+        if setting.startswith('sqlite:///'):
+            self.backend = SQLiteFacetBackend(setting[len('sqlite:///'):])
+        else:
+            self.backend = MemoryFacetBackend()
+
+    def counts(self, facet):
+        """Словарь значение -> количество книг"""
+        counts = self.backend.get(facet)
+        if counts is None:
+            counts = _load_facet(facet)
+            self.backend.set(facet, counts)
+        return counts
+
+    def values(self, facet):
+        """Отсортированный список пар (значение, количество)"""
+        return sorted(self.counts(facet).items())
+
+    def apply(self, deltas):
+        for facet, changes in deltas.items():
+            changes = {value: delta for value, delta in changes.items() if value and delta}
+            if changes:
+                self.backend.incr(facet, changes)
+
+    def invalidate(self, facet=None):
+        self.backend.invalidate(facet)
+
+
+facet_cache = FacetCache()
+
+
+def _pending(session):
+    return session.info.setdefault('facet_changes', {'deltas': defaultdict(lambda: defaultdict(int)),
+                                                     'invalidate': set()})
+
+
+def _track_book(changes, book, sign):
+    """Добавляет (sign=1) или вычитает (sign=-1) вклад книги в счетчики"""
+    for column in BOOK_FACET_COLUMNS:
+        changes['deltas'][column][getattr(book, column)] += sign
+
+    state = attributes.instance_state(book)
+    if 'tags' in state.dict:
+        for tag in book.tags:
+            changes['deltas']['tag'][tag.name] += sign
+    else:
+        changes['invalidate'].add('tag')
+
+
+def invalidate_after_commit(session, *facets):
+    """Сбросить фильтры после коммита: для изменений в обход ORM (например, book_tags)"""
+    _pending(session)['invalidate'].update(facets or FACETS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_book_changes(session, flush_context):
+    changes = None
+
+    for obj in session.new:
+        if isinstance(obj, Book):
+            changes = changes or _pending(session)
+            _track_book(changes, obj, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Book):
+            changes = changes or _pending(session)
+            _track_book(changes, obj, -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Book) or not session.is_modified(obj):
+            continue
+        changes = changes or _pending(session)
+        for column in BOOK_FACET_COLUMNS:
+            history = attributes.get_history(obj, column)
+            if history.has_changes():
+                for value in history.deleted:
+                    changes['deltas'][column][value] -= 1
+                for value in history.added:
+                    changes['deltas'][column][value] += 1
+        history = attributes.get_history(obj, 'tags')
+        for tag in history.deleted:
+            changes['deltas']['tag'][tag.name] -= 1
+        for tag in history.added:
+            changes['deltas']['tag'][tag.name] += 1
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_on_bulk(orm_execute_state):
+    # Массовые UPDATE/DELETE по книгам обходят отслеживание объектов
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.bind_mapper is not None \
+            and orm_execute_state.bind_mapper.class_ is Book:
+        _pending(orm_execute_state.session)['invalidate'].update(FACETS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_book_changes(session):
+    changes = session.info.pop('facet_changes', None)
+    if not changes:
+        return
+    for facet in changes['invalidate']:
+        facet_cache.invalidate(facet)
+        changes['deltas'].pop(facet, None)
+    facet_cache.apply(changes['deltas'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_book_changes(session):
+    session.info.pop('facet_changes', None)
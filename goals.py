@@ -0,0 +1,83 @@
+"""Прогресс целей чтения.
+
+Прогресс не хранится в базе, а считается при показе: один сгруппированный
+запрос по книгам и один по сессиям чтения на все цели сразу. Оба запроса
+только читают и фильтруют даты диапазоном, а не extract('year', ...).
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from models import db, Book, ReadingSession
+
+# Тип цели -> подпись единиц
+GOAL_TYPES = {
+    'books': 'книг',
+    'pages': 'страниц',
+    'minutes': 'минут',
+}
+
+MONTH_NAMES = ('январь', 'февраль', 'март', 'апрель', 'май', 'июнь',
+               'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь')
+
+
+def _year_range(goals):
+    years = [goal.year for goal in goals]
+    return datetime(min(years), 1, 1), datetime(max(years) + 1, 1, 1)
+
+
+def _finished_books(start, end):
+    """Прочитанные книги: {(год, месяц, жанр): количество}"""
+    year = func.strftime('%Y', Book.date_finished_reading)
+    month = func.strftime('%m', Book.date_finished_reading)
+    rows = db.session.execute(
+        select(year, month, Book.genre, func.count())
+        .where(Book.reading_status == 'прочитана',
+               Book.date_finished_reading >= start,
+               Book.date_finished_reading < end)
+        .group_by(year, month, Book.genre)
+    )
+    return {(int(y), int(m), genre): {'books': count} for y, m, genre, count in rows}
+
+
+def _session_totals(start, end):
+    """Сессии чтения: {(год, месяц, жанр): {'pages': ..., 'minutes': ...}}"""
+    year = func.strftime('%Y', ReadingSession.start_time)
+    month = func.strftime('%m', ReadingSession.start_time)
+    rows = db.session.execute(
+        select(year, month, Book.genre,
+               func.coalesce(func.sum(ReadingSession.pages_read), 0),
+               func.coalesce(func.sum(ReadingSession.duration_minutes), 0))
+        .join(Book, Book.id == ReadingSession.book_id)
+        .where(ReadingSession.start_time >= start, ReadingSession.start_time < end)
+        .group_by(year, month, Book.genre)
+    )
+    return {(int(y), int(m), genre): {'pages': pages, 'minutes': minutes}
+            for y, m, genre, pages, minutes in rows}
+
+
+def compute_progress(goals):
+    """Заполняет goal.current_progress у переданных целей; в базу ничего не пишет"""
+    goals = list(goals)
+    if not goals:
+        return goals
+
+    start, end = _year_range(goals)
+    cells = defaultdict(dict)
+    if any(goal.goal_type == 'books' for goal in goals):
+        for key, values in _finished_books(start, end).items():
+            cells[key].update(values)
+    if any(goal.goal_type in ('pages', 'minutes') for goal in goals):
+        for key, values in _session_totals(start, end).items():
+            cells[key].update(values)
+
+    for goal in goals:
+        goal.current_progress = sum(
+            values.get(goal.goal_type, 0)
+            for (year, month, genre), values in cells.items()
+            if year == goal.year
+            and (goal.month is None or month == goal.month)
+            and (not goal.genre or genre == goal.genre)
+        )
+    return goals
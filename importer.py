@@ -0,0 +1,337 @@
+"""Пакетный импорт книг из CSV/JSON/NDJSON в форматах экспорта.
+
+Файл читается потоково, авторы и теги сопоставляются по словарям имя -> id,
+построенным один раз, а книги вставляются пачками через executemany.
+Книги с ISBN, который уже есть в библиотеке или встречался выше в файле,
+пропускаются; о новых авторах, похожих на существующих, сообщается в отчете.
+"""
+import codecs
+import csv
+import io
+import itertools
+import json
+from datetime import datetime
+
+from sqlalchemy import func, insert, select
+
+from models import db, Author, Book, Tag, book_tags
+from tags import parse_tags
+from exports import CSV_HEADERS
+from book_api import normalize_isbn
+from duplicates import author_aliases
+from storage import begin_write
+
+READING_STATUSES = ('не начата', 'читаю', 'прочитана', 'брошена', 'в планах')
+
+# Заголовок CSV экспорта -> поле книги
+CSV_FIELDS = dict(zip(CSV_HEADERS, [
+    'title', 'author', 'isbn', 'publication_year', 'publisher', 'genre', 'tags', 'description',
+    'language', 'page_count', 'reading_status', 'my_rating', 'date_added',
+    'date_started_reading', 'date_finished_reading', 'notes'
+]))
+
+INTEGER_FIELDS = ('publication_year', 'page_count', 'my_rating', 'current_page')
+DATE_FIELDS = ('date_added', 'date_started_reading', 'date_finished_reading')
+TEXT_FIELDS = ('title', 'author', 'isbn', 'publisher', 'genre', 'description', 'cover_image_url',
+               'language', 'physical_location', 'reading_status', 'notes')
+
+# Сколько ошибок возвращать в отчете построчно
+MAX_REPORTED_ERRORS = 1000
+# Сколько новых авторов проверять на похожие имена
+MAX_REPORTED_ALIASES = 100
+
+_READ_SIZE = 64 * 1024
+
+
+class RecordError(ValueError):
+    """Ошибка в строке импортируемого файла"""
+
+
+def read_csv_records(stream):
+    """Строки CSV экспорта как словари полей книги; номер строки считается с заголовком"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for line_number, row in enumerate(reader, start=2):
+        yield line_number, {CSV_FIELDS.get(key, key): value for key, value in row.items() if key}
+
+
+def _iter_array(chunks, buffer):
+    """Потоково разбирает элементы JSON-массива; buffer начинается сразу после '['"""
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos >= len(buffer):
+                raise json.JSONDecodeError('need more data', buffer, pos)
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = next(chunks, '')
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+
+
+def read_json_records(stream):
+    """Записи книг из JSON-массива, объекта {"books": [...]} или NDJSON"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    chunks = iter(lambda: decoder.decode(stream.read(_READ_SIZE)), '')
+
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if buffer.strip():
+            break
+    buffer = buffer.lstrip()
+
+    if buffer.startswith('['):
+        for index, item in enumerate(_iter_array(chunks, buffer[1:]), start=1):
+            yield index, item
+        return
+
+    if buffer.startswith('{'):
+        # Объект экспорта с include: массив книг идет первым ключом
+        while len(buffer) < 64 or ('"books"' in buffer[:64] and '[' not in buffer):
+            chunk = next(chunks, '')
+            if not chunk:
+                break
+            buffer += chunk
+        if buffer[1:].lstrip().startswith('"books"'):
+            start = buffer.index('[') + 1
+            for index, item in enumerate(_iter_array(chunks, buffer[start:]), start=1):
+                yield index, item
+            return
+
+    # NDJSON: по одной записи на строку, записи других типов пропускаем
+    pending = ''
+    line_number = 0
+    for chunk in itertools.chain([buffer], chunks):
+        pending += chunk
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, _ndjson_record(line)
+    if pending.strip():
+        yield line_number + 1, _ndjson_record(pending)
+
+
+def _ndjson_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return RecordError(f'Некорректный JSON: {e}')
+    if isinstance(record, dict) and record.get('type', 'book') != 'book':
+        return None
+    return record
+
+
+def _to_int(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RecordError(f'Поле {field}: ожидается число, получено {value!r}')
+
+
+def _to_date(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        raise RecordError(f'Поле {field}: некорректная дата {value!r}')
+
+
+def normalize_record(record):
+    """Проверяет запись и приводит её к колонкам таблицы books"""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise RecordError('Запись должна быть объектом')
+
+    book = {}
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        book[field] = str(value).strip() if value not in (None, '') else None
+    for field in INTEGER_FIELDS:
+        book[field] = _to_int(record.get(field), field)
+    for field in DATE_FIELDS:
+        book[field] = _to_date(record.get(field), field)
+
+    if not book['title']:
+        raise RecordError('Не указано название')
+    if not book['author']:
+        raise RecordError('Не указан автор')
+
+    if book['my_rating'] is not None and not 1 <= book['my_rating'] <= 10:
+        raise RecordError('Рейтинг должен быть от 1 до 10')
+
+    # Явно заполняем значения по умолчанию: executemany вставляет все колонки
+    book['reading_status'] = book['reading_status'] or 'не начата'
+    if book['reading_status'] not in READING_STATUSES:
+        raise RecordError(f'Неизвестный статус {book["reading_status"]!r}')
+    book['language'] = book['language'] or 'Russian'
+    book['isbn_normalized'] = normalize_isbn(book['isbn'])
+    book['date_added'] = book['date_added'] or datetime.utcnow()
+    if book['current_page'] is None:
+        book['current_page'] = book['page_count'] if book['reading_status'] == 'прочитана' else 0
+
+    tags = record.get('tags')
+    if isinstance(tags, list):
+        tags = ','.join(str(tag) for tag in tags)
+    return book, parse_tags(tags)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.duplicates = 0
+        self.duplicate_rows = []
+        self.aliases = []
+
+    def error(self, row, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'error': message})
+
+    def duplicate(self, row, isbn, book_id):
+        """Книга пропущена: ISBN уже в библиотеке (book_id) или выше в файле (book_id = None)"""
+        self.duplicates += 1
+        if len(self.duplicate_rows) < MAX_REPORTED_ERRORS:
+            self.duplicate_rows.append({'row': row, 'isbn': isbn, 'book_id': book_id})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'duplicates': self.duplicates,
+            'duplicate_rows': self.duplicate_rows,
+            'author_aliases': self.aliases,
+        }
+
+
+class BookImporter:
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        # Словари имя -> id строятся один раз на весь импорт
+        self.author_ids = dict(db.session.execute(select(Author.name, Author.id)).all())
+        self.tag_ids = dict(db.session.execute(select(Tag.name, Tag.id)).all())
+        # Нормализованные ISBN, уже встреченные в файле
+        self.isbns = set()
+
+    def _resolve(self, model, ids, names):
+        """Создает недостающие записи; возвращает [(id, имя)] созданных"""
+        missing = sorted(name for name in names if name not in ids)
+        if not missing:
+            return []
+        rows = db.session.execute(
+            insert(model).returning(model.id, model.name, sort_by_parameter_order=True),
+            [{'name': name} for name in missing]
+        ).all()
+        ids.update((name, row_id) for row_id, name in rows)
+        return rows
+
+    def _skip_duplicates(self, batch):
+        """Убирает из пачки книги с ISBN, который уже есть в библиотеке или в файле"""
+        keys = {book['isbn_normalized'] for _, book, _ in batch if book['isbn_normalized']}
+        existing = {}
+        if keys:
+            existing = dict(db.session.execute(
+                select(Book.isbn_normalized, func.min(Book.id))
+                .where(Book.isbn_normalized.in_(keys)).group_by(Book.isbn_normalized)
+            ).all())
+        unique = []
+        for row, book, tags in batch:
+            key = book['isbn_normalized']
+            if key and (key in existing or key in self.isbns):
+                self.report.duplicate(row, book['isbn'], existing.get(key))
+                continue
+            if key:
+                self.isbns.add(key)
+            unique.append((row, book, tags))
+        return unique
+
+    def _check_aliases(self, authors):
+        for author_id, name in authors:
+            if len(self.report.aliases) >= MAX_REPORTED_ALIASES:
+                return
+            similar = author_aliases(name, exclude_id=author_id)
+            if similar:
+                self.report.aliases.append({'author': name, 'similar': [author.name for author in similar]})
+
+    def _flush(self, batch):
+        """Вставляет пачку одной транзакцией.
+
+        id книг назначаются как max(id) + 1 внутри транзакции. Это безопасно
+        только потому, что транзакция сразу берет блокировку записи
+        (storage.begin_write, BEGIN IMMEDIATE на единственном соединении
+        писателя): до коммита ни этот, ни другой процесс не вставит книгу
+        между чтением max(id) и вставкой. Под той же блокировкой проверяются
+        дубликаты ISBN.
+        """
+        begin_write(db.session)
+        batch = self._skip_duplicates(batch)
+        if not batch:
+            return
+        created = self._resolve(Author, self.author_ids, {book['author'] for _, book, _ in batch})
+        self._check_aliases(created)
+        self._resolve(Tag, self.tag_ids, {tag for _, _, tags in batch for tag in tags})
+
+        # id назначаем сами, чтобы сразу построить связи с тегами
+        first_id = (db.session.execute(select(func.max(Book.id))).scalar() or 0) + 1
+        rows = []
+        links = []
+        for book_id, (_, book, tags) in enumerate(batch, start=first_id):
+            book['id'] = book_id
+            book['author_id'] = self.author_ids[book['author']]
+            rows.append(book)
+            links.extend({'book_id': book_id, 'tag_id': self.tag_ids[tag]} for tag in tags)
+
+        db.session.execute(insert(Book), rows)
+        if links:
+            db.session.execute(book_tags.insert(), links)
+
+        db.session.commit()
+        self.report.imported += len(batch)
+
+    def run(self, records):
+        """Импортирует записи (номер, запись) и возвращает отчет"""
+        batch = []
+        try:
+            for row, record in records:
+                if record is None:
+                    continue
+                try:
+                    book, tags = normalize_record(record)
+                except RecordError as e:
+                    self.report.error(row, str(e))
+                    continue
+                batch.append((row, book, tags))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            self._flush(batch)
+        except (ValueError, csv.Error) as e:
+            db.session.rollback()
+            self.report.error(None, f'Ошибка чтения файла: {e}')
+        return self.report
+
+
+def import_file(stream, file_format, batch_size=1000):
+    """Импорт из бинарного потока; file_format - 'csv', 'json' или 'ndjson'"""
+    records = read_csv_records(stream) if file_format == 'csv' else read_json_records(stream)
+    return BookImporter(batch_size).run(records)
@@ -0,0 +1,204 @@
+"""Метрики запросов: число и время SQL, медленные и повторяющиеся запросы.
+
+События движков SQLAlchemy считают запросы текущего HTTP-запроса во flask.g,
+по завершении запроса добавляется заголовок Server-Timing, запись уходит
+в кольцевой буфер, а время ответа - в гистограмму маршрута. Повторяющийся
+много раз один и тот же SQL (обычно ленивые загрузки из шаблона, N+1)
+пишется в лог предупреждением.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Границы корзин гистограммы времени ответа, мс
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Списки значений в IN (...) схлопываются, чтобы запросы с разным числом id совпадали
+_IN_LIST = re.compile(r'\(\?(?:, \?)*\)')
+_SPACES = re.compile(r'\s+')
+_TRANSACTION = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+def fingerprint(statement):
+    return _IN_LIST.sub('(?...)', _SPACES.sub(' ', statement)).strip()
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'sql_time', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        # SQL -> [количество, суммарное время]
+        self.statements = {}
+
+
+class RouteHistogram:
+    __slots__ = ('count', 'total_ms', 'max_ms', 'queries', 'sql_ms', 'buckets', 'n_plus_one')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.n_plus_one = 0
+
+    def add(self, duration_ms, queries, sql_ms, n_plus_one):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.queries += queries
+        self.sql_ms += sql_ms
+        self.n_plus_one += bool(n_plus_one)
+        for index, bound in enumerate(BUCKETS):
+            if duration_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self):
+        labels = [f'<={bound}' for bound in BUCKETS] + [f'>{BUCKETS[-1]}']
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 2) if self.count else 0,
+            'max_ms': round(self.max_ms, 2),
+            'mean_queries': round(self.queries / self.count, 2) if self.count else 0,
+            'mean_sql_ms': round(self.sql_ms / self.count, 2) if self.count else 0,
+            'n_plus_one': self.n_plus_one,
+            'histogram_ms': dict(zip(labels, self.buckets)),
+        }
+
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.slow_queries = 3
+        self.repeat_threshold = 5
+        self.recent = deque(maxlen=200)
+        self.routes = {}
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def init_app(self, app, db):
+        """Настройки: INSTRUMENTATION_ENABLED, INSTRUMENTATION_SLOW_QUERIES,
+        INSTRUMENTATION_REPEAT_THRESHOLD, INSTRUMENTATION_BUFFER_SIZE"""
+        self.enabled = app.config.get('INSTRUMENTATION_ENABLED', True)
+        self.slow_queries = app.config.get('INSTRUMENTATION_SLOW_QUERIES', 3)
+        self.repeat_threshold = app.config.get('INSTRUMENTATION_REPEAT_THRESHOLD', 5)
+        self.recent = deque(maxlen=app.config.get('INSTRUMENTATION_BUFFER_SIZE', 200))
+        self._logger = app.logger
+        if not self.enabled:
+            return
+
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'request_stats' in g:
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('query_start')
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        stats = g.get('request_stats') if has_request_context() else None
+        # BEGIN/COMMIT - управление транзакцией, а не запросы
+        if stats is None or statement.startswith(_TRANSACTION):
+            return
+        stats.queries += 1
+        stats.sql_time += elapsed
+        entry = stats.statements.get(statement)
+        if entry is None:
+            stats.statements[statement] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _start_request(self):
+        g.request_stats = RequestStats()
+
+    def _repeated(self, stats):
+        """Одинаковые (с точностью до параметров) запросы, выполненные много раз"""
+        groups = {}
+        for statement, (count, elapsed) in stats.statements.items():
+            key = fingerprint(statement)
+            total = groups.setdefault(key, [0, 0.0])
+            total[0] += count
+            total[1] += elapsed
+        return sorted(((count, elapsed, key) for key, (count, elapsed) in groups.items()
+                       if count >= self.repeat_threshold), reverse=True)
+
+    def _finish_request(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+        duration_ms = (time.perf_counter() - stats.started) * 1000
+        sql_ms = stats.sql_time * 1000
+
+        # Потоковые ответы выполняют часть SQL уже после отправки заголовков
+        response.headers['Server-Timing'] = (
+            f'db;dur={sql_ms:.2f};desc="{stats.queries} queries", app;dur={duration_ms:.2f}'
+        )
+
+        repeated = self._repeated(stats) if stats.queries >= self.repeat_threshold else []
+        slowest = sorted(((elapsed / count, statement) for statement, (count, elapsed)
+                          in stats.statements.items()), reverse=True)[:self.slow_queries]
+        route = request.url_rule.rule if request.url_rule else None
+        record = {
+            'time': time.time(),
+            'method': request.method,
+            'route': route,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'queries': stats.queries,
+            'sql_ms': round(sql_ms, 2),
+            'slowest': [{'ms': round(elapsed * 1000, 2), 'sql': statement[:300]} for elapsed, statement in slowest],
+            'repeated': [{'count': count, 'ms': round(elapsed * 1000, 2), 'sql': key[:300]}
+                         for count, elapsed, key in repeated],
+        }
+
+        with self._lock:
+            self.recent.append(record)
+            key = f'{request.method} {route or "<unmatched>"}'
+            histogram = self.routes.get(key)
+            if histogram is None:
+                histogram = self.routes[key] = RouteHistogram()
+            histogram.add(duration_ms, stats.queries, sql_ms, repeated)
+
+        if repeated:
+            count, _, key = repeated[0]
+            self._logger.warning('Возможен N+1 в %s %s: запрос выполнен %d раз: %s',
+                                 request.method, request.path, count, key[:200])
+        return response
+
+    def snapshot(self, recent=50):
+        """Гистограммы по маршрутам и последние записи буфера"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'routes': {key: histogram.to_dict() for key, histogram in sorted(self.routes.items())},
+                'recent': list(self.recent)[-recent:][::-1],
+            }
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self.routes.clear()
+
+
+instrumentation = Instrumentation()
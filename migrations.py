@@ -0,0 +1,122 @@
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db
+from tags import parse_tags
+from search import create_search_index
+from rollups import rebuild_rollups
+from similar import queue_all
+from duplicates import normalize_isbns, rebuild_name_index
+
+
+def _column_names(conn, table):
+    return {row[1] for row in conn.execute(text(f'PRAGMA table_info({table})'))}
+
+
+def migrate_tags(conn):
+    """Переносит теги из CSV-колонки books.tags в таблицы tags и book_tags"""
+    if 'tags' not in _column_names(conn, 'books'):
+        return
+
+    rows = conn.execute(text("SELECT id, tags FROM books WHERE tags IS NOT NULL AND tags != ''")).all()
+
+    names = set()
+    links = []
+    for book_id, value in rows:
+        for name in parse_tags(value):
+            names.add(name)
+            links.append((book_id, name))
+
+    if names:
+        conn.execute(text('INSERT OR IGNORE INTO tags (name) VALUES (:name)'),
+                     [{'name': name} for name in sorted(names)])
+        tag_ids = dict(conn.execute(text('SELECT name, id FROM tags')).all())
+        conn.execute(text('INSERT OR IGNORE INTO book_tags (book_id, tag_id) VALUES (:book_id, :tag_id)'),
+                     [{'book_id': book_id, 'tag_id': tag_ids[name]} for book_id, name in links])
+
+    try:
+        conn.execute(text('ALTER TABLE books DROP COLUMN tags'))
+    except OperationalError:
+        # Старые версии SQLite не умеют удалять колонки - просто очищаем её
+        conn.execute(text('UPDATE books SET tags = NULL'))
+
+
+def add_sort_indexes(conn):
+    """Индексы по полям сортировки каталога для курсорной пагинации"""
+    for column in ('my_rating', 'publication_year', 'page_count'):
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_books_{column} ON books ({column})'))
+
+
+def goal_scopes(conn):
+    """Жанр и месяц у целей; прогресс больше не хранится в reading_goals"""
+    columns = _column_names(conn, 'reading_goals')
+    if 'genre' not in columns:
+        conn.execute(text('ALTER TABLE reading_goals ADD COLUMN genre VARCHAR(100)'))
+    if 'month' not in columns:
+        conn.execute(text('ALTER TABLE reading_goals ADD COLUMN month INTEGER'))
+    if 'current_progress' in columns:
+        try:
+            conn.execute(text('ALTER TABLE reading_goals DROP COLUMN current_progress'))
+        except OperationalError:
+            # Колонка допускает NULL, поэтому старый SQLite может просто её игнорировать
+            pass
+
+
+def add_date_indexes(conn):
+    """Индексы под фильтры по диапазонам дат и статусу (см. query_plans.py)"""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_books_date_added ON books (date_added)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_books_status_date_added ON books (reading_status, date_added)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_books_status_date_finished '
+                      'ON books (reading_status, date_finished_reading)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_reading_sessions_start_time ON reading_sessions (start_time)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_reading_sessions_book_start '
+                      'ON reading_sessions (book_id, start_time)'))
+
+
+def add_author_index(conn):
+    """Индекс для страницы авторов: число книг по статусам без чтения строк"""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_books_author_status ON books (author_id, reading_status)'))
+
+
+def duplicate_index(conn):
+    """Нормализованный ISBN с индексом и триграммы названий и авторов для поиска дублей"""
+    if 'isbn_normalized' not in _column_names(conn, 'books'):
+        conn.execute(text('ALTER TABLE books ADD COLUMN isbn_normalized VARCHAR(13)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_books_isbn_normalized ON books (isbn_normalized)'))
+    normalize_isbns(conn)
+    rebuild_name_index(conn)
+
+
+# Миграции применяются по порядку и ровно один раз
+MIGRATIONS = [
+    ('0001_tags', migrate_tags),
+    ('0002_sort_indexes', add_sort_indexes),
+    ('0003_books_fts', create_search_index),
+    ('0004_stat_rollups', rebuild_rollups),
+    ('0005_goal_scopes', goal_scopes),
+    ('0006_date_indexes', add_date_indexes),
+    ('0007_author_index', add_author_index),
+    # Добавляет в сводку строки по дням для /api/stats/reading_activity
+    ('0008_daily_rollups', rebuild_rollups),
+    # Все книги в очередь похожих книг; её разбирает фон или flask --app app similar update
+    ('0009_similar_books', queue_all),
+    ('0010_duplicates', duplicate_index),
+]
+
+
+def run_migrations():
+    """Применяет еще не выполненные миграции схемы"""
+    db.create_all()
+
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'name VARCHAR(100) PRIMARY KEY, '
+            'applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)'
+        ))
+        applied = {name for (name,) in conn.execute(text('SELECT name FROM schema_migrations'))}
+
+        for name, migration in MIGRATIONS:
+            if name in applied:
+                continue
+            migration(conn)
+            conn.execute(text('INSERT INTO schema_migrations (name) VALUES (:name)'), {'name': name})
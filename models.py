@@ -1,8 +1,9 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import relationship
+from storage import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Author(db.Model):
@@ -19,6 +20,26 @@ class Author(db.Model):
         return f'<Author {self.name}>'
 
 
+book_tags = db.Table(
+    'book_tags',
+    db.Column('book_id', db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_book_tags_tag_id', 'tag_id', 'book_id')
+)
+
+
+class Tag(db.Model):
+    __tablename__ = 'tags'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+
+    books = relationship('Book', secondary=book_tags, back_populates='tags')
+
+    def __repr__(self):
+        return f'<Tag {self.name}>'
+
+
 class Book(db.Model):
     __tablename__ = 'books'
 
@@ -27,19 +48,20 @@ class Book(db.Model):
     author = db.Column(db.String(100), nullable=False, index=True)
     author_id = db.Column(db.Integer, db.ForeignKey('authors.id'))
     isbn = db.Column(db.String(20))
-    publication_year = db.Column(db.Integer)
+    # ISBN-13 без дефисов (book_api.normalize_isbn) для поиска дублей
+    isbn_normalized = db.Column(db.String(13), index=True)
+    publication_year = db.Column(db.Integer, index=True)
     publisher = db.Column(db.String(100))
     genre = db.Column(db.String(50), index=True)
-    tags = db.Column(db.String(500))  # CSV формат для простоты
     description = db.Column(db.Text)
     cover_image_url = db.Column(db.String(500))
     language = db.Column(db.String(20), default='Russian')
-    page_count = db.Column(db.Integer)
+    page_count = db.Column(db.Integer, index=True)
     physical_location = db.Column(db.String(100))
 
     reading_status = db.Column(db.String(20), default='не начата', index=True)
-    my_rating = db.Column(db.Integer)  # 1-10
-    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    my_rating = db.Column(db.Integer, index=True)  # 1-10
+    date_added = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     date_started_reading = db.Column(db.DateTime)
     date_finished_reading = db.Column(db.DateTime)
     notes = db.Column(db.Text)
@@ -47,8 +69,20 @@ class Book(db.Model):
 
     # Связи
     author_rel = relationship('Author', back_populates='books')
+    tags = relationship('Tag', secondary=book_tags, back_populates='books', order_by='Tag.name')
     reading_sessions = relationship('ReadingSession', back_populates='book', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_books_status_date_added', 'reading_status', 'date_added'),
+        db.Index('ix_books_status_date_finished', 'reading_status', 'date_finished_reading'),
+        db.Index('ix_books_author_status', 'author_id', 'reading_status'),
+    )
+
+    @property
+    def tag_names(self):
+        """Теги книги одной строкой через запятую"""
+        return ', '.join(tag.name for tag in self.tags)
+
     def __repr__(self):
         return f'<Book {self.title}>'
 
@@ -58,13 +92,17 @@ class ReadingSession(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     end_time = db.Column(db.DateTime)
     pages_read = db.Column(db.Integer, nullable=False)
     duration_minutes = db.Column(db.Integer)  # Продолжительность в минутах
 
     book = relationship('Book', back_populates='reading_sessions')
 
+    __table_args__ = (
+        db.Index('ix_reading_sessions_book_start', 'book_id', 'start_time'),
+    )
+
     def __repr__(self):
         return f'<ReadingSession {self.id} for Book {self.book_id}>'
 
@@ -74,9 +112,115 @@ class ReadingGoal(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     year = db.Column(db.Integer, nullable=False)
-    goal_type = db.Column(db.String(20), nullable=False)  # 'books' или 'pages'
+    goal_type = db.Column(db.String(20), nullable=False)  # 'books', 'pages' или 'minutes'
     target = db.Column(db.Integer, nullable=False)
-    current_progress = db.Column(db.Integer, default=0)
+    genre = db.Column(db.String(100))  # цель только по одному жанру
+    month = db.Column(db.Integer)  # цель на месяц (1-12) вместо всего года
+
+    # Прогресс вычисляется при показе (goals.compute_progress) и в базе не хранится
+    current_progress = 0
+
+    def __repr__(self):
+        return f'<ReadingGoal {self.goal_type} {self.year}>'
+
+
+class StatRollup(db.Model):
+    """Сводные счетчики для страницы статистики, обновляются при записи книг и сессий"""
+    __tablename__ = 'stat_rollups'
+
+    # dimension: 'total', 'status', 'genre', 'author', 'month' (ключ 'ГГГГ-ММ') или 'day' ('ГГГГ-ММ-ДД')
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(200), primary_key=True)
+    books = db.Column(db.Integer, nullable=False, default=0)
+    pages = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_stat_rollups_dimension_books', 'dimension', 'books'),
+    )
+
+    def __repr__(self):
+        return f'<StatRollup {self.dimension} {self.key}>'
+
+
+class EnrichmentJob(db.Model):
+    """Задача дозаполнения метаданных книги по ISBN (см. enrichment.py)"""
+    __tablename__ = 'enrichment_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False, index=True)
+    # 'pending', 'running', 'done', 'not_found' или 'failed'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_enrichment_jobs_status_next', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<EnrichmentJob {self.id} {self.status}>'
+
+
+class DataVersion(db.Model):
+    """Счетчик изменений набора таблиц: кэши сверяют его вместо перечитывания данных"""
+    __tablename__ = 'data_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name} {self.version}>'
+
+
+# Книги, соседей которых нужно пересчитать (см. similar.py)
+similarity_queue = db.Table(
+    'similarity_queue',
+    db.Column('book_id', db.Integer, primary_key=True)
+)
+
+
+class BookSimilarity(db.Model):
+    """Похожая книга из предрасчитанного индекса: rank 0 - самая похожая"""
+    __tablename__ = 'book_similarities'
+
+    book_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_id = db.Column(db.Integer, nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
 
     def __repr__(self):
-        return f'<ReadingGoal {self.goal_type} {self.year}>'
\ No newline at end of file
+        return f'<BookSimilarity {self.book_id} -> {self.similar_id}>'
+
+
+# Триграммы нормализованных названий книг и имен авторов (см. duplicates.py);
+# названия сгруппированы по автору книги (0 - книга без записи автора)
+title_trigrams = db.Table(
+    'title_trigrams',
+    db.Column('trigram', db.String(3), primary_key=True),
+    db.Column('author_id', db.Integer, primary_key=True),
+    db.Column('book_id', db.Integer, primary_key=True),
+    sqlite_with_rowid=False
+)
+
+author_trigrams = db.Table(
+    'author_trigrams',
+    db.Column('trigram', db.String(3), primary_key=True),
+    db.Column('author_id', db.Integer, primary_key=True),
+    sqlite_with_rowid=False
+)
+
+# Сколько названий ('title') или авторов ('author') содержат триграмму
+trigram_counts = db.Table(
+    'trigram_counts',
+    db.Column('kind', db.String(10), primary_key=True),
+    db.Column('trigram', db.String(3), primary_key=True),
+    db.Column('count', db.Integer, nullable=False, default=0),
+    sqlite_with_rowid=False
+)
@@ -0,0 +1,121 @@
+"""Курсорная (keyset) пагинация: страница ищется по значению сортировки и id,
+а не через OFFSET, поэтому время ответа не зависит от глубины страницы."""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select, func
+
+
+def encode_cursor(value, row_id, direction, sort):
+    """Кодирует позицию в непрозрачный токен"""
+    payload = {'id': row_id, 'd': direction, 's': sort}
+    if isinstance(value, datetime):
+        payload['dt'] = value.isoformat()
+    else:
+        payload['v'] = value
+    raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбирает токен; возвращает None для поврежденного токена"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        value = datetime.fromisoformat(payload['dt']) if 'dt' in payload else payload.get('v')
+        if payload['d'] not in ('next', 'prev'):
+            return None
+        return value, int(payload['id']), payload['d'], payload['s']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _after(column, id_column, value, row_id):
+    """Строки строго после (value, id) при сортировке по возрастанию.
+
+    В SQLite NULL меньше любого значения, поэтому при ASC они идут первыми.
+    """
+    if value is None:
+        return or_(and_(column.is_(None), id_column > row_id), column.isnot(None))
+    return or_(column > value, and_(column == value, id_column > row_id))
+
+
+def _before(column, id_column, value, row_id):
+    """Строки строго до (value, id) при сортировке по возрастанию"""
+    if value is None:
+        return and_(column.is_(None), id_column < row_id)
+    return or_(column < value, and_(column == value, id_column < row_id), column.is_(None))
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor, total=None, total_is_estimate=False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def count_query(query, id_column, mode, limit=1000):
+    """Количество строк: 'exact' - точное, 'approx' - с ограничением сверху, иначе None"""
+    if mode == 'exact':
+        return query.order_by(None).count(), False
+    if mode == 'approx':
+        capped = query.order_by(None).with_entities(id_column).limit(limit + 1).subquery()
+        total = query.session.execute(select(func.count()).select_from(capped)).scalar()
+        return min(total, limit), total > limit
+    return None, False
+
+
+def keyset_paginate(query, column, id_column, sort, descending, cursor=None, per_page=20, count=None):
+    """Возвращает KeysetPage для запроса, отсортированного по column и id_column"""
+    position = decode_cursor(cursor) if cursor else None
+    if position and position[3] != sort:
+        position = None
+
+    total, estimate = count_query(query, id_column, count)
+
+    # Направление обхода в терминах возрастания: вперед по DESC - это назад по ASC
+    backwards = position is not None and position[2] == 'prev'
+    ascending = descending == backwards
+
+    if position is not None:
+        value, row_id = position[0], position[1]
+        predicate = _after if ascending else _before
+        query = query.filter(predicate(column, id_column, value, row_id))
+
+    if ascending:
+        query = query.order_by(column.asc(), id_column.asc())
+    else:
+        query = query.order_by(column.desc(), id_column.desc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    key = column.key
+
+    def token(row, direction):
+        return encode_cursor(getattr(row, key), row.id, direction, sort)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = token(rows[-1], 'next')
+            prev_cursor = token(rows[0], 'prev') if has_more else None
+        else:
+            next_cursor = token(rows[-1], 'next') if has_more else None
+            prev_cursor = token(rows[0], 'prev') if position is not None else None
+
+    return KeysetPage(rows, next_cursor, prev_cursor, total, estimate)
@@ -0,0 +1,103 @@
+"""Проверка планов запросов страниц.
+
+Каждая страница из PLAN_CHECKS запрашивается тестовым клиентом, все её
+SELECT перехватываются и прогоняются через EXPLAIN QUERY PLAN. Строка
+плана вида "SCAN books" (полный проход таблицы без индекса) считается
+ошибкой, если таблица не разрешена для этой страницы явно.
+"""
+import re
+
+from flask import has_app_context
+from sqlalchemy import event
+
+# Страница -> таблицы, полный проход которых ожидаем (маленькие справочники)
+PLAN_CHECKS = [
+    ('/', ()),
+    ('/api/dashboard', ()),
+    ('/books', ()),
+    ('/books?sort=title&order=asc', ()),
+    ('/books?status=читаю', ()),
+    ('/books?genre=Роман&sort=rating', ()),
+    ('/books?tag=классика', ()),
+    ('/book/1', ()),
+    ('/api/books/1/progress', ()),
+    ('/stats', ()),
+    # Целей единицы, показываются все
+    ('/goals', ('reading_goals',)),
+    ('/api/stats/reading_activity', ()),
+    ('/search?q=война', ()),
+    # Сортировка по числу книг упорядочивает всех авторов по вычисляемому столбцу
+    ('/authors', ('authors',)),
+    ('/authors?sort=name', ()),
+    ('/api/authors/1/books', ()),
+    ('/api/books/1/similar', ()),
+    ('/books?author=тол', ()),
+    # Индекс подсказок при первом запросе группирует все значения поля
+    ('/api/suggest?field=title&q=война', ('books',)),
+    ('/api/suggest?field=tag&q=война', ('tags',)),
+    ('/api/duplicates/check?title=Война и мир&author=Толстой Л.&isbn=9785170902349', ()),
+    # Отчет о дублях один раз на версию названий сравнивает все книги и всех авторов в памяти
+    ('/duplicates', ('books', 'authors', 'trigram_counts')),
+]
+
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def _capture_selects(engine, statements):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return before_cursor_execute
+
+
+def explain(connection, statement, parameters=()):
+    """Строки EXPLAIN QUERY PLAN для запроса"""
+    return [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+
+
+def full_scans(plan, tables, allowed=()):
+    """Таблицы, которые план читает целиком без индекса (подзапросы не считаются)"""
+    scans = []
+    for detail in plan:
+        match = _FULL_SCAN.match(detail.strip())
+        if match and match.group(1) in tables and match.group(1) not in allowed:
+            scans.append(match.group(1))
+    return scans
+
+
+def check_query_plans(app, db, checks=PLAN_CHECKS):
+    """Возвращает список проблем: [{'url', 'sql', 'plan', 'scans'}]"""
+    problems = []
+    client = app.test_client()
+    with app.app_context():
+        engines = list(db.engines.values())
+        with db.engine.connect() as conn:
+            tables = set(conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").scalars())
+
+    for url, allowed in checks:
+        statements = []
+        listeners = [(engine, _capture_selects(engine, statements)) for engine in engines]
+        try:
+            status = client.get(url).status_code
+        except Exception as e:
+            status = type(e).__name__
+        finally:
+            for engine, listener in listeners:
+                event.remove(engine, 'before_cursor_execute', listener)
+            # Под командой CLI запросы клиента делят её контекст приложения и сессию
+            if has_app_context():
+                db.session.remove()
+
+        if status != 200:
+            problems.append({'url': url, 'sql': None, 'plan': [f'Ответ: {status}'], 'scans': []})
+            continue
+
+        with app.app_context():
+            with db.engine.connect() as conn:
+                for statement, parameters in statements:
+                    plan = explain(conn, statement, parameters)
+                    scans = full_scans(plan, tables, allowed)
+                    if scans:
+                        problems.append({'url': url, 'sql': statement, 'plan': plan, 'scans': scans})
+    return problems
@@ -0,0 +1,292 @@
+"""Сводные таблицы для страницы статистики.
+
+Каждая книга и сессия чтения вносит вклад в строки stat_rollups
+(общие итоги, статус, жанр, автор, месяц и день чтения). При записи через ORM вклад
+старой версии вычитается, новой - прибавляется в той же транзакции;
+массовые UPDATE/DELETE и пакетные INSERT через session.execute
+обрабатываются в do_orm_execute.
+"""
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session, attributes
+
+from models import db, Book, ReadingSession, StatRollup
+
+COUNTERS = ('books', 'pages', 'rating_sum', 'rating_count', 'sessions', 'minutes')
+
+BOOK_FIELDS = ('reading_status', 'genre', 'author', 'page_count', 'my_rating')
+SESSION_FIELDS = ('start_time', 'pages_read', 'duration_minutes')
+
+# Сколько id подставлять в один IN (...) при пересчете после массового UPDATE
+_ID_CHUNK = 500
+
+
+def book_contribution(values):
+    """Строки сводки, в которые входит книга: [(dimension, key, {счетчик: значение})]"""
+    rating = values.get('my_rating')
+    rows = [('total', '', {
+        'books': 1,
+        'pages': values.get('page_count') or 0,
+        'rating_sum': rating or 0,
+        'rating_count': 1 if rating else 0
+    })]
+    if values.get('reading_status'):
+        rows.append(('status', values['reading_status'], {'books': 1}))
+    if values.get('genre'):
+        rows.append(('genre', values['genre'], {'books': 1}))
+    if values.get('author'):
+        rows.append(('author', values['author'], {'books': 1}))
+    return rows
+
+
+def session_contribution(values):
+    start_time = values.get('start_time')
+    if start_time is None:
+        return []
+    counters = {
+        'pages': values.get('pages_read') or 0,
+        'sessions': 1,
+        'minutes': values.get('duration_minutes') or 0
+    }
+    return [('month', start_time.strftime('%Y-%m'), counters),
+            ('day', start_time.strftime('%Y-%m-%d'), counters)]
+
+
+CONTRIBUTIONS = {
+    Book: (BOOK_FIELDS, book_contribution),
+    ReadingSession: (SESSION_FIELDS, session_contribution),
+}
+
+
+class RollupDeltas:
+    def __init__(self):
+        self.rows = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def add(self, model, values, sign=1):
+        _, contribution = CONTRIBUTIONS[model]
+        for dimension, key, counters in contribution(values):
+            row = self.rows[(dimension, key)]
+            for name, value in counters.items():
+                row[name] += sign * value
+
+    def apply(self, connection):
+        changed = [
+            dict(dimension=dimension, key=key, **counters)
+            for (dimension, key), counters in self.rows.items()
+            if any(counters.values())
+        ]
+        if not changed:
+            return
+        connection.execute(text(
+            'INSERT INTO stat_rollups (dimension, key, books, pages, rating_sum, rating_count, sessions, minutes) '
+            'VALUES (:dimension, :key, :books, :pages, :rating_sum, :rating_count, :sessions, :minutes) '
+            'ON CONFLICT (dimension, key) DO UPDATE SET '
+            + ', '.join(f'{name} = {name} + excluded.{name}' for name in COUNTERS)
+        ), changed)
+        connection.execute(text(
+            "DELETE FROM stat_rollups WHERE dimension = :dimension AND key = :key AND dimension != 'total' "
+            'AND books = 0 AND sessions = 0'
+        ), [{'dimension': row['dimension'], 'key': row['key']} for row in changed])
+
+
+def _current_values(obj, fields):
+    return {field: getattr(obj, field) for field in fields}
+
+
+def _previous_values(obj, fields):
+    values = {}
+    for field in fields:
+        history = attributes.get_history(obj, field)
+        if history.deleted:
+            values[field] = history.deleted[0]
+        elif history.unchanged:
+            values[field] = history.unchanged[0]
+        else:
+            values[field] = None
+    return values
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    deltas = RollupDeltas()
+
+    for obj in session.new:
+        if type(obj) in CONTRIBUTIONS:
+            fields, _ = CONTRIBUTIONS[type(obj)]
+            deltas.add(type(obj), _current_values(obj, fields))
+
+    for obj in session.deleted:
+        if type(obj) in CONTRIBUTIONS:
+            fields, _ = CONTRIBUTIONS[type(obj)]
+            deltas.add(type(obj), _previous_values(obj, fields), -1)
+
+    for obj in session.dirty:
+        if type(obj) not in CONTRIBUTIONS or obj in session.deleted:
+            continue
+        fields, _ = CONTRIBUTIONS[type(obj)]
+        if any(attributes.get_history(obj, field).has_changes() for field in fields):
+            deltas.add(type(obj), _previous_values(obj, fields), -1)
+            deltas.add(type(obj), _current_values(obj, fields))
+
+    deltas.apply(session.connection())
+
+
+def _select_values(session, model, where):
+    fields, _ = CONTRIBUTIONS[model]
+    statement = select(model.id, *(getattr(model, field) for field in fields))
+    if where is not None:
+        statement = statement.where(where)
+    return [dict(row._mapping) for row in session.execute(statement)]
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in CONTRIBUTIONS:
+        return None
+    model = mapper.class_
+    session = orm_execute_state.session
+
+    if orm_execute_state.is_insert:
+        parameters = orm_execute_state.parameters
+        if not isinstance(parameters, list):
+            return None
+        result = orm_execute_state.invoke_statement()
+        deltas = RollupDeltas()
+        for values in parameters:
+            deltas.add(model, values)
+        deltas.apply(session.connection())
+        return result
+
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+
+    deltas = RollupDeltas()
+    before = _select_values(session, model, orm_execute_state.statement.whereclause)
+    for values in before:
+        deltas.add(model, values, -1)
+
+    result = orm_execute_state.invoke_statement()
+
+    if orm_execute_state.is_update:
+        ids = [values['id'] for values in before]
+        for start in range(0, len(ids), _ID_CHUNK):
+            for values in _select_values(session, model, model.id.in_(ids[start:start + _ID_CHUNK])):
+                deltas.add(model, values)
+
+    deltas.apply(session.connection())
+    return result
+
+
+def _noop(target, value, oldvalue, initiator):
+    return value
+
+
+# active_history: при присваивании SQLAlchemy загружает старое значение,
+# иначе вклад старой версии объекта нельзя было бы вычесть
+for _model, (_fields, _) in CONTRIBUTIONS.items():
+    for _field in _fields:
+        event.listen(getattr(_model, _field), 'set', _noop, active_history=True, retval=True)
+
+
+def compute_rollups(connection):
+    """Считает сводку с нуля по таблицам books и reading_sessions"""
+    rows = {}
+
+    def put(dimension, key, **counters):
+        rows[(dimension, key)] = dict(dict.fromkeys(COUNTERS, 0), **counters)
+
+    total = connection.execute(text(
+        'SELECT count(*), coalesce(sum(page_count), 0), coalesce(sum(my_rating), 0), count(my_rating) FROM books'
+    )).one()
+    put('total', '', books=total[0], pages=total[1], rating_sum=total[2], rating_count=total[3])
+
+    for dimension, column in (('status', 'reading_status'), ('genre', 'genre'), ('author', 'author')):
+        for key, books in connection.execute(text(
+                f"SELECT {column}, count(*) FROM books WHERE {column} IS NOT NULL AND {column} != '' "
+                f'GROUP BY {column}')):
+            put(dimension, key, books=books)
+
+    for dimension, pattern in (('month', '%Y-%m'), ('day', '%Y-%m-%d')):
+        for key, pages, sessions, minutes in connection.execute(text(
+                f"SELECT strftime('{pattern}', start_time) AS period, coalesce(sum(pages_read), 0), count(*), "
+                'coalesce(sum(duration_minutes), 0) FROM reading_sessions '
+                'WHERE start_time IS NOT NULL GROUP BY period')):
+            put(dimension, key, pages=pages, sessions=sessions, minutes=minutes)
+
+    return rows
+
+
+def _stored_rollups(connection):
+    return {
+        (row.dimension, row.key): {name: getattr(row, name) for name in COUNTERS}
+        for row in connection.execute(text('SELECT * FROM stat_rollups'))
+    }
+
+
+def rebuild_rollups(connection):
+    """Полностью пересобирает сводку (для восстановления после ручных правок базы)"""
+    rows = compute_rollups(connection)
+    connection.execute(text('DELETE FROM stat_rollups'))
+    if rows:
+        connection.execute(text(
+            'INSERT INTO stat_rollups (dimension, key, books, pages, rating_sum, rating_count, sessions, minutes) '
+            'VALUES (:dimension, :key, :books, :pages, :rating_sum, :rating_count, :sessions, :minutes)'
+        ), [dict(dimension=dimension, key=key, **counters) for (dimension, key), counters in rows.items()])
+
+
+def check_rollups(connection):
+    """Сравнивает сводку с пересчетом; возвращает список расхождений"""
+    expected = _stored_rollups(connection)
+    actual = compute_rollups(connection)
+    problems = []
+    for key in sorted(set(expected) | set(actual)):
+        if expected.get(key) != actual.get(key):
+            problems.append({'row': key, 'stored': expected.get(key), 'actual': actual.get(key)})
+    return problems
+
+
+def rollup_rows(dimension):
+    """Строки сводки по измерению"""
+    return StatRollup.query.filter_by(dimension=dimension)
+
+
+def rollup_total():
+    return db.session.get(StatRollup, ('total', '')) or StatRollup(
+        dimension='total', key='', **dict.fromkeys(COUNTERS, 0))
+
+
+# Ключ периода по дню: неделя - ISO-номер, как 2025-W07
+GRANULARITIES = {
+    'day': lambda day: day.isoformat(),
+    'week': lambda day: '{0}-W{1:02d}'.format(*day.isocalendar()),
+    'month': lambda day: day.strftime('%Y-%m'),
+    'year': lambda day: day.strftime('%Y'),
+}
+
+
+def reading_activity(start, end, granularity='day'):
+    """Страницы, минуты и сессии за период [start, end] по дням, неделям, месяцам или годам.
+
+    Читаются только строки 'day' сводки (не больше одной на день), поэтому
+    время ответа зависит от длины периода, а не от числа сессий. Периоды
+    без чтения пропускаются. Результат в колоночном виде.
+    """
+    period_of = GRANULARITIES[granularity]
+    rows = db.session.query(StatRollup.key, StatRollup.pages, StatRollup.minutes, StatRollup.sessions).filter(
+        StatRollup.dimension == 'day',
+        StatRollup.key.between(start.isoformat(), end.isoformat())
+    ).order_by(StatRollup.key)
+
+    series = {'dates': [], 'pages': [], 'minutes': [], 'sessions': []}
+    for key, pages, minutes, sessions in rows:
+        period = period_of(date.fromisoformat(key))
+        if not series['dates'] or series['dates'][-1] != period:
+            for name, value in (('dates', period), ('pages', 0), ('minutes', 0), ('sessions', 0)):
+                series[name].append(value)
+        series['pages'][-1] += pages
+        series['minutes'][-1] += minutes
+        series['sessions'][-1] += sessions
+    return series
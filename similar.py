@@ -0,0 +1,409 @@
+"""Похожие книги.
+
+Книга - разреженный вектор бинарных признаков: автор, жанр, каждый тег,
+язык и группа оценки. Вес признака - FEATURE_WEIGHTS по виду, умноженный
+на IDF, сходство - косинус. Для каждой книги заранее считаются TOP_K
+соседей и хранятся в book_similarities, так что страница книги читает
+готовый список одним запросом по первичному ключу.
+
+Соседи ищутся по инвертированному индексу признак -> книги в памяти:
+редкие признаки (автор, теги) перебираются целиком, частые (жанр, язык)
+только сужают набор кандидатов, поэтому поиск приближенный, но не
+зависит от размера библиотеки.
+
+Изменения книг ставят их id в similarity_queue в той же транзакции.
+После коммита очередь разбирается в фоновом потоке: пересчитываются сами
+книги, книги, у которых они были в списке, и их новые соседи. Массовые
+UPDATE книг признаки не меняют; если это понадобится, вызывайте mark().
+"""
+import heapq
+import math
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session, attributes
+
+from models import db, Book, BookSimilarity, book_tags, similarity_queue
+from analytics import bump_version, current_version
+from storage import begin_write
+
+TOP_K = 10
+VERSION_NAME = 'similar'
+
+FEATURE_WEIGHTS = {
+    'author': 3.0,
+    'genre': 2.0,
+    'tag': 1.5,
+    'rating': 1.0,
+    'language': 0.5,
+}
+FEATURE_FIELDS = ('author_id', 'author_rel', 'genre', 'language', 'my_rating', 'tags')
+
+# Признак с большим числом книг не перебирается целиком
+MAX_POSTING = 1000
+# Сколько кандидатов добирается из частых признаков
+MAX_CANDIDATES = 500
+
+_ID_CHUNK = 500
+
+
+def _rating_group(rating):
+    return 'low' if rating <= 4 else 'mid' if rating <= 7 else 'high'
+
+
+def book_features(author_id, genre, language, rating, tag_ids):
+    """Признаки книги: множество пар (вид, значение)"""
+    features = {('tag', tag_id) for tag_id in tag_ids}
+    if author_id:
+        features.add(('author', author_id))
+    if genre:
+        features.add(('genre', genre))
+    if language:
+        features.add(('language', language))
+    if rating:
+        features.add(('rating', _rating_group(rating)))
+    return frozenset(features)
+
+
+def read_features(session, ids=None):
+    """{id книги: признаки} для всех книг или только для ids"""
+    chunks = [None] if ids is None else [ids[start:start + _ID_CHUNK] for start in range(0, len(ids), _ID_CHUNK)]
+    features = {}
+    for chunk in chunks:
+        books = select(Book.id, Book.author_id, Book.genre, Book.language, Book.my_rating)
+        links = select(book_tags.c.book_id, book_tags.c.tag_id)
+        if chunk is not None:
+            books = books.where(Book.id.in_(chunk))
+            links = links.where(book_tags.c.book_id.in_(chunk))
+        tags = defaultdict(list)
+        for book_id, tag_id in session.execute(links):
+            tags[book_id].append(tag_id)
+        for book_id, author_id, genre, language, rating in session.execute(books):
+            features[book_id] = book_features(author_id, genre, language, rating, tags[book_id])
+    return features
+
+
+class FeatureIndex:
+    """Признаки книг и инвертированный индекс признак -> множество id книг"""
+
+    def __init__(self, version, features=()):
+        self.version = version
+        self.features = {}
+        self.postings = defaultdict(set)
+        self.norms = {}
+        self._pools = {}
+        for book_id, book in dict(features).items():
+            self.set(book_id, book)
+
+    def __contains__(self, book_id):
+        return book_id in self.features
+
+    def __len__(self):
+        return len(self.features)
+
+    def set(self, book_id, features):
+        self.discard(book_id)
+        self.features[book_id] = features
+        for feature in features:
+            self.postings[feature].add(book_id)
+        self._pools.clear()
+
+    def discard(self, book_id):
+        for feature in self.features.pop(book_id, ()):
+            posting = self.postings[feature]
+            posting.discard(book_id)
+            if not posting:
+                del self.postings[feature]
+        self.norms.pop(book_id, None)
+        self._pools.clear()
+
+    def weight(self, feature):
+        """Квадрат веса признака: вклад общего признака в скалярное произведение"""
+        idf = math.log(1 + len(self.features) / len(self.postings[feature]))
+        return (FEATURE_WEIGHTS[feature[0]] * idf) ** 2
+
+    def norm(self, book_id):
+        # IDF меняется с каждой книгой, но нормы пересчитываются только у
+        # измененных книг; полная перестройка выравнивает их
+        norm = self.norms.get(book_id)
+        if norm is None:
+            norm = self.norms[book_id] = math.sqrt(sum(self.weight(feature)
+                                                       for feature in self.features[book_id])) or 1.0
+        return norm
+
+    def _pool(self, frequent, k):
+        """Кандидаты из пересечения частых признаков, пока в нем больше k книг"""
+        key = tuple(sorted(frequent))
+        pool = self._pools.get(key)
+        if pool is None:
+            books = self.postings[frequent[0]]
+            for feature in frequent[1:]:
+                narrowed = books & self.postings[feature]
+                if len(narrowed) > k:
+                    books = narrowed
+            pool = self._pools[key] = list(islice(books, MAX_CANDIDATES + 1))
+        return pool
+
+    def neighbors(self, book_id, k=TOP_K):
+        """До k самых похожих книг: [(id, сходство)] по убыванию сходства"""
+        own = self.features.get(book_id)
+        if not own:
+            return []
+        scores = defaultdict(float)
+        frequent = []
+        for feature in sorted(own, key=lambda feature: len(self.postings[feature])):
+            posting = self.postings[feature]
+            if len(posting) > MAX_POSTING:
+                frequent.append(feature)
+                continue
+            weight = self.weight(feature)
+            for other in posting:
+                scores[other] += weight
+
+        if frequent:
+            weights = [(self.postings[feature], self.weight(feature)) for feature in frequent]
+            for other in scores:
+                scores[other] += sum(weight for posting, weight in weights if other in posting)
+            if len(scores) < MAX_CANDIDATES:
+                for other in self._pool(frequent, k):
+                    if other not in scores:
+                        scores[other] = sum(weight for posting, weight in weights if other in posting)
+
+        scores.pop(book_id, None)
+        norm = self.norm(book_id)
+        best = heapq.nlargest(k, ((score / (norm * self.norm(other)), -other) for other, score in scores.items()))
+        return [(-other, round(score, 4)) for score, other in best]
+
+
+def mark(session, book_ids):
+    """Ставит книги в очередь пересчета в текущей транзакции"""
+    book_ids = sorted(set(book_ids))
+    if not book_ids:
+        return
+    session.connection().execute(insert(similarity_queue).prefix_with('OR IGNORE'),
+                                 [{'book_id': book_id} for book_id in book_ids])
+    session.info['similar_queued'] = True
+
+
+def queue_all(connection):
+    """Ставит в очередь все книги (после прямых вставок мимо сессии)"""
+    connection.execute(insert(similarity_queue).prefix_with('OR IGNORE').from_select(['book_id'], select(Book.id)))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    ids = {obj.id for obj in session.new if isinstance(obj, Book)}
+    ids.update(obj.id for obj in session.deleted if isinstance(obj, Book))
+    ids.update(obj.id for obj in session.dirty
+               if isinstance(obj, Book) and obj not in session.deleted
+               and any(attributes.get_history(obj, field).has_changes() for field in FEATURE_FIELDS))
+    mark(session, ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not Book:
+        return
+    session = orm_execute_state.session
+    if orm_execute_state.is_insert and isinstance(orm_execute_state.parameters, list):
+        mark(session, [values['id'] for values in orm_execute_state.parameters if 'id' in values])
+    elif orm_execute_state.is_delete:
+        statement = select(Book.id)
+        if orm_execute_state.statement.whereclause is not None:
+            statement = statement.where(orm_execute_state.statement.whereclause)
+        mark(session, session.execute(statement).scalars().all())
+
+
+@event.listens_for(Session, 'after_commit')
+def _schedule_update(session):
+    if session.info.pop('similar_queued', False):
+        similar_index.schedule()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queue(session):
+    session.info.pop('similar_queued', None)
+
+
+class SimilarIndex:
+    def __init__(self):
+        self.app = None
+        self.top_k = TOP_K
+        self.auto_update = True
+        self.batch = 200
+        self._features = None
+        self._scheduled = False
+        self._executor = None
+        self._lock = threading.Lock()
+        self._process_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Настройки: SIMILAR_BOOKS_K, SIMILAR_BOOKS_AUTO_UPDATE, SIMILAR_BOOKS_BATCH"""
+        self.app = app
+        self.top_k = app.config.get('SIMILAR_BOOKS_K', TOP_K)
+        self.auto_update = app.config.get('SIMILAR_BOOKS_AUTO_UPDATE', True)
+        self.batch = app.config.get('SIMILAR_BOOKS_BATCH', 200)
+        self._features = None
+
+    def schedule(self):
+        """Разбор очереди в фоновом потоке; повторный вызов до начала разбора ничего не добавляет"""
+        if self.app is None or not self.auto_update:
+            return None
+        with self._lock:
+            if self._scheduled:
+                return None
+            self._scheduled = True
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similar-books')
+            return self._executor.submit(self._run)
+
+    def _run(self):
+        with self._lock:
+            self._scheduled = False
+        with self.app.app_context():
+            try:
+                while self.process_queue():
+                    pass
+            except Exception:
+                self.app.logger.exception('Не удалось обновить похожие книги')
+            finally:
+                db.session.remove()
+
+    def _index(self, session):
+        version = current_version(VERSION_NAME)
+        if self._features is None or self._features.version != version:
+            # Очередь разбирал другой процесс: наш индекс мог устареть
+            self._features = FeatureIndex(version, read_features(session))
+        return self._features
+
+    def _write(self, session, lists, replace=True):
+        """Записывает списки соседей {id книги: [(id, сходство)]}.
+
+        replace=True сначала удаляет прежние списки этих книг; при полном
+        пересчете таблица уже очищена и удалять нечего.
+        """
+        connection = session.connection()
+        if replace:
+            book_ids = sorted(lists)
+            for start in range(0, len(book_ids), _ID_CHUNK):
+                connection.execute(delete(BookSimilarity).where(
+                    BookSimilarity.book_id.in_(book_ids[start:start + _ID_CHUNK])))
+        rows = [{'book_id': book_id, 'rank': rank, 'similar_id': similar_id, 'score': score}
+                for book_id, neighbors in lists.items()
+                for rank, (similar_id, score) in enumerate(neighbors)]
+        if rows:
+            connection.execute(insert(BookSimilarity), rows)
+
+    def process_queue(self, batch=None):
+        """Пересчитывает соседей для пачки книг из очереди; возвращает размер пачки.
+
+        Соседи считаются без открытой транзакции; книги, признаки которых
+        изменились за это время, остаются в очереди до следующего прохода.
+        """
+        session = db.session
+        with self._process_lock:
+            try:
+                ids = session.execute(select(similarity_queue.c.book_id)
+                                      .limit(batch or self.batch)).scalars().all()
+                if not ids:
+                    session.commit()
+                    return 0
+                index = self._index(session)
+                fresh = read_features(session, ids)
+                # Книги, у которых измененные были в списке соседей
+                affected = set(ids)
+                for start in range(0, len(ids), _ID_CHUNK):
+                    affected.update(session.execute(select(BookSimilarity.book_id).where(
+                        BookSimilarity.similar_id.in_(ids[start:start + _ID_CHUNK]))).scalars())
+                # Пока считаются соседи, транзакция не держится
+                session.commit()
+
+                for book_id in ids:
+                    if book_id in fresh:
+                        index.set(book_id, fresh[book_id])
+                    else:
+                        index.discard(book_id)
+                lists = {book_id: index.neighbors(book_id, self.top_k) for book_id in affected}
+                # Новые соседи измененной книги: теперь она может войти в их списки
+                for book_id in ids:
+                    for neighbor, _ in lists[book_id]:
+                        if neighbor not in lists:
+                            lists[neighbor] = index.neighbors(neighbor, self.top_k)
+
+                # Повторная постановка в очередь не меняет строку (OR IGNORE),
+                # поэтому изменения за время расчета видны только по признакам
+                begin_write(session)
+                current = read_features(session, ids)
+                done = [book_id for book_id in ids if current.get(book_id) == fresh.get(book_id)]
+                self._write(session, lists)
+                session.execute(delete(similarity_queue).where(similarity_queue.c.book_id.in_(done)))
+                bump_version(session.connection(), VERSION_NAME)
+                session.commit()
+                index.version += 1
+                return len(ids)
+            except Exception:
+                session.rollback()
+                self._features = None
+                raise
+
+    def rebuild(self, progress=None):
+        """Полный пересчет индекса; progress(сделано, всего) вызывается каждые 1000 книг"""
+        session = db.session
+        progress = progress or (lambda done, total: None)
+        with self._process_lock:
+            version = current_version(VERSION_NAME)
+            index = FeatureIndex(version, read_features(session))
+            # Пока индекс считается, транзакция чтения не держится
+            session.commit()
+            lists = {}
+            for done, book_id in enumerate(index.features, start=1):
+                lists[book_id] = index.neighbors(book_id, self.top_k)
+                if done % 1000 == 0:
+                    progress(done, len(index))
+            progress(len(index), len(index))
+
+            try:
+                session.execute(delete(BookSimilarity))
+                self._write(session, lists, replace=False)
+                changed = current_version(VERSION_NAME) != version
+                bump_version(session.connection(), VERSION_NAME)
+                session.commit()
+            except Exception:
+                session.rollback()
+                self._features = None
+                raise
+            # Если очередь за это время разбирал другой процесс, индекс перечитается
+            index.version = version + 1
+            self._features = None if changed else index
+            return len(lists)
+
+    def status(self):
+        return {
+            'queued': db.session.execute(select(func.count()).select_from(similarity_queue)).scalar(),
+            'books': db.session.execute(select(func.count(func.distinct(BookSimilarity.book_id)))).scalar(),
+            'rows': db.session.execute(select(func.count()).select_from(BookSimilarity)).scalar(),
+            'top_k': self.top_k,
+        }
+
+
+def similar_books(book_id, limit=None):
+    """Похожие книги из индекса: [(Book, сходство)] в порядке rank"""
+    return db.session.execute(
+        select(Book, BookSimilarity.score)
+        .join(BookSimilarity, BookSimilarity.similar_id == Book.id)
+        .where(BookSimilarity.book_id == book_id)
+        .order_by(BookSimilarity.rank)
+        .limit(limit or similar_index.top_k)
+    ).all()
+
+
+def is_queued(book_id):
+    return db.session.execute(select(similarity_queue.c.book_id).where(
+        similarity_queue.c.book_id == book_id)).first() is not None
+
+
+similar_index = SimilarIndex()
@@ -0,0 +1,282 @@
+"""Профили хранения SQLite.
+
+Профиль задает PRAGMA, которые выполняются при открытии каждого
+соединения. Чтения идут через отдельный пул соединений только для
+чтения (bind 'read'), а все записи - через единственное соединение
+писателя, которое начинает транзакцию с BEGIN IMMEDIATE. Сессия берет
+писателя только на первой записи (flush, DML, session.connection()) и
+после нее до конца транзакции читает через него же; в запросах GET
+через пул чтения идет всё, кроме flush и DML. При ошибке "database is
+locked" view можно повторить декоратором retry_on_busy.
+"""
+import functools
+import os
+import threading
+import time
+
+from flask import request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import column, event, func, select, table, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import SelectBase
+
+READ_BIND = 'read'
+
+# PRAGMA по профилям; значения cache_size в КиБ со знаком минус, как в SQLite
+STORAGE_PROFILES = {
+    'development': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+        },
+        'read_pool_size': 2,
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+            'temp_store': 'MEMORY',
+        },
+        'read_pool_size': 8,
+    },
+}
+
+# Эти PRAGMA меняют файл базы и выполняются только на соединении писателя
+_WRITER_ONLY_PRAGMAS = ('journal_mode',)
+
+# Повторы при "database is locked": количество и начальная пауза в секундах
+BUSY_RETRIES = 3
+BUSY_DELAY = 0.05
+
+
+class RoutingSession(FlaskSession):
+    """Сессия, которая отправляет чтения в пул чтения, пока ничего не записала.
+
+    flush, DML и session.connection() идут писателю, и с этого момента до
+    конца транзакции - все запросы сессии. В режиме read_only в пул чтения
+    идут и текстовые запросы.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None and (self.info.get('read_only')
+                                       or (isinstance(clause, SelectBase) and not self.info.get('writing'))):
+                return engine
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None:
+            self.info['writing'] = True
+        return engine
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute', insert=True)
+def _lock_before_write(orm_execute_state):
+    # Обработчики массовых UPDATE/DELETE (rollups.py, facets.py и др.) читают
+    # строки до изменения: это должно происходить уже под блокировкой записи
+    if not orm_execute_state.is_select:
+        begin_write(orm_execute_state.session)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _forget_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('writing', None)
+
+
+def begin_write(session):
+    """Сразу берет соединение писателя и блокировку записи.
+
+    Нужна перед чтением, по которому потом пишут (max(id), выбор задач):
+    после нее чтения сессии идут писателю и видят данные под блокировкой.
+    """
+    session.connection()
+
+
+def read_connection(session):
+    """Соединение текущей транзакции для чтения: пул чтения, пока сессия ничего не записала"""
+    engine = session.get_bind(clause=select(1))
+    return session.connection(bind_arguments={'bind': engine})
+
+
+def _profile(app):
+    name = app.config.setdefault('STORAGE_PROFILE', os.environ.get('LIBRARY_STORAGE_PROFILE', 'production'))
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f'Неизвестный профиль хранения: {name}')
+    profile = STORAGE_PROFILES[name]
+    pragmas = dict(profile['pragmas'], **app.config.get('STORAGE_PRAGMAS', {}))
+    return name, profile, pragmas
+
+
+def configure(app):
+    """Дополняет конфиг SQLAlchemy до db.init_app: bind для чтения и один писатель"""
+    _, profile, _ = _profile(app)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+        # Единственное соединение писателя: записи внутри процесса идут по очереди
+        'pool_size': 1,
+        'max_overflow': 0,
+        'pool_timeout': 30,
+    })
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    binds.setdefault(READ_BIND, {
+        'url': app.config['SQLALCHEMY_DATABASE_URI'],
+        'pool_size': profile['read_pool_size'],
+        'max_overflow': profile['read_pool_size'],
+    })
+
+
+def _set_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def _setup_engine(engine, pragmas, writer):
+    if engine.dialect.name != 'sqlite':
+        return
+    connection_pragmas = {name: value for name, value in pragmas.items()
+                          if writer or name not in _WRITER_ONLY_PRAGMAS}
+    if not writer:
+        connection_pragmas['query_only'] = 'ON'
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        # Транзакциями управляем сами, а не драйвер sqlite3
+        dbapi_connection.isolation_level = None
+        _set_pragmas(dbapi_connection, connection_pragmas)
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(connection):
+        # Писатель сразу берет блокировку записи: иначе при повышении
+        # блокировки с чтения на запись busy_timeout не помогает
+        connection.exec_driver_sql('BEGIN IMMEDIATE' if writer else 'BEGIN')
+
+
+def init_app(app, db):
+    """Настраивает PRAGMA на движках и направляет GET-запросы в пул чтения"""
+    _, _, pragmas = _profile(app)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            _setup_engine(engine, pragmas, writer=key != READ_BIND)
+
+    @app.before_request
+    def _route_reads():
+        # Флаг ставится и снимается явно: после потокового ответа сессия
+        # может достаться следующему запросу
+        db.session.info['read_only'] = request.method in ('GET', 'HEAD')
+
+
+def is_busy_error(error):
+    # Соединение писателя занято дольше pool_timeout - та же занятость, что и блокировка
+    if isinstance(error, PoolTimeoutError):
+        return True
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_busy(view):
+    """Повторяет view с откатом транзакции, если база занята другим процессом"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        from models import db
+
+        delay = BUSY_DELAY
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return view(*args, **kwargs)
+            except (OperationalError, PoolTimeoutError) as e:
+                db.session.rollback()
+                if attempt == BUSY_RETRIES or not is_busy_error(e):
+                    raise
+                time.sleep(delay)
+                delay *= 2
+    return wrapper
+
+
+def effective_pragmas(app, db, bind_key=None):
+    """Фактические значения PRAGMA на соединении движка"""
+    _, _, pragmas = _profile(app)
+    with db.engines[bind_key].connect() as conn:
+        return {name: conn.execute(text(f'PRAGMA {name}')).scalar()
+                for name in list(pragmas) + ['query_only']}
+
+
+def stress_test(app, db, seconds=5.0, readers=8, writers=2, pause=0.001):
+    """Одновременные чтение и запись во временную таблицу; возвращает счетчики.
+
+    Читатели работают в режиме read_only (как GET), писатели - через
+    соединение писателя с retry_on_busy. pause - пауза между операциями
+    потока, как между запросами клиента.
+    """
+    from models import Book
+
+    stats = {'reads': 0, 'writes': 0, 'read_errors': 0, 'write_errors': 0,
+             'max_read_ms': 0.0, 'max_write_ms': 0.0}
+    # Своя таблица на процесс: тест можно запускать в нескольких процессах сразу
+    name = f'storage_stress_{os.getpid()}'
+    stress = table(name, column('id'))
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    with app.app_context():
+        db.session.execute(text(f'CREATE TABLE IF NOT EXISTS {name} ('
+                                'id INTEGER PRIMARY KEY, worker INTEGER, payload TEXT)'))
+        db.session.commit()
+
+    def count(key, value=1):
+        with lock:
+            stats[key] += value
+
+    def timed(key, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            stats[key] = max(stats[key], elapsed)
+
+    def reader():
+        while time.monotonic() < deadline:
+            with app.app_context():
+                db.session.info['read_only'] = True
+                started = time.perf_counter()
+                try:
+                    db.session.execute(select(func.count(), func.max(stress.c.id))).one()
+                    db.session.execute(select(func.count()).select_from(Book)).scalar()
+                    count('reads')
+                except OperationalError:
+                    count('read_errors')
+                timed('max_read_ms', started)
+            time.sleep(pause)
+
+    def writer(number):
+        @retry_on_busy
+        def write():
+            db.session.execute(text(f'INSERT INTO {name} (worker, payload) VALUES (:w, :p)'),
+                               {'w': number, 'p': 'x' * 200})
+            db.session.commit()
+
+        while time.monotonic() < deadline:
+            with app.app_context():
+                started = time.perf_counter()
+                try:
+                    write()
+                    count('writes')
+                except OperationalError:
+                    count('write_errors')
+                timed('max_write_ms', started)
+            time.sleep(pause)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.session.execute(text(f'DROP TABLE {name}'))
+        db.session.commit()
+    return stats
@@ -0,0 +1,314 @@
+"""Автодополнение названий, авторов, тегов, издателей и мест хранения.
+
+Для каждого поля в памяти процесса хранится отсортированный список пар
+(ключ, значение): ключ - значение в нижнем регистре с ё -> е, начиная с
+каждого слова, поэтому «тол» находит и «Толстой Лев», и «Лев Толстой».
+Подсказки - bisect по префиксу и несколько следующих элементов.
+
+Индекс поля строится при первом запросе и дальше поддерживается событиями
+сессии, как кэш фильтров в facets.py; массовые UPDATE/DELETE книг
+учитываются по значениям до и после, как в rollups.py. После изменений в
+обход ORM (datagen, удаление неиспользуемых тегов) поле сбрасывается и
+строится заново при следующем запросе. Индекс у каждого процесса свой
+и не знает о записях других процессов, поэтому фильтр каталога по
+неполному имени автора (author_condition) считается в SQL по тем же
+правилам: функция suggest_match регистрируется на соединениях в init_app.
+"""
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, attributes
+
+from models import db, Book, Tag
+
+FIELDS = ('title', 'author', 'tag', 'publisher', 'physical_location')
+
+# Поля, значения которых - колонки книги
+BOOK_FIELDS = ('title', 'author', 'publisher', 'physical_location')
+
+MAX_SUGGESTIONS = 10
+
+_WORD = re.compile(r'\w+')
+_ID_CHUNK = 500
+
+
+def normalize(value):
+    """Нижний регистр и ё -> е"""
+    return (value or '').casefold().replace('ё', 'е')
+
+
+def _keys(value):
+    """Ключи значения: с начала строки и с начала каждого слова"""
+    normalized = normalize(value)
+    starts = {match.start() for match in _WORD.finditer(normalized)} | {0}
+    return {normalized[start:] for start in starts}
+
+
+def match_rank(value, prefix):
+    """2 - prefix совпадает со значением целиком, 1 - с началом слова значения, 0 - нет"""
+    if normalize(value) == prefix:
+        return 2
+    return int(any(key.startswith(prefix) for key in _keys(value)))
+
+
+def author_condition(query):
+    """Условие фильтра книг по введенному имени автора.
+
+    Имя целиком выбирает только этого автора, иначе подходят все авторы
+    со словом на введенный текст.
+    """
+    prefix = normalize(query).strip()
+    names = select(Book.author.label('name'), func.suggest_match(Book.author, prefix).label('rank')) \
+        .group_by(Book.author).cte('author_matches')
+    best = select(func.max(names.c.rank)).scalar_subquery()
+    return Book.author.in_(select(names.c.name).where(names.c.rank > 0, names.c.rank == best))
+
+
+def _load_field(field):
+    """Значение -> число книг (у тегов - 1)"""
+    if field == 'tag':
+        return {name: 1 for name in db.session.execute(select(Tag.name)).scalars() if name}
+    column = getattr(Book, field)
+    rows = db.session.execute(select(column, func.count()).where(column.isnot(None)).group_by(column))
+    return {value: count for value, count in rows if value}
+
+
+class PrefixIndex:
+    """Отсортированные пары (ключ, значение) одного поля"""
+
+    def __init__(self, counts):
+        self.counts = dict(counts)
+        self.entries = sorted((key, value) for value in self.counts for key in _keys(value))
+        # Ключи с начала значения отдельно: такие совпадения показываются первыми
+        self.starts = sorted((normalize(value), value) for value in self.counts)
+
+    def add(self, value, delta):
+        count = self.counts.get(value, 0) + delta
+        if count > 0 and value not in self.counts:
+            for key in _keys(value):
+                insort(self.entries, (key, value))
+            insort(self.starts, (normalize(value), value))
+        elif count <= 0 and value in self.counts:
+            for key in _keys(value):
+                _discard(self.entries, (key, value))
+            _discard(self.starts, (normalize(value), value))
+        if count > 0:
+            self.counts[value] = count
+        else:
+            self.counts.pop(value, None)
+
+    def search(self, prefix, limit):
+        """До limit значений с ключом на prefix; сначала совпадения с начала значения"""
+        found = []
+        for value in _walk(self.starts, prefix):
+            if len(found) == limit:
+                return found
+            found.append(value)
+        seen = set(found)
+        others = []
+        for value in _walk(self.entries, prefix):
+            if len(found) + len(others) == limit:
+                break
+            if value not in seen:
+                seen.add(value)
+                others.append(value)
+        return found + sorted(others, key=normalize)
+
+
+def _walk(entries, prefix):
+    """Значения подряд с ключа, равного prefix, пока ключ на него начинается"""
+    index = bisect_left(entries, (prefix,))
+    while index < len(entries) and entries[index][0].startswith(prefix):
+        yield entries[index][1]
+        index += 1
+
+
+def _discard(entries, entry):
+    index = bisect_left(entries, entry)
+    if index < len(entries) and entries[index] == entry:
+        del entries[index]
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db):
+        """Регистрирует SQL-функцию suggest_match(значение, prefix) для author_condition"""
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'connect', _register_functions)
+
+    def _index(self, field):
+        # Вызывается под self._lock
+        index = self._indexes.get(field)
+        if index is None:
+            index = self._indexes[field] = PrefixIndex(_load_field(field))
+        return index
+
+    def suggest(self, field, query, limit=MAX_SUGGESTIONS):
+        """Подсказки для поля по началу query"""
+        prefix = normalize(query).lstrip()
+        if not prefix:
+            return []
+        with self._lock:
+            return self._index(field).search(prefix, limit)
+
+    def apply(self, deltas):
+        with self._lock:
+            for field, changes in deltas.items():
+                index = self._indexes.get(field)
+                if index is None:
+                    continue
+                for value, delta in changes.items():
+                    if value and delta:
+                        index.add(value, delta)
+
+    def invalidate(self, field=None):
+        with self._lock:
+            if field is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(field, None)
+
+    def status(self):
+        with self._lock:
+            return {field: len(index.counts) for field, index in self._indexes.items()}
+
+
+suggest_index = SuggestIndex()
+
+
+def _register_functions(dbapi_connection, connection_record):
+    dbapi_connection.create_function('suggest_match', 2, match_rank, deterministic=True)
+
+
+def _pending(session):
+    return session.info.setdefault('suggest_changes', {'deltas': defaultdict(lambda: defaultdict(int)),
+                                                       'invalidate': set()})
+
+
+def invalidate_after_commit(session, *fields):
+    """Сбросить поля после коммита: для изменений в обход ORM"""
+    _pending(session)['invalidate'].update(fields or FIELDS)
+
+
+def _previous(obj, field):
+    history = attributes.get_history(obj, field)
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = None
+    for obj in session.new:
+        if isinstance(obj, Book):
+            changes = changes or _pending(session)
+            for field in BOOK_FIELDS:
+                changes['deltas'][field][getattr(obj, field)] += 1
+        elif isinstance(obj, Tag):
+            changes = changes or _pending(session)
+            changes['deltas']['tag'][obj.name] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Book):
+            changes = changes or _pending(session)
+            for field in BOOK_FIELDS:
+                changes['deltas'][field][_previous(obj, field)] -= 1
+        elif isinstance(obj, Tag):
+            changes = changes or _pending(session)
+            changes['deltas']['tag'][_previous(obj, 'name')] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Book):
+            pairs = [(field, field) for field in BOOK_FIELDS]
+        elif isinstance(obj, Tag):
+            pairs = [('tag', 'name')]
+        else:
+            continue
+        for field, attribute in pairs:
+            history = attributes.get_history(obj, attribute)
+            if history.has_changes():
+                changes = changes or _pending(session)
+                for value in history.deleted:
+                    changes['deltas'][field][value] -= 1
+                for value in history.added:
+                    changes['deltas'][field][value] += 1
+
+
+def _book_values(session, whereclause):
+    """{id: значения полей подсказок} книг, попадающих под условие"""
+    statement = select(Book.id, *(getattr(Book, field) for field in BOOK_FIELDS))
+    if whereclause is not None:
+        statement = statement.where(whereclause)
+    return {row[0]: row[1:] for row in session.execute(statement)}
+
+
+def _count_books(changes, rows, sign):
+    for values in rows:
+        for field, value in zip(BOOK_FIELDS, values):
+            changes['deltas'][field][value] += sign
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in (Book, Tag) or orm_execute_state.is_select:
+        return None
+    session = orm_execute_state.session
+    changes = _pending(session)
+
+    if orm_execute_state.is_insert and isinstance(orm_execute_state.parameters, list):
+        # Импорт вставляет книги и теги пачками: значения есть в параметрах
+        for values in orm_execute_state.parameters:
+            if mapper.class_ is Tag:
+                changes['deltas']['tag'][values.get('name')] += 1
+            else:
+                _count_books(changes, [[values.get(field) for field in BOOK_FIELDS]], 1)
+        return None
+    if mapper.class_ is Tag or orm_execute_state.is_insert:
+        changes['invalidate'].update(('tag',) if mapper.class_ is Tag else BOOK_FIELDS)
+        return None
+
+    # Как в rollups.py: значения до и после массового UPDATE/DELETE книг
+    before = _book_values(session, orm_execute_state.statement.whereclause)
+    _count_books(changes, before.values(), -1)
+    if orm_execute_state.is_delete:
+        return None
+    result = orm_execute_state.invoke_statement()
+    ids = sorted(before)
+    for start in range(0, len(ids), _ID_CHUNK):
+        _count_books(changes, _book_values(session, Book.id.in_(ids[start:start + _ID_CHUNK])).values(), 1)
+    return result
+
+
+def _noop(target, value, oldvalue, initiator):
+    return value
+
+
+# active_history, как в rollups.py: старое значение нужно, чтобы убрать его из индекса
+for _model, _fields in ((Book, BOOK_FIELDS), (Tag, ('name',))):
+    for _field in _fields:
+        event.listen(getattr(_model, _field), 'set', _noop, active_history=True, retval=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('suggest_changes', None)
+    if not changes:
+        return
+    for field in changes['invalidate']:
+        suggest_index.invalidate(field)
+        changes['deltas'].pop(field, None)
+    suggest_index.apply(changes['deltas'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('suggest_changes', None)
@@ -0,0 +1,52 @@
+from sqlalchemy import text
+from models import db, Tag
+from suggest import invalidate_after_commit
+
+
+def parse_tags(value):
+    """Разбирает строку тегов через запятую в список уникальных имен"""
+    if not value:
+        return []
+
+    names = []
+    for name in value.split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def get_or_create_tags(names):
+    """Возвращает объекты Tag для списка имен, создавая недостающие"""
+    if not names:
+        return []
+
+    # Учитываем еще не сохраненные теги, созданные в этой же сессии
+    existing = {obj.name: obj for obj in db.session.new if isinstance(obj, Tag)}
+    with db.session.no_autoflush:
+        existing.update((tag.name, tag) for tag in Tag.query.filter(Tag.name.in_(names)).all())
+    tags = []
+    for name in names:
+        tag = existing.get(name)
+        if tag is None:
+            tag = Tag(name=name)
+            db.session.add(tag)
+            existing[name] = tag
+        tags.append(tag)
+    return tags
+
+
+def set_book_tags(book, value):
+    """Заменяет теги книги тегами из строки через запятую"""
+    book.tags = get_or_create_tags(parse_tags(value))
+
+
+def prune_unused_tags():
+    """Удаляет теги, не привязанные ни к одной книге"""
+    db.session.flush()
+    db.session.execute(text(
+        'DELETE FROM tags WHERE NOT EXISTS '
+        '(SELECT 1 FROM book_tags WHERE book_tags.tag_id = tags.id)'
+    ))
+    # Удаление идет мимо ORM: подсказки тегов соберутся заново
+    invalidate_after_commit(db.session, 'tag')
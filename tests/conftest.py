@@ -0,0 +1,101 @@
+"""Общие фикстуры тестов.
+
+Приложение создается при импорте app.py, поэтому каталог instance (база,
+кэши ISBN и обложек) подменяется временным до импорта. Тест с фикстурой
+app получает пустую базу после миграций и сброшенные кэши процесса.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+from sqlalchemy import text
+
+INSTANCE_PATH = tempfile.mkdtemp(prefix='library-tests-')
+os.environ['LIBRARY_INSTANCE_PATH'] = INSTANCE_PATH
+os.environ['LIBRARY_STORAGE_PROFILE'] = 'development'
+
+import analytics  # noqa: E402
+import duplicates  # noqa: E402
+from app import app as flask_app  # noqa: E402
+from facets import facet_cache  # noqa: E402
+from duplicates import rebuild_name_index  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from models import db  # noqa: E402
+from rollups import check_rollups  # noqa: E402
+from search import create_search_index  # noqa: E402
+from similar import similar_index  # noqa: E402
+from suggest import suggest_index  # noqa: E402
+
+# Фоновый пересчет похожих книг держал бы соединения и мешал удалять базу
+similar_index.auto_update = False
+
+
+def reset_database():
+    """Пустая база после миграций и сброшенные кэши процесса"""
+    with flask_app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        path = os.path.join(INSTANCE_PATH, f'library.db{suffix}')
+        if os.path.exists(path):
+            os.remove(path)
+    with flask_app.app_context():
+        run_migrations()
+        db.session.remove()
+    facet_cache.invalidate()
+    suggest_index.invalidate()
+    analytics.clear_cache()
+    duplicates._report_cache.clear()
+    similar_index._features = None
+
+
+# Таблицы, которые поддерживают события сессии и триггеры
+DERIVED_TABLES = {
+    'books_fts': 'SELECT rowid, title, author, description, notes, publisher, tags FROM books_fts',
+    'title_trigrams': 'SELECT * FROM title_trigrams',
+    'author_trigrams': 'SELECT * FROM author_trigrams',
+    'trigram_counts': 'SELECT * FROM trigram_counts WHERE count != 0',
+}
+
+
+def _derived(conn):
+    return {name: sorted(conn.execute(text(query)).all()) for name, query in DERIVED_TABLES.items()}
+
+
+def assert_derived_consistent():
+    """Сводка, FTS и триграммы совпадают с полной пересборкой по текущим данным"""
+    with flask_app.app_context():
+        db.session.remove()
+        with db.engine.connect() as conn:
+            assert check_rollups(conn) == []
+            maintained = _derived(conn)
+            rebuild_name_index(conn)
+            create_search_index(conn)
+            assert maintained == _derived(conn)
+            conn.rollback()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _instance_dir():
+    yield
+    shutil.rmtree(INSTANCE_PATH, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    reset_database()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def derived_consistent():
+    return assert_derived_consistent
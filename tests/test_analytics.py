@@ -0,0 +1,73 @@
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import analytics
+from models import db, Book, ReadingGoal, ReadingSession
+from rollups import reading_activity
+
+pytestmark = pytest.mark.skipif(not analytics.available(), reason='нужен NumPy')
+
+TODAY = date(2026, 3, 20)
+
+
+def add_sessions(app, book, sessions):
+    """sessions: [(день, страниц)]; время сессии - 12:00 UTC"""
+    with app.app_context():
+        db.session.add(book)
+        db.session.flush()
+        for day, pages in sessions:
+            start = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+            db.session.add(ReadingSession(book_id=book.id, start_time=start, pages_read=pages, duration_minutes=60))
+        db.session.commit()
+        book_id = book.id
+        db.session.remove()
+    return book_id
+
+
+def test_finish_forecast_for_recently_started_book(app):
+    # Начата три дня назад, по 50 страниц в день
+    book_id = add_sessions(app, Book(title='Новая', author='Автор', reading_status='читаю', page_count=500,
+                                     current_page=150),
+                           [(TODAY - timedelta(days=offset), 50) for offset in range(3)])
+    with app.app_context():
+        item = analytics.reading_analytics(TODAY)['finish']['items'][0]
+        db.session.remove()
+    assert item['book_id'] == book_id
+    assert item['pages_per_day'] == 50.0
+    assert item['days_left'] == 7
+
+
+def test_goal_pace_is_clipped_to_period(app):
+    # 300 страниц в конце февраля не считаются в скорость мартовской цели
+    add_sessions(app, Book(title='Книга', author='Автор'),
+                 [(date(2026, 2, 27), 300)] + [(date(2026, 3, day), 10) for day in range(1, 21)])
+    with app.app_context():
+        db.session.add(ReadingGoal(year=2026, month=3, goal_type='pages', target=1000))
+        db.session.commit()
+        goal = analytics.reading_analytics(TODAY)['goals'][0]
+        db.session.remove()
+    assert goal['progress'] == 200
+    assert goal['projected'] == 310
+
+
+def test_days_match_activity_rollup(app, monkeypatch):
+    # 23:30 UTC - уже следующий день по местному времени Владивостока
+    monkeypatch.setenv('TZ', 'Asia/Vladivostok')
+    time.tzset()
+    try:
+        with app.app_context():
+            book = Book(title='Книга', author='Автор')
+            db.session.add(book)
+            db.session.flush()
+            db.session.add(ReadingSession(book_id=book.id, start_time=datetime(2026, 3, 19, 23, 30), pages_read=10))
+            db.session.commit()
+            streaks = analytics.reading_analytics(TODAY)['streaks']
+            activity = reading_activity(date(2026, 3, 18), date(2026, 3, 21))
+            db.session.remove()
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
+    assert activity['dates'] == ['2026-03-19']
+    assert streaks['longest_start'] == '2026-03-19'
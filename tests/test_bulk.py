@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+import bulk
+from models import db, Book, ReadingSession, Tag
+
+COUNT = 7
+
+
+@pytest.fixture
+def library(app, monkeypatch):
+    """Семь книг с сессиями чтения; пачки по три id, чтобы операции шли несколькими операторами"""
+    monkeypatch.setattr(bulk.chunked, '__defaults__', (3,))
+    with app.app_context():
+        for number in range(COUNT):
+            book = Book(title=f'Книга {number}', author=f'Автор {number % 2}', genre='Роман' if number % 2 else 'Поэзия',
+                        page_count=100 + number, my_rating=number + 1)
+            db.session.add(book)
+            db.session.flush()
+            db.session.add(ReadingSession(book_id=book.id, start_time=datetime(2026, 3, number + 1, 12),
+                                          pages_read=10, duration_minutes=30))
+        db.session.commit()
+        ids = db.session.execute(db.select(Book.id).order_by(Book.id)).scalars().all()
+        db.session.remove()
+    return ids
+
+
+def bulk_post(client, operation, ids=None, **form):
+    data = dict(form, operation=operation)
+    if ids is None:
+        data['select_all'] = '1'
+    else:
+        data['book_ids'] = [str(book_id) for book_id in ids]
+    response = client.post('/books/bulk_operations', data=data)
+    assert response.status_code == 302
+
+
+def state(app):
+    with app.app_context():
+        rows = [(book.id, book.reading_status, book.tag_names, book.current_page)
+                for book in Book.query.order_by(Book.id)]
+        sessions = db.session.query(ReadingSession).count()
+        tags = sorted(db.session.execute(db.select(Tag.name)).scalars())
+        db.session.remove()
+    return rows, sessions, tags
+
+
+def test_bulk_operations_keep_rollups(client, library, derived_consistent):
+    app = client.application
+    bulk_post(client, 'change_status', library[:5], new_status='прочитана')
+    rows, _, _ = state(app)
+    assert [row[1] for row in rows] == ['прочитана'] * 5 + ['не начата'] * 2
+    assert [row[3] for row in rows[:5]] == [100, 101, 102, 103, 104]
+    derived_consistent()
+
+    bulk_post(client, 'add_tag', new_tag='классика', genre='Роман')
+    rows, _, tags = state(app)
+    assert [row[2] for row in rows] == ['', 'классика'] * 3 + ['']
+    assert tags == ['классика']
+    derived_consistent()
+
+    bulk_post(client, 'remove_tag', library, new_tag='классика')
+    assert state(app)[2] == []
+    derived_consistent()
+
+    bulk_post(client, 'delete', library[1:6])
+    rows, sessions, _ = state(app)
+    assert [row[0] for row in rows] == [library[0], library[6]]
+    assert sessions == 2
+    derived_consistent()
+
+    bulk_post(client, 'delete')
+    assert state(app) == ([], 0, [])
+    derived_consistent()
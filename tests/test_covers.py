@@ -0,0 +1,156 @@
+import os
+import struct
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import covers
+from covers import cover_store
+from models import db, Book
+
+
+def png(width, height):
+    """Однотонная картинка PNG без Pillow"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + b'\x80\x40\x20' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class CoverServer(ThreadingHTTPServer):
+    """Отдает картинки из self.files по пути, остальное - 404"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), CoverHandler)
+        self.files = {}
+        self.requests = []
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+
+class CoverHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        data = self.server.files.get(self.path)
+        self.send_response(200 if data is not None else 404)
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+        self.wfile.write(data or b'')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = CoverServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(app, tmp_path):
+    """Кэш обложек во временном каталоге"""
+    previous = app.config['COVERS_PATH']
+    app.config['COVERS_PATH'] = str(tmp_path / 'covers')
+    cover_store.init_app(app)
+    yield cover_store
+    cover_store.drain()
+    app.config['COVERS_PATH'] = previous
+    cover_store.init_app(app)
+
+
+@pytest.fixture
+def pillow():
+    pytest.importorskip('PIL')
+
+
+@pytest.fixture
+def no_pillow(monkeypatch):
+    monkeypatch.setattr(covers, 'Image', None)
+
+
+def test_fetch_stores_original_by_content_hash(store, server):
+    data = png(40, 60)
+    server.files['/a.png'] = server.files['/b.png'] = data
+    first = store.fetch(server.url('/a.png'))
+    # Та же картинка по другому адресу - тот же файл
+    assert store.fetch(server.url('/b.png')) == first
+    with open(store.path('original', first), 'rb') as file:
+        assert file.read() == data
+
+
+def test_failed_downloads_are_retried_later(store, server):
+    url = server.url('/missing.png')
+    assert store.fetch(url) is None
+    assert store.info()['errors'] == 1
+    # До истечения retry_after повторной загрузки нет
+    assert store.thumbnail(url, 'list') is None
+    store.drain()
+    assert server.requests == ['/missing.png']
+
+
+def test_rejects_non_images_and_oversized_files(store, server):
+    server.files['/page.html'] = b'<html></html>'
+    server.files['/big.png'] = png(10, 10) + b'\x00' * 2048
+    store.max_bytes = 1024
+    assert store.fetch(server.url('/page.html')) is None
+    assert store.fetch(server.url('/big.png')) is None
+    assert store.info()['stored'] == 0
+
+
+def test_thumbnails_are_resized_and_served(store, server, client, pillow):
+    from PIL import Image
+
+    server.files['/cover.png'] = png(600, 900)
+    url = server.url('/cover.png')
+    assert store.thumbnail(url, 'list') is None
+    store.drain()
+    size, digest = store.thumbnail(url, 'list')
+    with Image.open(store.path(size, digest)) as image:
+        assert image.size[0] <= store.sizes['list'][0] and image.size[1] <= store.sizes['list'][1]
+
+    response = client.get(f'/covers/{size}/{digest}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert len(response.data) < len(server.files['/cover.png'])
+
+
+def test_without_pillow_pages_use_remote_cover(store, server, client, no_pillow):
+    url = server.url('/cover.png')
+    server.files['/cover.png'] = png(600, 900)
+    with client.application.app_context():
+        db.session.add(Book(title='Обложка', author='Автор', cover_image_url=url))
+        db.session.commit()
+        db.session.remove()
+
+    assert store.thumbnail(url, 'list') is None
+    assert url in client.get('/books').get_data(as_text=True)
+    store.drain()
+    # Без Pillow ничего не скачивается и полноразмерные копии не подсовываются как миниатюры
+    assert server.requests == []
+    assert not os.path.exists(os.path.join(store.root, 'list'))
+
+
+def test_list_shows_remote_cover_until_cached(store, server, client, pillow):
+    url = server.url('/cover.png')
+    server.files['/cover.png'] = png(600, 900)
+    with client.application.app_context():
+        db.session.add(Book(title='Обложка', author='Автор', cover_image_url=url))
+        db.session.commit()
+        db.session.remove()
+
+    assert url in client.get('/books').get_data(as_text=True)
+    store.drain()
+    html = client.get('/books').get_data(as_text=True)
+    assert url not in html and '/covers/list/' in html
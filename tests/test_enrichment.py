@@ -0,0 +1,132 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import enrichment
+from models import db, Book, EnrichmentJob
+
+
+@pytest.fixture
+def books(app):
+    """Три книги с ISBN без метаданных: без задач, с 'not_found' и с 'failed'"""
+    with app.app_context():
+        ids = []
+        for number in range(3):
+            book = Book(title=f'Книга {number}', author='Автор', isbn=f'978000000000{number}')
+            db.session.add(book)
+            db.session.flush()
+            ids.append(book.id)
+        now = datetime.utcnow()
+        for book_id, job_status in zip(ids[1:], ('not_found', 'failed')):
+            db.session.add(EnrichmentJob(book_id=book_id, status=job_status, attempts=1,
+                                         next_attempt_at=now, created_at=now, updated_at=now))
+        db.session.commit()
+        db.session.remove()
+    return ids
+
+
+def pending_books(app):
+    with app.app_context():
+        ids = db.session.execute(db.select(EnrichmentJob.book_id)
+                                 .where(EnrichmentJob.status == 'pending')).scalars().all()
+        db.session.remove()
+    return sorted(ids)
+
+
+def test_enqueue_missing_skips_finished_jobs(app, books):
+    with app.app_context():
+        assert enrichment.enqueue_missing() == 1
+        db.session.commit()
+        # Повторный вызов не плодит задач
+        assert enrichment.enqueue_missing() == 0
+        db.session.commit()
+        db.session.remove()
+    assert pending_books(app) == books[:1]
+
+
+def test_enqueue_missing_retry(app, books):
+    with app.app_context():
+        assert enrichment.enqueue_missing(retry=True) == 3
+        db.session.commit()
+        db.session.remove()
+    assert pending_books(app) == books
+
+
+def test_enqueue_missing_after_backoff(app, books):
+    with app.app_context():
+        old = datetime.utcnow() - timedelta(seconds=enrichment.RETRY_FINISHED_AFTER + 60)
+        db.session.execute(db.update(EnrichmentJob).where(EnrichmentJob.book_id == books[1])
+                           .values(updated_at=old))
+        assert enrichment.enqueue_missing() == 2
+        db.session.commit()
+        db.session.remove()
+    assert pending_books(app) == books[:2]
+
+
+def test_enqueue_route_retry(client, books):
+    assert client.post('/enrichment/enqueue').status_code == 302
+    assert client.post('/enrichment/enqueue', data={'retry': '1'}).status_code == 302
+    assert pending_books(client.application) == books
+
+
+def job_state(app, book_id):
+    with app.app_context():
+        job = db.session.execute(db.select(EnrichmentJob).where(EnrichmentJob.book_id == book_id)
+                                 .order_by(EnrichmentJob.id.desc())).scalars().first()
+        book = db.session.get(Book, book_id)
+        state = job.status, job.attempts, job.last_error, book.publisher, book.page_count
+        db.session.remove()
+    return state
+
+
+def test_finish(app, books):
+    with app.app_context():
+        enrichment.enqueue(books)
+        db.session.commit()
+        jobs = enrichment.claim(10)
+        results = {
+            books[0]: ({'publisher': 'Наука', 'page_count': 320, 'publication_year': '1999'}, None),
+            books[1]: (None, None),
+            books[2]: (None, 'ConnectionError: timeout'),
+        }
+        for job_id, book_id, isbn, attempt in jobs:
+            enrichment.finish(job_id, book_id, attempt, *results[book_id])
+        db.session.commit()
+        db.session.remove()
+    assert job_state(app, books[0]) == ('done', 1, None, 'Наука', 320)
+    assert job_state(app, books[1]) == ('not_found', 1, None, None, None)
+    assert job_state(app, books[2]) == ('pending', 1, 'ConnectionError: timeout', None, None)
+
+
+def test_finish_gives_up_after_max_attempts(app, books):
+    with app.app_context():
+        enrichment.enqueue(books[:1])
+        db.session.commit()
+        job_id, book_id, _, _ = enrichment.claim(1)[0]
+        enrichment.finish(job_id, book_id, enrichment.MAX_ATTEMPTS, None, 'HTTPError: 503')
+        db.session.commit()
+        db.session.remove()
+    assert job_state(app, books[0])[0] == 'failed'
+
+
+def test_run_worker_looks_up_without_write_lock(app, books, monkeypatch):
+    with app.app_context():
+        enrichment.enqueue(books)
+        db.session.commit()
+        writer_pool = db.engine.pool
+        db.session.remove()
+    checked_out = []
+
+    def lookup(isbn):
+        # Первый ответ быстрый, остальные медленные: результаты не записываются, пока ждем сеть
+        if not isbn.endswith('0'):
+            time.sleep(0.1)
+        checked_out.append(writer_pool.checkedout())
+        return {'publisher': f'Издательство {isbn[-1]}'}, None
+
+    monkeypatch.setattr(enrichment, '_lookup', lookup)
+    assert enrichment.run_worker(app, workers=2, rate=1000, once=True, log=lambda message: None) == 3
+    assert checked_out == [0, 0, 0]
+    assert [job_state(app, book_id)[:1] + job_state(app, book_id)[3:4] for book_id in books] == [
+        ('done', f'Издательство {number}') for number in range(3)]
@@ -0,0 +1,104 @@
+import pytest
+
+from facets import facet_cache, _load_facet, FACETS, MemoryFacetBackend, SQLiteFacetBackend
+from models import db, Book
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, app, tmp_path):
+    """Кэш фильтров на каждом из хранилищ; после теста возвращается прежнее"""
+    previous = facet_cache.backend
+    if request.param == 'memory':
+        facet_cache.backend = MemoryFacetBackend()
+    else:
+        facet_cache.backend = SQLiteFacetBackend(str(tmp_path / 'facets.db'))
+    yield facet_cache.backend
+    facet_cache.backend = previous
+
+
+def assert_counts_fresh(app):
+    """Счетчики из кэша совпадают с пересчетом по базе"""
+    with app.app_context():
+        for facet in FACETS:
+            assert facet_cache.counts(facet) == _load_facet(facet), facet
+        db.session.remove()
+
+
+def load_cache(app):
+    with app.app_context():
+        for facet in FACETS:
+            facet_cache.counts(facet)
+        db.session.remove()
+
+
+def add_book(client, title, author, genre, tags, status='не начата'):
+    response = client.post('/book/add', data={'title': title, 'author': author, 'genre': genre, 'tags': tags,
+                                              'reading_status': status, 'confirm_duplicates': '1'})
+    assert response.status_code == 302
+
+
+def book_id(app, title):
+    with app.app_context():
+        found = db.session.execute(db.select(Book.id).where(Book.title == title)).scalar_one()
+        db.session.remove()
+    return found
+
+
+def test_add_edit_delete_keep_counts(app, client, backend):
+    add_book(client, 'Война и мир', 'Лев Толстой', 'Роман', 'классика, война')
+    load_cache(app)
+
+    add_book(client, 'Анна Каренина', 'Лев Толстой', 'Роман', 'классика')
+    add_book(client, 'Пикник на обочине', 'Стругацкие', 'Фантастика', 'фантастика', status='читаю')
+    assert_counts_fresh(app)
+    assert facet_cache.counts('author')['Лев Толстой'] == 2
+
+    edited = book_id(app, 'Анна Каренина')
+    response = client.post(f'/book/{edited}/edit', data={
+        'title': 'Анна Каренина', 'author': 'Толстой Л. Н.', 'genre': 'Драма', 'tags': 'любовь',
+        'reading_status': 'прочитана', 'language': 'Russian'})
+    assert response.status_code == 302
+    assert_counts_fresh(app)
+    assert facet_cache.counts('genre') == {'Роман': 1, 'Драма': 1, 'Фантастика': 1}
+    assert 'классика' in facet_cache.counts('tag') and 'любовь' in facet_cache.counts('tag')
+
+    response = client.post(f"/book/{book_id(app, 'Война и мир')}/delete")
+    assert response.status_code == 302
+    assert_counts_fresh(app)
+    assert 'Лев Толстой' not in facet_cache.counts('author')
+    assert 'классика' not in facet_cache.counts('tag')
+
+
+def test_bulk_operations_keep_counts(app, client, backend):
+    for number in range(5):
+        add_book(client, f'Книга {number}', f'Автор {number % 2}', 'Роман', 'общий')
+    load_cache(app)
+    ids = [book_id(app, f'Книга {number}') for number in range(5)]
+
+    client.post('/books/bulk_operations', data={'book_ids': ids[:3], 'operation': 'change_status',
+                                                'new_status': 'прочитана'})
+    assert_counts_fresh(app)
+    assert facet_cache.counts('reading_status') == {'прочитана': 3, 'не начата': 2}
+
+    client.post('/books/bulk_operations', data={'book_ids': ids[:2], 'operation': 'add_tag', 'new_tag': 'избранное'})
+    assert_counts_fresh(app)
+    assert facet_cache.counts('tag')['избранное'] == 2
+
+    client.post('/books/bulk_operations', data={'book_ids': ids, 'operation': 'remove_tag', 'new_tag': 'общий'})
+    assert_counts_fresh(app)
+    assert 'общий' not in facet_cache.counts('tag')
+
+    client.post('/books/bulk_operations', data={'book_ids': ids[3:], 'operation': 'delete'})
+    assert_counts_fresh(app)
+    assert sum(facet_cache.counts('author').values()) == 3
+
+
+def test_rollback_does_not_change_counts(app, backend):
+    load_cache(app)
+    with app.app_context():
+        db.session.add(Book(title='Черновик', author='Никто', genre='Роман'))
+        db.session.flush()
+        db.session.rollback()
+        db.session.remove()
+    assert_counts_fresh(app)
+    assert facet_cache.counts('author') == {}
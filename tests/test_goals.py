@@ -0,0 +1,26 @@
+import pytest
+
+from models import db, ReadingGoal
+
+
+def goal_count(app):
+    with app.app_context():
+        count = db.session.query(ReadingGoal).count()
+        db.session.remove()
+    return count
+
+
+@pytest.mark.parametrize('year, target', [('2026', '0'), ('2026', '-5'), ('2026', ''), ('', '10'), ('двадцать', '10')])
+def test_invalid_goal_is_rejected(client, year, target):
+    response = client.post('/goals', data={'year': year, 'goal_type': 'books', 'target': target},
+                           follow_redirects=True)
+    assert response.status_code == 200
+    assert 'цель - больше нуля' in response.get_data(as_text=True)
+    assert goal_count(client.application) == 0
+
+
+def test_goal_is_added(client):
+    response = client.post('/goals', data={'year': '2026', 'goal_type': 'pages', 'target': '5000'},
+                           follow_redirects=True)
+    assert response.status_code == 200
+    assert goal_count(client.application) == 1
@@ -0,0 +1,108 @@
+import io
+import json
+
+import pytest
+
+import importer
+from models import db, Book
+
+EXISTING_ISBN = '9785170902347'
+
+
+@pytest.fixture
+def library(app):
+    """Одна книга до импорта"""
+    with app.app_context():
+        db.session.add(Book(title='Анна Каренина', author='Толстой Лев', isbn=EXISTING_ISBN, genre='Роман'))
+        db.session.commit()
+        db.session.remove()
+
+
+def post_import(client, content, file_format):
+    data = {'file': (io.BytesIO(content.encode('utf-8')), f'books.{file_format}')}
+    response = client.post('/import', data=data, headers={'Accept': 'application/json'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def books(app):
+    with app.app_context():
+        rows = [(book.id, book.title, book.author, book.tag_names)
+                for book in Book.query.order_by(Book.id)]
+        db.session.remove()
+    return rows
+
+
+RECORDS = [
+    {'title': 'Война и мир', 'author': 'Толстой Лев', 'isbn': '978-5-17-090234-7'},
+    {'title': 'Мастер и Маргарита', 'author': 'Булгаков Михаил', 'isbn': '9785170878956',
+     'tags': ['классика', 'мистика'], 'description': 'Роман о дьяволе в Москве', 'reading_status': 'прочитана',
+     'page_count': 480, 'my_rating': 10, 'date_finished_reading': '2025-05-01'},
+    {'title': 'Собачье сердце', 'author': 'Булгаков Михаил', 'isbn': '978-5-17-087895-6'},
+    {'title': 'Белая гвардия', 'author': 'Булгаков М.', 'tags': 'классика', 'genre': 'Роман'},
+    {'author': 'Без названия'},
+    {'title': 'Плохой рейтинг', 'author': 'Кто-то', 'my_rating': 42},
+]
+
+
+def test_import_json(client, library, derived_consistent):
+    report = post_import(client, json.dumps(RECORDS, ensure_ascii=False), 'json')
+    assert report['imported'] == 2
+    assert report['duplicates'] == 2
+    # ISBN уже в библиотеке - ссылка на книгу, повтор в файле - без неё
+    assert [(row['row'], row['book_id']) for row in report['duplicate_rows']] == [(1, 1), (3, None)]
+    assert [row['row'] for row in report['errors']] == [5, 6]
+    assert {'author': 'Булгаков М.', 'similar': ['Булгаков Михаил']} in report['author_aliases']
+    # id идут подряд после последней книги
+    assert books(client.application) == [
+        (1, 'Анна Каренина', 'Толстой Лев', ''),
+        (2, 'Мастер и Маргарита', 'Булгаков Михаил', 'классика, мистика'),
+        (3, 'Белая гвардия', 'Булгаков М.', 'классика'),
+    ]
+    with client.application.app_context():
+        assert [book.author_rel.name for book in Book.query.filter(Book.id > 1).order_by(Book.id)] == [
+            'Булгаков Михаил', 'Булгаков М.']
+        db.session.remove()
+    derived_consistent()
+    html = client.get('/search?q=дьявол').get_data(as_text=True)
+    assert 'Мастер и Маргарита' in html
+    html = client.get('/search?q=мистика').get_data(as_text=True)
+    assert 'Мастер и Маргарита' in html and 'Белая гвардия' not in html
+
+
+def test_import_batches(client, library, derived_consistent, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'IMPORT_BATCH_SIZE', 2)
+    lines = [json.dumps({'title': f'Книга {number}', 'author': f'Автор {number % 3}', 'tags': [f'тег{number % 2}']},
+                        ensure_ascii=False) for number in range(7)]
+    report = post_import(client, '\n'.join(lines), 'ndjson')
+    assert report['imported'] == 7 and report['failed'] == 0
+    assert [row[0] for row in books(client.application)] == list(range(1, 9))
+    derived_consistent()
+
+
+def test_csv_round_trip(client, library, derived_consistent):
+    post_import(client, json.dumps(RECORDS[1:4], ensure_ascii=False), 'json')
+    exported = client.get('/export/csv').get_data(as_text=True)
+    before = [row[1:] for row in books(client.application)]
+
+    response = client.post('/books/bulk_operations', data={'operation': 'delete', 'select_all': '1'})
+    assert response.status_code == 302
+    assert books(client.application) == []
+    derived_consistent()
+
+    report = post_import(client, exported, 'csv')
+    assert report['imported'] == 3 and report['failed'] == 0
+    assert sorted(row[1:] for row in books(client.application)) == sorted(before)
+    derived_consistent()
+
+
+def test_normalize_record_defaults():
+    book, tags = importer.normalize_record({'title': ' Дар ', 'author': 'Набоков', 'isbn': '5-17-090234-4',
+                                            'tags': 'проза, проза, эмиграция', 'reading_status': 'прочитана',
+                                            'page_count': '400'})
+    assert book['title'] == 'Дар'
+    assert book['language'] == 'Russian'
+    assert book['current_page'] == 400
+    assert book['isbn_normalized'] == EXISTING_ISBN
+    assert tags == ['проза', 'эмиграция']
@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import book_api
+
+WAR_AND_PEACE = '9785170902347'
+UNKNOWN = '9785170902354'
+
+
+def isbn13(number):
+    """Корректный ISBN-13 с номером number"""
+    digits = f'978{number:09d}'
+    check = -sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10
+    return f'{digits}{check}'
+
+
+class OpenLibraryStub(ThreadingHTTPServer):
+    """Локальная замена /api/books Open Library: книги из self.books, счетчик запросов"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.books = {WAR_AND_PEACE: {'title': 'Война и мир', 'authors': [{'name': 'Лев Толстой'}],
+                                      'number_of_pages': 1300}}
+        self.requests = []
+        self.delay = 0
+        self.status = 200
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        key = parse_qs(urlparse(self.path).query)['bibkeys'][0]
+        with server._lock:
+            server.requests.append(key.split(':', 1)[1])
+        time.sleep(server.delay)
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        isbn = key.split(':', 1)[1]
+        body = json.dumps({key: server.books[isbn]} if isbn in server.books else {}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(tmp_path):
+    """Поиск ISBN только через заглушку Open Library, кэш во временном файле"""
+    server = OpenLibraryStub()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    saved = dict(book_api.settings)
+    book_api.configure(cache_path=str(tmp_path / 'isbn_cache.db'), openlibrary_url=server.url,
+                       sources=('openlibrary',), rate_limits={}, hit_ttl=3600, miss_ttl=3600)
+    yield server
+    server.shutdown()
+    server.server_close()
+    book_api.configure(**saved)
+
+
+def test_found_book_is_cached(stub):
+    book = book_api.get_book_by_isbn(WAR_AND_PEACE)
+    assert book['title'] == 'Война и мир' and book['page_count'] == 1300
+    # Другая запись того же ISBN - тот же ключ кэша
+    assert book_api.get_book_by_isbn('978-5-17-090234-7') == book
+    assert book_api.get_book_by_isbn('5-17-090234-4') == book
+    assert stub.requests == [WAR_AND_PEACE]
+    assert book_api.cache_stats()['hits'] == 2
+
+
+def test_cache_survives_restart(stub):
+    book_api.get_book_by_isbn(WAR_AND_PEACE)
+    # configure пересоздает кэш: LRU пустой, запись читается из SQLite
+    book_api.configure(openlibrary_url=stub.url)
+    assert book_api.get_book_by_isbn(WAR_AND_PEACE)['title'] == 'Война и мир'
+    assert stub.requests == [WAR_AND_PEACE]
+
+
+def test_missing_book_is_cached_negatively(stub):
+    assert book_api.get_book_by_isbn(UNKNOWN) is None
+    assert book_api.get_book_by_isbn(UNKNOWN) is None
+    assert stub.requests == [UNKNOWN]
+    assert book_api.cache_stats()['negative_hits'] == 1
+
+
+def test_expired_entries_are_fetched_again(stub):
+    book_api.configure(miss_ttl=0)
+    book_api.get_book_by_isbn(UNKNOWN)
+    book_api.get_book_by_isbn(UNKNOWN)
+    assert stub.requests == [UNKNOWN, UNKNOWN]
+
+
+def test_errors_are_not_cached(stub):
+    stub.status = 503
+    assert book_api.get_book_by_isbn(WAR_AND_PEACE) is None
+    with pytest.raises(Exception):
+        book_api.get_book_by_isbn(WAR_AND_PEACE, raise_errors=True)
+    assert book_api.cache_stats()['errors'] == 2
+
+    stub.status = 200
+    assert book_api.get_book_by_isbn(WAR_AND_PEACE)['title'] == 'Война и мир'
+    assert len(stub.requests) == 3
+
+
+def test_invalid_isbn_is_not_requested(stub):
+    assert book_api.get_book_by_isbn('12345') is None
+    assert stub.requests == []
+
+
+def test_batch_lookup_runs_concurrently(client, stub):
+    stub.delay = 0.2
+    isbns = ['978-5-17-090234-7', WAR_AND_PEACE, 'не isbn'] + [isbn13(n) for n in range(20)]
+    valid, invalid = book_api.prepare_isbns(isbns)
+    started = time.monotonic()
+    response = client.post('/book/search_isbn/batch', json={'isbns': isbns})
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['results'][WAR_AND_PEACE]['title'] == 'Война и мир'
+    assert set(data['results']) == set(valid)
+    assert data['invalid'] == invalid
+    assert sorted(stub.requests) == sorted(valid)
+    # Последовательно было бы len(valid) * 0.2 с
+    assert elapsed < len(valid) * stub.delay / 2
+
+
+def test_batch_lookup_streams_ndjson(client, stub):
+    response = client.post('/book/search_isbn/batch?stream=1', json={'isbns': [WAR_AND_PEACE, UNKNOWN, 'x']})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0] == {'isbn': 'x', 'error': 'Некорректный ISBN'}
+    assert {line['isbn']: line['book'] for line in lines[1:]} == {
+        WAR_AND_PEACE: book_api.get_book_by_isbn(WAR_AND_PEACE), UNKNOWN: None}
+
+
+def test_batch_limit(client, stub, app):
+    isbns = [isbn13(n) for n in range(app.config['ISBN_BATCH_LIMIT'] + 1)]
+    response = client.post('/book/search_isbn/batch', json={'isbns': isbns})
+    assert response.status_code == 400
+    assert stub.requests == []
@@ -0,0 +1,21 @@
+import pytest
+
+from conftest import flask_app, reset_database
+from datagen import generate_library
+from models import db
+from query_plans import check_query_plans, PLAN_CHECKS
+
+
+@pytest.fixture(scope='module')
+def library():
+    # Небольшая синтетическая библиотека: страницам из PLAN_CHECKS нужны книги, авторы, сессии и цели
+    reset_database()
+    with flask_app.app_context():
+        generate_library(books=500, sessions=3000)
+        db.session.remove()
+    return flask_app
+
+
+@pytest.mark.parametrize('url, allowed', PLAN_CHECKS, ids=[url for url, _ in PLAN_CHECKS])
+def test_page_has_no_unexpected_full_scans(library, url, allowed):
+    assert check_query_plans(library, db, [(url, allowed)]) == []
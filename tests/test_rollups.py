@@ -0,0 +1,57 @@
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from models import db, Book, ReadingSession
+from rollups import check_rollups, rebuild_rollups, reading_activity, rollup_total
+
+
+def add_library(app):
+    with app.app_context():
+        for number in range(3):
+            book = Book(title=f'Книга {number}', author='Автор', genre='Роман', page_count=200, my_rating=8)
+            db.session.add(book)
+            db.session.flush()
+            db.session.add(ReadingSession(book_id=book.id, start_time=datetime(2026, 3, 1 + number, 10),
+                                          pages_read=20, duration_minutes=40))
+        db.session.commit()
+        db.session.remove()
+
+
+def test_orm_changes_keep_rollups(app):
+    add_library(app)
+    with app.app_context():
+        book = db.session.get(Book, 1)
+        book.genre = 'Поэзия'
+        book.my_rating = None
+        db.session.get(ReadingSession, 2).pages_read = 50
+        db.session.delete(db.session.get(Book, 3))
+        db.session.commit()
+        assert check_rollups(db.session.connection()) == []
+        assert rollup_total().books == 2
+        assert reading_activity(date(2026, 3, 1), date(2026, 3, 31))['pages'] == [20, 50]
+        db.session.remove()
+
+
+def test_rebuild_and_check_round_trip(app):
+    add_library(app)
+    runner = app.test_cli_runner()
+    assert 'согласована' in runner.invoke(args=['rollups', 'check']).output
+    with app.app_context():
+        db.session.execute(text("UPDATE stat_rollups SET pages = pages + 7 WHERE dimension = 'day'"))
+        db.session.execute(text("DELETE FROM stat_rollups WHERE dimension = 'genre'"))
+        db.session.commit()
+        problems = check_rollups(db.session.connection())
+        assert len(problems) == 4
+        assert problems[-1] == {'row': ('genre', 'Роман'), 'stored': None, 'actual': problems[-1]['actual']}
+        db.session.remove()
+
+    result = runner.invoke(args=['rollups', 'check'])
+    assert result.exit_code != 0 and 'Расхождений: 4' in str(result.exception)
+    assert 'пересобрана' in runner.invoke(args=['rollups', 'rebuild']).output
+    with app.app_context():
+        assert check_rollups(db.session.connection()) == []
+        rebuild_rollups(db.session.connection())
+        assert check_rollups(db.session.connection()) == []
+        db.session.rollback()
+        db.session.remove()
@@ -0,0 +1,72 @@
+import pytest
+
+import search
+from models import db, Book
+from search import search_books
+
+
+@pytest.fixture
+def books(app):
+    with app.app_context():
+        db.session.add(Book(title='Море', author='Иван Иванов', genre='Поэзия'))
+        for number in range(3):
+            db.session.add(Book(title=f'Повесть {number}', author='Пётр Петров', genre='Проза',
+                                description='Долгая дорога к морю'))
+        db.session.add(Book(title='Ёлка', author='Фёдор Сологуб', genre='Проза', notes='прочитать зимой'))
+        db.session.commit()
+        db.session.remove()
+
+
+def titles(hits):
+    return sorted(hit.book.title for hit in hits)
+
+
+def test_search_matches_prefixes_and_yo(app, books):
+    with app.app_context():
+        hits, has_next, narrowed = search_books(Book.query, 'елк')
+        assert titles(hits) == ['Ёлка'] and not has_next and not narrowed
+        assert str(hits[0].title).startswith('<mark>')
+        assert titles(search_books(Book.query, 'федор зим')[0]) == ['Ёлка']
+        assert search_books(Book.query, '!!!') == ([], False, False)
+        db.session.remove()
+
+
+def test_search_respects_catalog_filters(app, books):
+    with app.app_context():
+        hits, _, _ = search_books(Book.query.filter(Book.genre == 'Поэзия'), 'мор')
+        assert titles(hits) == ['Море']
+        db.session.remove()
+
+
+def test_search_pages(app, books):
+    with app.app_context():
+        first, has_next, _ = search_books(Book.query, 'мор', limit=3)
+        second, has_next_second, _ = search_books(Book.query, 'мор', limit=3, offset=3)
+        assert has_next and not has_next_second
+        assert titles(first + second) == ['Море', 'Повесть 0', 'Повесть 1', 'Повесть 2']
+        db.session.remove()
+
+
+def test_broad_query_is_narrowed_and_flagged(app, books, monkeypatch):
+    monkeypatch.setattr(search, 'BROAD_QUERY_LIMIT', 2)
+    with app.app_context():
+        hits, _, narrowed = search_books(Book.query, 'мор')
+        assert narrowed and titles(hits) == ['Море']
+        hits, _, narrowed = search_books(Book.query, 'мор', all_columns=True)
+        assert not narrowed and len(hits) == 4
+        # Совпадений только в описаниях: сужать некуда, ищем по всем колонкам
+        hits, _, narrowed = search_books(Book.query, 'дорог')
+        assert not narrowed and len(hits) == 3
+        # Кандидаты считаются с фильтрами каталога
+        hits, _, narrowed = search_books(Book.query.filter(Book.title.in_(['Море', 'Повесть 0'])), 'мор')
+        assert not narrowed and titles(hits) == ['Море', 'Повесть 0']
+        db.session.remove()
+
+
+def test_search_page_shows_narrowing(client, books, monkeypatch):
+    monkeypatch.setattr(search, 'BROAD_QUERY_LIMIT', 2)
+    html = client.get('/search?q=мор').get_data(as_text=True)
+    assert 'показаны только совпадения в названии' in html and 'Повесть' not in html
+    html = client.get('/search?q=мор&all=1').get_data(as_text=True)
+    assert 'показаны только совпадения' not in html and 'Повесть 2' in html
+    assert client.get('/api/search?q=мор').get_json()['narrowed'] is True
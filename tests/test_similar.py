@@ -0,0 +1,75 @@
+import pytest
+
+from models import db, Book, BookSimilarity, similarity_queue
+from similar import similar_index, FeatureIndex
+
+
+@pytest.fixture
+def books(app):
+    """Шесть книг двух жанров, очередь похожих книг разобрана"""
+    with app.app_context():
+        for number in range(6):
+            db.session.add(Book(title=f'Книга {number}', author='Автор', genre='Поэзия' if number < 3 else 'Проза'))
+        db.session.commit()
+        while similar_index.process_queue():
+            pass
+        ids = db.session.execute(db.select(Book.id).order_by(Book.id)).scalars().all()
+        db.session.remove()
+    return ids
+
+
+def neighbors(app, book_id):
+    with app.app_context():
+        found = db.session.execute(db.select(BookSimilarity.similar_id).where(BookSimilarity.book_id == book_id)
+                                   .order_by(BookSimilarity.rank)).scalars().all()
+        db.session.remove()
+    return found
+
+
+def queued(app):
+    with app.app_context():
+        found = db.session.execute(db.select(similarity_queue.c.book_id)).scalars().all()
+        db.session.remove()
+    return sorted(found)
+
+
+def test_process_queue(app, books):
+    assert neighbors(app, books[0])[:2] == books[1:3]
+    with app.app_context():
+        db.session.get(Book, books[5]).genre = 'Поэзия'
+        db.session.commit()
+        assert similar_index.process_queue() == 1
+        db.session.remove()
+    assert books[5] in neighbors(app, books[0])[:3]
+    assert queued(app) == []
+
+
+def test_process_queue_computes_without_transaction(app, books, monkeypatch):
+    with app.app_context():
+        writer_pool = db.engine.pool
+        db.session.get(Book, books[5]).genre = 'Поэзия'
+        db.session.commit()
+        db.session.remove()
+    checked_out = []
+    original = FeatureIndex.neighbors
+
+    def compute(index, book_id, k=10):
+        if not checked_out:
+            checked_out.append(writer_pool.checkedout())
+            # Книгу снова меняют, пока считаются соседи: строка очереди та же
+            db.session.get(Book, books[5]).language = 'en'
+            db.session.commit()
+        return original(index, book_id, k)
+
+    monkeypatch.setattr(FeatureIndex, 'neighbors', compute)
+    with app.app_context():
+        assert similar_index.process_queue() == 1
+        db.session.remove()
+    assert checked_out == [0]
+    # Изменение за время расчета не потеряно: книга осталась в очереди
+    assert queued(app) == [books[5]]
+    monkeypatch.setattr(FeatureIndex, 'neighbors', original)
+    with app.app_context():
+        assert similar_index.process_queue() == 1
+        db.session.remove()
+    assert queued(app) == []
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import storage
+from models import db, Book
+
+# Второй процесс с тем же каталогом instance: пишет в ту же базу одновременно с тестом
+STRESS_SCRIPT = '''
+import json
+import storage
+from app import app
+from models import db
+print(json.dumps(storage.stress_test(app, db, seconds={seconds}, readers=2, writers=2)))
+'''
+
+
+def test_pragmas_applied(app):
+    with app.app_context():
+        writer = storage.effective_pragmas(app, db)
+        reader = storage.effective_pragmas(app, db, storage.READ_BIND)
+    assert writer['journal_mode'] == 'wal'
+    assert writer['query_only'] == 0
+    assert reader['query_only'] == 1
+    assert writer['busy_timeout'] == reader['busy_timeout'] == 5000
+
+
+def test_reads_are_routed_to_read_pool(app):
+    with app.app_context():
+        reader = db.engines[storage.READ_BIND]
+        db.session.info['read_only'] = True
+        assert db.session.get_bind(clause=select(Book.id)) is reader
+        assert db.session.get_bind(clause=text('SELECT 1')) is reader
+        db.session.info['read_only'] = False
+        # Вне GET чтения тоже идут в пул чтения, пока сессия ничего не записала
+        assert db.session.get_bind(clause=select(Book.id)) is reader
+        assert db.session.get_bind(clause=text('SELECT 1')) is db.engine
+        db.session.remove()
+
+
+def test_session_takes_writer_only_for_writes(app):
+    with app.app_context():
+        db.session.execute(select(Book.id)).all()
+        assert db.engine.pool.checkedout() == 0
+        # Пока сессия только читала, соединение писателя свободно
+        with db.engine.connect() as conn:
+            conn.execute(select(Book.id)).all()
+        db.session.add(Book(title='Книга', author='Автор'))
+        db.session.flush()
+        assert db.engine.pool.checkedout() == 1
+        # После записи чтения идут писателю и видят незакоммиченное
+        assert db.session.get_bind(clause=select(Book.id)) is db.engine
+        assert db.session.execute(select(Book.title)).scalar() == 'Книга'
+        db.session.commit()
+        assert db.engine.pool.checkedout() == 0
+        assert db.session.get_bind(clause=select(Book.id)) is db.engines[storage.READ_BIND]
+        db.session.remove()
+
+
+def test_pool_timeout_is_retried(app):
+    calls = []
+
+    @storage.retry_on_busy
+    def view():
+        calls.append(1)
+        if len(calls) == 1:
+            raise PoolTimeoutError('QueuePool limit of size 1 overflow 0 reached')
+        return 'ok'
+
+    with app.app_context():
+        assert view() == 'ok'
+    assert len(calls) == 2
+
+
+def test_concurrent_reads_and_writes_in_process(app):
+    stats = storage.stress_test(app, db, seconds=1.0, readers=4, writers=2)
+    assert stats['reads'] > 0 and stats['writes'] > 0
+    assert stats['read_errors'] == stats['write_errors'] == 0
+
+
+def test_write_contention_between_processes(app):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    other = subprocess.Popen([sys.executable, '-c', STRESS_SCRIPT.format(seconds=2.0)], env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        # Дольше второго процесса: он сначала импортирует приложение
+        stats = storage.stress_test(app, db, seconds=3.0, readers=2, writers=2)
+    finally:
+        output, errors = other.communicate(timeout=60)
+    assert other.returncode == 0, errors
+    other_stats = json.loads(output.strip().splitlines()[-1])
+    for result in (stats, other_stats):
+        assert result['writes'] > 0
+        assert result['read_errors'] == result['write_errors'] == 0
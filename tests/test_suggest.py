@@ -0,0 +1,78 @@
+import os
+import sqlite3
+
+from sqlalchemy import insert
+
+from models import db, Book
+from suggest import PrefixIndex, suggest_index
+
+
+def test_whole_value_matches_come_first():
+    # Двадцать значений, где "тол" - начало второго слова, идут в ключах раньше "толстой"
+    counts = {f'Автор Тол{number}': 1 for number in range(20)}
+    counts.update({'Толстой Лев': 1, 'Толстая Татьяна': 1})
+    index = PrefixIndex(counts)
+    assert index.search('тол', 3) == ['Толстая Татьяна', 'Толстой Лев', 'Автор Тол0']
+
+
+def test_case_and_yo_are_ignored(app):
+    with app.app_context():
+        db.session.add(Book(title='Ёлка', author='Фёдор Сологуб'))
+        db.session.commit()
+        assert suggest_index.suggest('title', 'ЕЛ') == ['Ёлка']
+        assert suggest_index.suggest('author', 'федор') == ['Фёдор Сологуб']
+        db.session.remove()
+
+
+def test_author_filter_accepts_partial_names(app, client):
+    with app.app_context():
+        for title, author in (('Война и мир', 'Лев Толстой'), ('Аэлита', 'Алексей Толстой'),
+                              ('Идиот', 'Фёдор Достоевский')):
+            db.session.add(Book(title=title, author=author))
+        db.session.commit()
+        db.session.remove()
+
+    html = client.get('/books?author=тол').get_data(as_text=True)
+    assert 'Война и мир' in html and 'Аэлита' in html and 'Идиот' not in html
+    # Имя из подсказки целиком - только этот автор
+    html = client.get('/books?author=Лев Толстой').get_data(as_text=True)
+    assert 'Война и мир' in html and 'Аэлита' not in html
+    assert 'Идиот' not in client.get('/books?author=нет такого').get_data(as_text=True)
+
+
+def test_author_filter_sees_other_processes(app, client):
+    with app.app_context():
+        db.session.add(Book(title='Аэлита', author='Алексей Толстой'))
+        db.session.commit()
+        assert suggest_index.suggest('author', 'тол') == ['Алексей Толстой']
+        db.session.remove()
+    # Запись в обход сессии, как из другого процесса: индекс подсказок о ней не знает
+    with sqlite3.connect(os.path.join(app.instance_path, 'library.db')) as conn:
+        conn.execute("INSERT INTO books (title, author) VALUES ('Война и мир', 'Лев Толстой')")
+    html = client.get('/books?author=тол').get_data(as_text=True)
+    assert 'Война и мир' in html and 'Аэлита' in html
+
+
+def test_author_filter_with_many_matching_authors(app, client):
+    with app.app_context():
+        db.session.execute(insert(Book), [{'title': f'Книга {number}', 'author': f'Автор {number}'}
+                                          for number in range(1500)])
+        db.session.commit()
+        db.session.remove()
+    response = client.get('/books?author=авт&count=1')
+    assert response.status_code == 200
+
+
+def test_index_follows_edits(app):
+    with app.app_context():
+        book = Book(title='Черновик', author='Автор', publisher='Мелик')
+        db.session.add(book)
+        db.session.commit()
+        assert suggest_index.suggest('publisher', 'мел') == ['Мелик']
+        book.publisher = 'Речь'
+        db.session.commit()
+        assert suggest_index.suggest('publisher', 'мел') == []
+        db.session.delete(book)
+        db.session.commit()
+        assert suggest_index.suggest('publisher', 'реч') == []
+        db.session.remove()